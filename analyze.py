@@ -1,16 +1,34 @@
 import os
-import matplotlib.pyplot as plt
-import seaborn as sns
 
 import data_loader
+import rollup
 import utils
 
-sns.set(color_codes=True)
+
+_plt = None
+
+
+def get_plt():
+    """按需加载作图库 (加载耗时较长，仅作图时才需要)"""
+    global _plt
+    if _plt is None:
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+        sns.set(color_codes=True)
+        _plt = plt
+    return _plt
+
+
+# 以下分桶函数既可读取分钟数据 (`data_loader.Data`)，也可直接读取小时汇总表 (`rollup.Table`)：
+# 汇总表的每一行对应一个小时，返回该小时内分钟值之和与分钟数，统计结果与逐分钟计算一致
 
 
 def get_price_change_by_hour(data, i):
     """获取基于小时的价格变动"""
-    v = data.prices[i] / data.prices[i - 1] - 1
+    if isinstance(data, rollup.Table):
+        v = data.return_sum[i], data.minutes[i]
+    else:
+        v = data.prices[i] / data.prices[i - 1] - 1
     time_triplet = utils.tic2time(data.tics[i]).split()[-1].split(":")
     bucket_id = time_triplet[0]
     return bucket_id, v
@@ -18,7 +36,10 @@ def get_price_change_by_hour(data, i):
 
 def get_price_change_by_weekday(data, i):
     """获取基于天的价格变动"""
-    v = data.prices[i] / data.prices[i - 1] - 1
+    if isinstance(data, rollup.Table):
+        v = data.return_sum[i], data.minutes[i]
+    else:
+        v = data.prices[i] / data.prices[i - 1] - 1
     tic = data.tics[i]
 
     # 基于2000年1月1日 (星期六) 计算是星期几
@@ -31,7 +52,10 @@ def get_price_change_by_weekday(data, i):
 
 def get_volume_by_hour(data, i):
     """获取基于小时的交易量变动"""
-    v = data.volumes[i]
+    if isinstance(data, rollup.Table):
+        v = data.quote_volume[i], data.minutes[i]
+    else:
+        v = data.volumes[i]
     time_triplet = utils.tic2time(data.tics[i]).split()[-1].split(":")
     bucket_id = time_triplet[0]
     return bucket_id, v
@@ -39,7 +63,10 @@ def get_volume_by_hour(data, i):
 
 def get_volume_by_weekday(data, i):
     """获取基于天的交易量变动"""
-    v = data.volumes[i]
+    if isinstance(data, rollup.Table):
+        v = data.quote_volume[i], data.minutes[i]
+    else:
+        v = data.volumes[i]
     tic = data.tics[i]
 
     # 基于2000年1月1日 (星期六) 计算是星期几
@@ -54,24 +81,27 @@ def statistics(f, data, start_timestamp, end_timestamp):
     """获取排行分布"""
 
     # 根据计量单位分桶
-    buckets = {}
-    for i in range(1, len(data.prices)):
+    buckets = {}    # bucket_id -> [和, 数量]
+    first = 0 if isinstance(data, rollup.Table) else 1    # 分钟数据的首行没有涨跌幅
+    for i in range(first, len(data.tics)):
         tic = data.tics[i]
         if tic / 1000 < start_timestamp or tic / 1000 > end_timestamp:    # 超出数据范围
             continue
 
-        # 获取bucket_id和取值
+        # 获取bucket_id和取值 (汇总表为取值之和与数量)
         bucket_id, v = f(data, i)
+        v, n = v if isinstance(v, tuple) else (v, 1)
 
         # 注入桶中
         if bucket_id not in buckets:
-            buckets[bucket_id] = []
-        buckets[bucket_id].append(v)
+            buckets[bucket_id] = [0, 0]
+        buckets[bucket_id][0] += v
+        buckets[bucket_id][1] += n
 
     # 桶数据汇总
     sorting_items = []
-    for bucket_id, v in buckets.items():
-        v = sum(v) / len(v)    # 取均值
+    for bucket_id, (v, n) in buckets.items():
+        v = v / n    # 取均值
         sorting_items.append((bucket_id, v))
 
     # 排序
@@ -83,7 +113,7 @@ def statistics(f, data, start_timestamp, end_timestamp):
     # 作图
     x = list(sorted(indices.keys()))
     y = [indices[bucket_id] for bucket_id in x]
-    plt.plot(x, y)
+    get_plt().plot(x, y)
     # plt.scatter(x, y)
 
 
@@ -93,16 +123,17 @@ if __name__ == "__main__":
     start_timestamp = utils.time2tic(2021, 7, 1, 0, 0, 0)
     end_timestamp = utils.time2tic(2021, 11, 1, 23, 59, 59)
 
+    plt = get_plt()
     plt.figure()
     for symbol in data_loader.COINS[:50]:
 
-        # 读取数据
+        # 读取数据 (优先使用由`rollup.py`维护的小时汇总表，计算量约为分钟K线的1/60，结果一致)
         file = ".backup/data/%s.1m.data" % symbol
         if not os.path.exists(file):
             continue
-        data = data_loader.Data(file)    # 读取历史数据
-        last_timestamp = data_loader.get_last_timestamp(file)
-        if not last_timestamp or last_timestamp < start_timestamp:
+        rollup.catch_up(symbol, ".backup/data")    # 只处理新增的分钟数据
+        data = rollup.load(symbol, "1h", ".backup/data") or data_loader.Data(file)
+        if not len(data.tics) or data.tics[-1] / 1000 < start_timestamp:
             continue
 
         # statistics(get_price_change_by_hour, data, start_timestamp, end_timestamp)    # 价格变动分布 (天)
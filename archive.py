@@ -0,0 +1,171 @@
+# 历史K线归档导入：读取币安公开的按月/按日K线压缩包 (https://data.binance.vision)，转换为本地数据文件
+#
+# 压缩包需预先下载到本地，文件名形如`BTCUSDT-1m-2021-10.zip` (按月) 或`BTCUSDT-1m-2021-11-05.zip` (按日)，
+# 可放在同一目录下，也可保持官方的目录结构 (如`spot/monthly/klines/BTCUSDT/1m/`)。
+# 导入过程不访问API，多个币种并行处理；导入后可通过`update_data`补齐归档之后的最新数据
+
+import io
+import os
+import re
+import sys
+import shutil
+import zipfile
+import concurrent.futures
+
+import data_loader
+import integrity
+
+
+FILE_PATTERN = re.compile(r"^([A-Z0-9]+)-(\w+)-(\d{4})-(\d{2})(?:-(\d{2}))?\.zip$")
+
+
+def find_files(archive_dir, interval="1m", symbols=None):
+    """查找归档目录 (含子目录) 中的K线压缩包
+
+    returns: {symbol: [压缩包路径, ...]}，按月份/日期排序，按月与按日的压缩包均存在时两者都保留 (导入时去重)
+    """
+
+    files = {}
+    for root, _, names in os.walk(archive_dir):
+        for name in names:
+            match = FILE_PATTERN.match(name)
+            if not match or match.group(2) != interval:
+                continue
+            symbol = match.group(1)
+            if symbols is not None and symbol not in symbols:
+                continue
+            period = (match.group(3), match.group(4), match.group(5) or "")
+            files.setdefault(symbol, []).append((period, os.path.join(root, name)))
+    return {symbol: [file for _, file in sorted(items)] for symbol, items in files.items()}
+
+
+def read_zip(file):
+    """流式解压并读取压缩包中的K线，不将整个文件载入内存
+
+    returns: 生成器，每次返回 (开盘时间, 以制表符分隔的一行数据)
+    """
+
+    with zipfile.ZipFile(file) as archive:
+        for name in archive.namelist():
+            if not name.endswith(".csv"):
+                continue
+            with archive.open(name) as f:
+                for line in io.TextIOWrapper(f, encoding="utf-8"):
+                    line = line.rstrip("\r\n")
+                    if not line or not line[0].isdigit():    # 空行或表头
+                        continue
+                    tic = int(line[:line.index(",")])
+                    if tic > 10 ** 14:    # 2025年起的现货数据以微秒为单位，统一为毫秒
+                        fields = line.split(",")
+                        tic //= 1000
+                        fields[0] = str(tic)
+                        fields[6] = str(int(fields[6]) // 1000)
+                        yield tic, "\t".join(fields)
+                    else:
+                        yield tic, line.replace(",", "\t")
+
+
+def import_symbol(symbol, files, data_dir="data", interval="1m"):
+    """将一个币种的压缩包导入数据文件
+
+    已有数据文件时，早于文件首行的数据插入文件头部，晚于文件末行的数据追加到文件尾部，文件范围内的数据以已有文件为准
+
+    returns: {
+        "symbol": 币种,
+        "imported": 导入的K线数量,
+        "gaps": 导入数据中的缺失区间 (可通过`python3 integrity.py`补齐),
+        "duplicates": 重复的K线数量 (已丢弃),
+    }
+    """
+
+    os.makedirs(data_dir, exist_ok=True)    # 并行导入时可能同时创建目录
+    file = "%s/%s.%s.data" % (data_dir, symbol, interval)
+    first_timestamp = last_timestamp = None
+    if os.path.exists(file) and os.path.getsize(file):
+        with open(file, encoding="utf-8") as f:
+            first_line = f.readline()
+        first_timestamp = int(first_line[:first_line.index("\t")])
+        last_timestamp = data_loader.get_last_timestamp(file)
+
+    # 按时间顺序读取所有压缩包，写入临时文件
+    head_file = file + ".head.tmp"    # 早于已有数据的部分
+    tail_file = file + ".tail.tmp"    # 晚于已有数据的部分
+    tics = []
+    duplicates = 0
+    last = -1
+    with open(head_file, "w", encoding="utf-8") as head, open(tail_file, "w", encoding="utf-8") as tail:
+        for zip_file in files:
+            for tic, line in read_zip(zip_file):
+                if tic <= last:    # 按月与按日的压缩包重叠
+                    duplicates += 1
+                    continue
+                if first_timestamp is None or tic > last_timestamp:
+                    tail.write(line + "\n")
+                elif tic < first_timestamp:
+                    head.write(line + "\n")
+                else:
+                    continue
+                last = tic
+                tics.append(tic)
+
+    # 拼接：头部 + 已有文件 + 尾部 (写入临时文件后替换)
+    if os.path.getsize(head_file):
+        with open(head_file, "a", encoding="utf-8") as head:
+            if first_timestamp is not None:
+                with open(file, encoding="utf-8") as f:
+                    shutil.copyfileobj(f, head)
+            with open(tail_file, encoding="utf-8") as f:
+                shutil.copyfileobj(f, head)
+        os.replace(head_file, file)
+    else:
+        with open(file, "a", encoding="utf-8") as f, open(tail_file, encoding="utf-8") as tail:
+            shutil.copyfileobj(tail, f)
+        os.remove(head_file)
+    os.remove(tail_file)
+
+    # 连续性检查 (包括与已有数据的衔接处)
+    imported = len(tics)
+    if first_timestamp is not None:
+        tics += [first_timestamp, last_timestamp]
+    gaps, _ = integrity.find_gaps(tics, interval)
+    if first_timestamp is not None:    # 已有文件内部的缺失不在本次检查范围内
+        gaps = [gap for gap in gaps if not (gap[0] > first_timestamp and gap[1] < last_timestamp)]
+    return {"symbol": symbol, "imported": imported, "gaps": gaps, "duplicates": duplicates}
+
+
+def import_all(archive_dir, data_dir="data", interval="1m", symbols=None, workers=None, update=True, verbosity=1):
+    """并行导入归档目录中所有币种的压缩包，之后通过`update_data`补齐最新数据
+
+    returns: [导入结果 (见`import_symbol`), ...]
+    """
+
+    files = find_files(archive_dir, interval, symbols)
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(import_symbol, symbol, symbol_files, data_dir, interval)
+            for symbol, symbol_files in sorted(files.items())
+        ]
+        for i, future in enumerate(concurrent.futures.as_completed(futures)):
+            result = future.result()
+            results.append(result)
+            if verbosity:
+                print("%s (%d/%d): 导入%d条, 缺失%d处, 重复%d条" % (
+                    result["symbol"], i + 1, len(futures), result["imported"], len(result["gaps"]), result["duplicates"],
+                ))
+
+    # 补齐归档之后的最新数据 (仅需少量API请求)
+    if update:
+        for result in results:
+            if verbosity:
+                print("%s: 更新最新数据..." % result["symbol"])
+            data_loader.update_data(result["symbol"], interval, "%s/%s.%s.data" % (data_dir, result["symbol"], interval), verbosity=0)
+    return results
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) < 2:
+        print("Usage: python3 archive.py [archive_dir] [data_dir]        e.g. python3 archive.py downloads data")
+        sys.exit(-1)
+    import_all(sys.argv[1], data_dir=sys.argv[2] if len(sys.argv) > 2 else "data")
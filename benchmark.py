@@ -0,0 +1,151 @@
+# 性能测试
+
+import sys
+import json
+import time
+import random
+import subprocess
+
+
+def bench_import(modules, repeat=5):
+    """测试模块导入耗时 (每次在新的进程中导入，取最小值)
+
+    returns: {module: 秒}
+    """
+
+    results = {}
+    for module in modules:
+        code = "import time; t = time.perf_counter(); import %s; print(time.perf_counter() - t)" % module
+        costs = []
+        for _ in range(repeat):
+            output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+            if output.returncode != 0:    # 依赖未安装等
+                break
+            costs.append(float(output.stdout.strip().split("\n")[-1]))
+        results[module] = min(costs) if costs else None
+    return results
+
+
+def make_items(n, start=1609459200000):
+    """生成`n`条模拟的1分钟K线 (币安K线格式，字段为字符串)"""
+
+    items = []
+    price = 100.0
+    for i in range(n):
+        open_price = price
+        price *= 1 + random.gauss(0, 0.001)
+        open_time = start + i * 60000
+        items.append([
+            open_time, "%.8f" % open_price, "%.8f" % max(open_price, price), "%.8f" % min(open_price, price),
+            "%.8f" % price, "%.8f" % random.random(), open_time + 59999, "%.8f" % (random.random() * 100),
+            random.randint(1, 1000), "%.8f" % random.random(), "%.8f" % (random.random() * 50), "0",
+        ])
+    return items
+
+
+def bench_kline_memory(n=10080):
+    """对比`data_loader.Data`的三列Python列表与`klines.Klines`完整11列的内存占用
+
+    returns: {名称: 字节}
+    """
+
+    import klines
+
+    items = make_items(n)
+    tics = [int(item[0]) for item in items]
+    prices = [float(item[4]) for item in items]
+    volumes = [float(item[7]) for item in items]
+    list_bytes = sum(sys.getsizeof(x) for x in (tics, prices, volumes))
+    list_bytes += sum(sys.getsizeof(v) for x in (tics, prices, volumes) for v in x)
+
+    results = {"Data (3列)": list_bytes}
+    for dtype in klines.DTYPE_POLICIES:
+        results["Klines %s (11列)" % dtype] = klines.Klines.from_items(items, dtype=dtype).nbytes
+    return results
+
+
+def bench_window_memory(n=10080):
+    """对比`Monitor`原先保存的7天分钟列表与多分辨率窗口的每币种内存占用
+
+    returns: {名称: 字节}
+    """
+
+    import window
+
+    items = make_items(n)
+    tics = [int(item[0]) for item in items]
+    prices = [float(item[4]) for item in items]
+    volumes = [float(item[7]) for item in items]
+    list_bytes = sum(sys.getsizeof(x) for x in (tics, prices, volumes))
+    list_bytes += sum(sys.getsizeof(v) for x in (tics, prices, volumes) for v in x)
+
+    price_window = window.MultiResolutionWindow.from_history(tics, prices, short_windows=(7, 420))
+    volume_window = window.MultiResolutionWindow.from_history(tics, volumes, short_windows=(420,))
+    tic_bytes = sys.getsizeof(tics[-len(price_window):]) + sum(sys.getsizeof(v) for v in tics[-len(price_window):])
+    return {
+        "分钟列表": list_bytes,
+        "多分辨率窗口": price_window.nbytes + volume_window.nbytes + tic_bytes,
+    }
+
+
+def make_response(items):
+    """将模拟的K线转换为K线接口的响应内容 (bytes)"""
+    return json.dumps(items, separators=(",", ":")).encode("ascii")
+
+
+def bench_kline_parse(n=50000, repeat=3):
+    """比较K线响应的两种解析方式，各自得到收盘价/成交额与数据文件的行
+
+    returns: {方式: 每条K线的耗时 (秒)}
+    """
+
+    import klines
+
+    body = make_response(make_items(n))
+
+    def parse_json():
+        items = json.loads(body)
+        prices = [float(item[4]) for item in items]
+        volumes = [float(item[7]) for item in items]
+        lines = ["%s\n" % "\t".join(map(str, item)) for item in items]
+        return prices, volumes, lines
+
+    def parse_arrays():
+        columns = klines.decode_columns(body, ["close", "quote_volume"])
+        return columns["close"], columns["quote_volume"], klines.decode_lines(body)
+
+    results = {}
+    for name, parse in (("json + 逐字段转换", parse_json), ("直接解析为数组", parse_arrays)):
+        costs = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            parse()
+            costs.append(time.perf_counter() - start)
+        results[name] = min(costs) / n
+    return results
+
+
+if __name__ == "__main__":
+
+    print("模块导入耗时：")
+    results = bench_import([
+        "utils", "data_loader", "price_index", "resample", "universe", "analyze", "binance",    # 本仓库模块
+        "requests", "numpy", "matplotlib.pyplot", "seaborn",    # 重量级依赖 (仅作参照)
+    ])
+    for module, cost in results.items():
+        if cost is None:
+            print("%-20s 导入失败" % module)
+        else:
+            print("%-20s %.1fms" % (module, cost * 1000))
+
+    print("\n7天1分钟K线的内存占用：")
+    for name, nbytes in bench_kline_memory().items():
+        print("%-24s %.1fKB" % (name, nbytes / 1024))
+
+    print("\nK线响应的解析耗时：")
+    for name, cost in bench_kline_parse().items():
+        print("%-24s %.2fµs/条" % (name, cost * 1e6))
+
+    print("\n每币种监控状态的内存占用：")
+    for name, nbytes in bench_window_memory().items():
+        print("%-24s %.1fKB" % (name, nbytes / 1024))
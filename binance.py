@@ -1,17 +1,88 @@
 # 本页的实现参考了：https://github.com/hengxuZ/binance-quantization，感谢hengxuZ提供的优质代码
 
 import os
-import requests
 import time
 import json
 import hmac
-import pprint
 import hashlib
-import urllib
+import urllib.parse
+import threading
 
 import utils
 
 
+class RequestCache:
+    """带过期时间的请求缓存
+
+    - 各接口设置不同的过期时间 (ttl，单位秒)，过期前重复请求直接返回缓存
+    - 同一键的并发请求只发送一次，其余请求等待并共享结果 (single-flight)
+    - 请求失败的结果不予缓存
+    """
+
+    def __init__(self):
+        self._data = {}    # key -> (写入时间, 数据)
+        self._inflight = {}    # key -> threading.Event，正在进行中的请求
+        self._lock = threading.Lock()
+        self.stats = {"hit": 0, "miss": 0, "shared": 0}    # 命中/未命中/共享并发请求的次数
+
+    def get(self, key, ttl, fetch):
+        """读取缓存，过期或不存在时调用`fetch`获取
+
+        fetch: 无参函数，returns: err, data
+        returns: err, data
+        """
+
+        while True:
+            with self._lock:
+                item = self._data.get(key)
+                if item is not None and time.time() - item[0] < ttl:
+                    self.stats["hit"] += 1
+                    return None, item[1]
+                event = self._inflight.get(key)
+                if event is None:    # 由当前线程发起请求
+                    event = threading.Event()
+                    self._inflight[key] = event
+                    self.stats["miss"] += 1
+                    break
+                self.stats["shared"] += 1
+
+            # 等待其他线程的同一请求完成后重新读取缓存
+            event.wait()
+            with self._lock:
+                item = self._data.get(key)
+                if item is not None and time.time() - item[0] < ttl:
+                    return None, item[1]
+
+        try:
+            err, data = fetch()
+            if err is None:
+                with self._lock:
+                    self._data[key] = (time.time(), data)
+            return err, data
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+    def peek(self, key, ttl):
+        """仅读取未过期的缓存，不发起请求，不存在时返回None"""
+
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and time.time() - item[0] < ttl:
+                return item[1]
+        return None
+
+    def invalidate(self, *keys):
+        """使指定缓存失效，不指定时清空所有缓存"""
+
+        with self._lock:
+            if not keys:
+                self._data.clear()
+            for key in keys:
+                self._data.pop(key, None)
+
+
 class BinanceAPI:
     """通过币安API获取信息，详见：
     https://github.com/binance/binance-spot-api-docs/blob/master/README_CN.md
@@ -21,6 +92,12 @@ class BinanceAPI:
     FUTURE_URL = "https://fapi.binance.com"
     PUBLIC_URL = "https://www.binance.com/exchange/public/product"
 
+    # 各接口缓存过期时间 (秒)
+    CACHE_TTL = {
+        "prices": 1,
+        "account": 5,
+    }
+
     def __init__(self, api_key, secret_key, basic_currency="USDT", verbosity=0):
         self.api_key = api_key
         self.secret_key = secret_key
@@ -28,6 +105,8 @@ class BinanceAPI:
         self.verbosity = verbosity
 
         self.lost_connection = False    # 是否断开网络连接
+        self.cache = RequestCache()    # 请求缓存
+        self.order_callbacks = []    # 委托后的回调 callback(symbol)，如通知持仓跟踪刷新余额
 
     def get_ping(self):
         """检测是否与服务器连接成功
@@ -68,16 +147,26 @@ class BinanceAPI:
         }
         """
 
+        # 所有资产现价的缓存未过期时，直接从中读取
+        prices = self.cache.peek("prices", self.CACHE_TTL["prices"])
+        if prices is not None:
+            for market in prices:
+                if market["symbol"] == symbol:
+                    self.cache.stats["hit"] += 1
+                    return None, market
+
         url = "%s/ticker/price" % self.BASE_URL
         params = {}
         if symbol:
             params["symbol"] = symbol
 
         # 请求
-        try:
-            return None, self._get_without_sign(url, params)
-        except Exception as e:
-            return "获取特定资产现价失败: %s" % self._process_error(e), None
+        def fetch():
+            try:
+                return None, self._get_without_sign(url, params)
+            except Exception as e:
+                return "获取特定资产现价失败: %s" % self._process_error(e), None
+        return self.cache.get(("price", symbol), self.CACHE_TTL["prices"], fetch)
 
     def get_prices(self):
         """获取所有资产现价
@@ -95,13 +184,15 @@ class BinanceAPI:
         params = {}
 
         # 请求
-        try:
-            return None, self._get_without_sign(url, params)
-        except Exception as e:
-            return "获取所有资产现价失败: %s" % self._process_error(e), None
+        def fetch():
+            try:
+                return None, self._get_without_sign(url, params)
+            except Exception as e:
+                return "获取所有资产现价失败: %s" % self._process_error(e), None
+        return self.cache.get("prices", self.CACHE_TTL["prices"], fetch)
 
-    def get_price_change(self, symbol, interval="24hr"):
-        """获取资产区间交易信息
+    def get_price_change(self, symbol=None, interval="24hr"):
+        """获取资产区间交易信息，`symbol`为空时一次性获取所有资产
 
         returns: None, {
             "symbol": "BNBBTC",
@@ -127,16 +218,50 @@ class BinanceAPI:
         """
 
         url = "%s/ticker/%s" % (self.BASE_URL, interval)
-        params = {"symbol": symbol}
+        params = {}
+        if symbol:
+            params["symbol"] = symbol
+
+        # 请求
+        def fetch():
+            try:
+                return None, self._get_without_sign(url, params)
+            except Exception as e:
+                return "获取资产区间交易信息失败: %s" % self._process_error(e), None
+        return self.cache.get(("price_change", symbol, interval), self.CACHE_TTL["prices"], fetch)
+
+    def get_exchange_info(self):
+        """获取交易规则和交易对信息
+
+        returns: None, {
+            "timezone": "UTC",
+            "serverTime": 1565246363776,
+            "symbols": [
+                {
+                    "symbol": "ETHBTC",
+                    "status": "TRADING",
+                    "baseAsset": "ETH",
+                    "quoteAsset": "BTC",
+                    "isSpotTradingAllowed": true,
+                    ...
+                },
+                ...
+            ],
+            ...
+        }
+        """
+
+        url = "%s/exchangeInfo" % self.BASE_URL
+        params = {}
 
         # 请求
         try:
             return None, self._get_without_sign(url, params)
         except Exception as e:
-            return "获取资产区间交易信息失败: %s" % self._process_error(e), None
+            return "获取交易对信息失败: %s" % self._process_error(e), None
 
-    def get_ticker_bookticker(self, symbol):
-        """获取资产挂单价
+    def get_ticker_bookticker(self, symbol=None):
+        """获取资产挂单价，`symbol`为空时一次获取所有交易对 (返回列表)
 
         returns: None, {
           "symbol": "LTCBTC",
@@ -148,7 +273,9 @@ class BinanceAPI:
         """
 
         url = "%s/ticker/bookTicker" % self.BASE_URL
-        params = {"symbol": symbol}
+        params = {}
+        if symbol:
+            params["symbol"] = symbol
 
         # 请求
         try:
@@ -156,8 +283,8 @@ class BinanceAPI:
         except Exception as e:
             return "获取资产挂单价失败: %s" % self._process_error(e), None
 
-    def get_interval_prices(self, symbol, interval="1m", startTime=None, endTime=None):
-        """获取区间价格
+    def get_interval_prices(self, symbol, interval="1m", startTime=None, endTime=None, raw=False):
+        """获取区间价格，`raw`为True时返回未解析的响应 (bytes)，可由`klines.decode_columns`/`klines.decode_lines`直接解析
 
         returns: None, [
             [
@@ -187,12 +314,12 @@ class BinanceAPI:
 
         # 请求
         try:
-            return None, self._get_without_sign(url, params)
+            return None, self._get_without_sign(url, params, raw=raw)
         except Exception as e:
             return "获取区间价格失败: %s" % self._process_error(e), None
 
-    def get_historical_trades(self, symbol, limit=500, startTime=None, endTime=None):
-        """获取历史交易
+    def get_historical_trades(self, symbol, limit=500, startTime=None, endTime=None, fromId=None):
+        """获取历史交易 (归集成交)，`fromId`为起始的归集成交ID (含)，用于按ID增量获取
 
         returns: None, [
             {
@@ -215,6 +342,8 @@ class BinanceAPI:
             params["startTime"] = startTime
         if endTime:
             params["endTime"] = endTime
+        if fromId is not None:
+            params["fromId"] = fromId
 
         # 请求
         try:
@@ -252,13 +381,15 @@ class BinanceAPI:
         """
 
         url = "%s/account" % self.BASE_URL
-        params = {"recvWindow": 5000, "timestamp": int(1000 * time.time())}
 
         # 请求
-        try:
-            return None, self._get_with_sign(url, params)
-        except Exception as e:
-            return "获取账户信息失败: %s" % self._process_error(e), None
+        def fetch():
+            params = {"recvWindow": 5000, "timestamp": int(1000 * time.time())}
+            try:
+                return None, self._get_with_sign(url, params)
+            except Exception as e:
+                return "获取账户信息失败: %s" % self._process_error(e), None
+        return self.cache.get("account", self.CACHE_TTL["account"], fetch)
 
     def get_account_value(self, ignore_small_amount_asset=True):
         """获取账户剩余价值
@@ -407,9 +538,13 @@ class BinanceAPI:
 
         # 请求
         try:
-            return None, self._post_with_sign(url, params)
+            data = self._post_with_sign(url, params)
         except Exception as e:
             return "现货买入失败: %s" % self._process_error(e), None
+        finally:
+            self.cache.invalidate("account")    # 委托后持仓发生变化
+        self._notify_order(symbol, data)
+        return None, data
 
     def sell(self, symbol, quantity=None, value=None, limit_price=None):
         """现货卖出
@@ -488,9 +623,13 @@ class BinanceAPI:
 
         # 请求
         try:
-            return None, self._post_with_sign(url, params)
+            data = self._post_with_sign(url, params)
         except Exception as e:
             return "现货卖出失败: %s" % self._process_error(e), None
+        finally:
+            self.cache.invalidate("account")    # 委托后持仓发生变化
+        self._notify_order(symbol, data)
+        return None, data
 
     def sell_all(self):
         """一键平仓"""
@@ -529,6 +668,14 @@ class BinanceAPI:
             print("一键平仓")
         return None, info
 
+    def _notify_order(self, symbol, data):
+        """委托请求已送达且未被交易所拒绝 (响应中没有错误码) 时通知回调"""
+
+        if isinstance(data, dict) and "code" in data:
+            return
+        for callback in self.order_callbacks:
+            callback(symbol)
+
     def _post_with_sign(self, url, params):
         """带有签名的HTTP请求"""
 
@@ -541,6 +688,7 @@ class BinanceAPI:
             print(query)
 
         # 请求
+        import requests
         data = requests.post(url, headers=header, data=query, timeout=180, verify=True)
         try:
             d = data.json()
@@ -564,6 +712,7 @@ class BinanceAPI:
             print("REQUEST: ", url)
 
         # 请求
+        import requests
         data = requests.get(url, headers=header, timeout=180, verify=True)
         try:
             d = data.json()
@@ -576,17 +725,18 @@ class BinanceAPI:
                 print(data.content.decode("utf-8"))
             raise e
 
-    def _get_without_sign(self, url, params):
-        """不带签名的HTTP请求"""
+    def _get_without_sign(self, url, params, raw=False):
+        """不带签名的HTTP请求，`raw`为True时直接返回响应内容 (bytes)"""
         query = urllib.parse.urlencode(params)
         url = "%s?%s" % (url, query)
         if self.verbosity > 1:
             print("REQUEST: ", url)
 
         # 请求
+        import requests
         data = requests.get(url, timeout=180, verify=True)
         try:
-            d = data.json()
+            d = data.content if raw else data.json()
             if self.lost_connection and self.verbosity > 0:
                 print("网络连接已恢复")
                 self.lost_connection = False
@@ -627,36 +777,60 @@ class BinanceAPI:
         return msg
 
 
-# 读取API配置
-if not os.path.exists("api.conf"):
-    raise FileNotFoundError("未找到`./api.conf`文件，请遵循README提示操作, 并注意保护隐私")
-with open("api.conf", encoding="utf-8") as f:
-    api_conf = json.load(f)
-    instance = BinanceAPI(
-        api_conf["API Key"],
-        api_conf["Secret Key"],
-        verbosity=0,
-    )
+_instance = None
+
+
+def get_instance():
+    """获取全局API实例，首次调用时读取API配置"""
+
+    global _instance
+    if _instance is None:
+        if not os.path.exists("api.conf"):
+            raise FileNotFoundError("未找到`./api.conf`文件，请遵循README提示操作, 并注意保护隐私")
+        with open("api.conf", encoding="utf-8") as f:
+            api_conf = json.load(f)
+        _instance = BinanceAPI(
+            api_conf["API Key"],
+            api_conf["Secret Key"],
+            verbosity=0,
+        )
+    return _instance
+
+
+def __getattr__(name):
+    """兼容`from binance import instance`的写法，在首次访问时才创建实例"""
+    if name == "instance":
+        return get_instance()
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
 
 if __name__ == "__main__":
 
+    import pprint
+    instance = get_instance()
+
     # pprint.pprint(instance.get_ping())    # 检测是否与服务器连接成功
     # pprint.pprint(instance.get_time())    # 获取服务器时间戳
+    # pprint.pprint(instance.get_exchange_info())    # 获取交易对信息
     # pprint.pprint(instance.get_price("BTCUSDT"))    # 获取指定资产价格
     # pprint.pprint(instance.get_prices())    # 获取所有资产价格
     # pprint.pprint(instance.get_interval_prices("BTCUSDT", interval="1h", startTime=None, endTime=None))    # 获取价格区间
     # pprint.pprint(instance.get_price_change("BTCUSDT", interval="24hr"))    # 获取价格区间变动
+    # pprint.pprint(instance.get_price_change(None, interval="24hr"))    # 获取所有资产价格区间变动
+    # pprint.pprint(instance.get_ticker_bookticker("BTCUSDT"))    # 获取指定资产挂单价
     # pprint.pprint(instance.get_account())    # 获取账户信息
     # pprint.pprint(instance.get_account_value())    # 获取账户价值
     # pprint.pprint(instance.buy("BTCUSDT", quantity=None, value=20, limit_price=None))    # 现货买入 (市价买入$20BTC)
     # pprint.pprint(instance.sell("BTCUSDT", quantity=None, value=None, limit_price=None))    # 现货卖出 (市价卖出所有BTC)
     # pprint.pprint(instance.sell_all())    # 现货卖出 (一键平仓)
 
-    # 定期打印账户价值
+    # 定期打印账户价值 (余额只在首次及每30分钟读取，之后每分钟一次全市场价格请求)
+    import portfolio
+    tracker = portfolio.Portfolio(instance, on_drawdown=portfolio.print_drawdown)
     while True:
         print(utils.tic2time(time.time()))
-        err, d = instance.get_account_value()    # 获取账户剩余价值
-        if err is None:
-            pprint.pprint(d)
+        err = tracker.poll() or tracker.fetch_prices()
+        if err is not None:
+            print(err)
+        pprint.pprint(tracker.summary())
         time.sleep(60)
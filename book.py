@@ -0,0 +1,297 @@
+# 最优挂单 (买一/卖一) 的高频采集：每隔几秒通过一次全市场bookTicker请求采样所有跟踪币种的买卖价与挂单量，
+# 以紧凑的二进制格式保存，并按分钟汇总价差与挂单失衡度，可与1分钟K线按开盘时间对齐
+#
+# 采样文件`data_dir/book/SYMBOL.YYYYMMDD.bin` (按UTC日期)，每条记录为：
+#   距上一条的毫秒数 (uint16) + 买一价、价差 (卖一价 - 买一价)、买一挂单量、卖一挂单量 (float32)，共18字节；
+#   间隔超过65秒或文件首条记录时，毫秒数为0xFFFF，其后紧跟8字节的绝对时间戳
+# 价差在float64下计算后单独保存，避免高价币种的float32精度 (约7位有效数字) 淹没一两个最小价格单位的价差
+#
+# 分钟汇总`data_dir/book/SYMBOL.1m.data`，每行一分钟，字段见`ROLLUP_FIELDS`
+
+import os
+import sys
+import time
+import struct
+
+import numpy as np
+
+import binance
+import data_loader
+import scheduler
+import utils
+
+
+CAPTURE_INTERVAL = 5    # 采样间隔 (秒)
+ESCAPE = 0xFFFF    # 时间戳转义：其后为8字节的绝对时间戳
+DELTA = struct.Struct("<H")
+ABSOLUTE = struct.Struct("<q")
+VALUES = struct.Struct("<4f")
+
+ROLLUP_FIELDS = [
+    "open_time",        # 分钟开盘时间 (与1分钟K线一致)
+    "samples",          # 采样数
+    "spread_bps",       # 平均价差 (相对中间价，万分之一)
+    "max_spread_bps",   # 最大价差
+    "imbalance",        # 平均挂单失衡度 (买一挂单额 - 卖一挂单额) / (买一挂单额 + 卖一挂单额)，-1~1
+    "last_imbalance",   # 分钟内最后一次采样的失衡度
+    "bid_value",        # 平均买一挂单额
+    "ask_value",        # 平均卖一挂单额
+]
+
+
+class SymbolBook:
+    """单一币种的采集状态：编码用的上一条时间戳、未写入的记录、当前分钟的汇总 (内存占用固定)"""
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.day = None    # 当前采样文件的日期
+        self.last_tic = None    # 上一条记录的时间戳 (毫秒)
+        self.buffer = bytearray()    # 尚未写入文件的记录 (每分钟写入一次)
+        self.minute = None    # 当前汇总的分钟
+        self.sums = None    # [采样数, 价差之和, 最大价差, 失衡度之和, 最后失衡度, 买一挂单额之和, 卖一挂单额之和]
+
+    def encode(self, tic, bid, spread, bid_qty, ask_qty):
+        """编码一条记录，写入缓冲"""
+
+        delta = tic - self.last_tic if self.last_tic is not None else -1
+        if 0 <= delta < ESCAPE:
+            self.buffer += DELTA.pack(delta)
+        else:
+            self.buffer += DELTA.pack(ESCAPE) + ABSOLUTE.pack(tic)
+        self.buffer += VALUES.pack(bid, spread, bid_qty, ask_qty)
+        self.last_tic = tic
+
+    def aggregate(self, bid, ask, bid_qty, ask_qty):
+        """并入当前分钟的汇总"""
+
+        mid = (bid + ask) / 2
+        spread_bps = (ask - bid) / mid * 10000 if mid > 0 else 0
+        bid_value = bid * bid_qty
+        ask_value = ask * ask_qty
+        imbalance = (bid_value - ask_value) / (bid_value + ask_value) if bid_value + ask_value > 0 else 0
+        if self.sums is None:
+            self.sums = [0, 0.0, spread_bps, 0.0, 0.0, 0.0, 0.0]
+        sums = self.sums
+        sums[0] += 1
+        sums[1] += spread_bps
+        sums[2] = max(sums[2], spread_bps)
+        sums[3] += imbalance
+        sums[4] = imbalance
+        sums[5] += bid_value
+        sums[6] += ask_value
+
+    def rollup_line(self):
+        """当前分钟的汇总行，无采样时返回None"""
+
+        if self.sums is None:
+            return None
+        n, spread, max_spread, imbalance, last_imbalance, bid_value, ask_value = self.sums
+        return "%d\t%d\t%.3f\t%.3f\t%.4f\t%.4f\t%.2f\t%.2f\n" % (
+            self.minute, n, spread / n, max_spread, imbalance / n, last_imbalance, bid_value / n, ask_value / n,
+        )
+
+
+class BookRecorder:
+    """最优挂单的采集与存储
+
+    - `poll(symbols)`每`interval`秒以一次全市场请求采样`symbols`中的币种
+    - 采样记录在内存中只保留当前分钟，每分钟追加写入文件；分钟汇总在分钟结束后写入
+    - 采样时间以服务器时间为准，与K线的开盘时间对齐
+    """
+
+    def __init__(self, data_dir="data", interval=CAPTURE_INTERVAL, clock=None):
+        self.book_dir = os.path.join(data_dir, "book")
+        self.interval = interval
+        self.clock = clock or scheduler.ServerClock()
+        self.books = {}    # symbol -> SymbolBook
+        self.last_poll_tic = -1
+        self.stats = {"requests": 0, "samples": 0, "bytes": 0}    # 请求次数/采样数/写入采样文件的字节数
+        os.makedirs(self.book_dir, exist_ok=True)
+
+    def poll(self, symbols=None):
+        """到达采样间隔时采样一次，`symbols`为空时采样所有交易对
+
+        returns: err
+        """
+
+        if time.time() - self.last_poll_tic < self.interval:
+            return None
+        self.last_poll_tic = time.time()
+        err, tickers = binance.get_instance().get_ticker_bookticker()
+        if err is not None:
+            return err
+        if not isinstance(tickers, list):
+            return "获取挂单价失败: %s" % tickers
+        self.stats["requests"] += 1
+        tic = self.clock.now()
+        for ticker in tickers:
+            symbol = ticker["symbol"]
+            if symbols is not None and symbol not in symbols:
+                continue
+            self.add(symbol, tic, float(ticker["bidPrice"]), float(ticker["askPrice"]), float(ticker["bidQty"]), float(ticker["askQty"]))
+        return None
+
+    def add(self, symbol, tic, bid, ask, bid_qty, ask_qty):
+        """加入一次采样"""
+
+        book = self.books.get(symbol)
+        if book is None:
+            book = self.books[symbol] = SymbolBook(symbol)
+
+        # 进入新的分钟：写入上一分钟的记录与汇总
+        minute = tic // 60000 * 60000
+        if book.minute != minute:
+            self._flush(book)
+            book.minute = minute
+            book.sums = None
+
+        # 进入新的日期：切换采样文件，首条记录使用绝对时间戳
+        day = time.strftime("%Y%m%d", time.gmtime(tic / data_loader.TIMESTAMP_UNIT))
+        if book.day != day:
+            self._write_samples(book)
+            book.day = day
+            book.last_tic = None
+
+        book.encode(tic, bid, ask - bid, bid_qty, ask_qty)
+        book.aggregate(bid, ask, bid_qty, ask_qty)
+        self.stats["samples"] += 1
+
+    def close(self):
+        """写入所有缓冲 (包括未结束的分钟)"""
+
+        for book in self.books.values():
+            self._flush(book)
+            book.sums = None
+
+    def remove(self, symbol):
+        """停止采集币种 (写入缓冲后释放状态)"""
+
+        book = self.books.pop(symbol, None)
+        if book is not None:
+            self._flush(book)
+
+    def memory(self):
+        """采集状态的内存占用 (字节，不含Python对象的固定开销)"""
+        return sum(len(book.buffer) + 8 * 7 for book in self.books.values())
+
+    def _flush(self, book):
+        self._write_samples(book)
+        line = book.rollup_line()
+        if line is not None:
+            with open(os.path.join(self.book_dir, "%s.1m.data" % book.symbol), "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def _write_samples(self, book):
+        if not book.buffer:
+            return
+        with open(get_sample_file(book.symbol, book.day, os.path.dirname(self.book_dir)), "ab") as f:
+            f.write(book.buffer)
+        self.stats["bytes"] += len(book.buffer)
+        book.buffer = bytearray()
+
+
+def get_sample_file(symbol, day, data_dir="data"):
+    return os.path.join(data_dir, "book", "%s.%s.bin" % (symbol, day))
+
+
+def read_samples(symbol, day, data_dir="data"):
+    """读取一天的采样记录 (`day`形如"20211105")，末尾写入中断的不完整记录将被忽略
+
+    returns: {"tic": int64数组, "bid", "ask", "bid_qty", "ask_qty": float64数组}
+    """
+
+    with open(get_sample_file(symbol, day, data_dir), "rb") as f:
+        data = f.read()
+    tics = []
+    values = []
+    pos = 0
+    tic = 0
+    while pos + DELTA.size + VALUES.size <= len(data):
+        delta, = DELTA.unpack_from(data, pos)
+        pos += DELTA.size
+        if delta == ESCAPE:
+            if pos + ABSOLUTE.size + VALUES.size > len(data):
+                break
+            tic, = ABSOLUTE.unpack_from(data, pos)
+            pos += ABSOLUTE.size
+        else:
+            tic += delta
+        tics.append(tic)
+        values.append(VALUES.unpack_from(data, pos))
+        pos += VALUES.size
+    values = np.array(values, dtype=np.float64).reshape(-1, 4)
+    return {
+        "tic": np.array(tics, dtype=np.int64),
+        "bid": values[:, 0],
+        "ask": values[:, 0] + values[:, 1],
+        "bid_qty": values[:, 2],
+        "ask_qty": values[:, 3],
+    }
+
+
+def load_rollup(symbol, data_dir="data"):
+    """读取分钟汇总
+
+    returns: {字段: 数组}，字段见`ROLLUP_FIELDS`，不存在时返回None
+    """
+
+    file = os.path.join(data_dir, "book", "%s.1m.data" % symbol)
+    if not os.path.exists(file):
+        return None
+    table = np.loadtxt(file, delimiter="\t", ndmin=2)
+    columns = {name: table[:, i] for i, name in enumerate(ROLLUP_FIELDS)}
+    columns["open_time"] = columns["open_time"].astype(np.int64)
+    return columns
+
+
+def join_klines(symbol, tics, data_dir="data"):
+    """将分钟汇总按开盘时间对齐到K线的时间戳 (如`data_loader.Data(file).tics`)
+
+    returns: {字段: 与`tics`等长的数组}，没有汇总的分钟为NaN
+    """
+
+    tics = np.asarray(tics, dtype=np.int64)
+    rollup = load_rollup(symbol, data_dir)
+    joined = {name: np.full(len(tics), np.nan) for name in ROLLUP_FIELDS[1:]}
+    if rollup is None or not len(tics):
+        return joined
+    open_times, index = np.unique(rollup["open_time"], return_index=True)    # 重复的分钟 (重启采集) 取首次
+    positions = np.searchsorted(open_times, tics)
+    found = positions < len(open_times)
+    found[found] = open_times[positions[found]] == tics[found]
+    for name in joined:
+        joined[name][found] = rollup[name][index[positions[found]]]
+    return joined
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) < 2:
+        print("Usage: python3 book.py [data_dir] [seconds]        e.g. python3 book.py data 5")
+        sys.exit(-1)
+
+    # 采集数据目录中已有1分钟K线的币种 (即监控跟踪的币种)
+    data_dir = sys.argv[1]
+    symbols = {file[:-len(".1m.data")] for file in os.listdir(data_dir) if file.endswith(".1m.data") and not file.startswith("index")}
+    recorder = BookRecorder(data_dir, interval=float(sys.argv[2]) if len(sys.argv) > 2 else CAPTURE_INTERVAL)
+    print("开始采集%d个币种的最优挂单..." % len(symbols))
+    start = time.time()
+    last_report_tic = time.time()
+    try:
+        while True:
+            err = recorder.poll(symbols)
+            if err is not None:
+                print(err)
+            if time.time() - last_report_tic > 600:
+                last_report_tic = time.time()
+                days = (time.time() - start) / 86400
+                print("%s --- 请求%d次, 采样%d条, 每币种每天约%.0fKB, 内存%.1fKB" % (
+                    utils.tic2time(time.time()),
+                    recorder.stats["requests"],
+                    recorder.stats["samples"],
+                    recorder.stats["bytes"] / max(len(recorder.books), 1) / days / 1024,
+                    recorder.memory() / 1024,
+                ))
+            time.sleep(0.1)
+    finally:
+        recorder.close()
@@ -0,0 +1,153 @@
+# 已收盘K线的本地磁盘缓存：历史K线不再变化，按 (币种, 周期, 时间区间) 缓存接口的响应内容，
+# 重复初始化数据、新建数据目录或反复实验时直接从磁盘读取，仅尚未收盘的末段需要访问API
+#
+# 缓存文件以键的哈希值命名 (`cache_dir/ab/abcdef....kl`)，内容为zlib压缩后的响应；
+# 总大小超过上限时按最近访问时间 (读取时刷新文件的修改时间) 淘汰最久未使用的文件
+
+import os
+import sys
+import zlib
+import hashlib
+import threading
+
+
+CACHE_DIR = "cache"
+MAX_BYTES = 1024 ** 3    # 缓存总大小上限 (字节)
+EVICT_RATIO = 0.9    # 超过上限时淘汰至上限的该比例，避免每次写入都扫描目录
+SUFFIX = ".kl"
+
+
+class KlineCache:
+    """已收盘K线区间的磁盘缓存 (LRU淘汰)，调用方需保证写入的区间已全部收盘"""
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._size = None    # 缓存总大小，首次写入时扫描目录得到
+        self._lock = threading.Lock()
+        self.stats = {"hit": 0, "miss": 0, "evicted": 0}
+
+    def get_file(self, symbol, interval, start_timestamp, end_timestamp):
+        key = hashlib.sha1(("%s/%s/%d/%d" % (symbol, interval, start_timestamp, end_timestamp)).encode()).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key + SUFFIX)
+
+    def get(self, symbol, interval, start_timestamp, end_timestamp):
+        """读取区间的响应内容 (bytes)，不存在时返回None"""
+
+        file = self.get_file(symbol, interval, start_timestamp, end_timestamp)
+        try:
+            with open(file, "rb") as f:
+                body = zlib.decompress(f.read())
+            os.utime(file)    # 刷新最近访问时间
+        except FileNotFoundError:
+            self.stats["miss"] += 1
+            return None
+        except (OSError, zlib.error):    # 文件损坏 (如写入中断)，删除后重新请求
+            self._remove(file)
+            self.stats["miss"] += 1
+            return None
+        self.stats["hit"] += 1
+        return body
+
+    def put(self, symbol, interval, start_timestamp, end_timestamp, body):
+        """写入区间的响应内容 (写入临时文件后替换)，超过大小上限时淘汰最久未使用的文件"""
+
+        file = self.get_file(symbol, interval, start_timestamp, end_timestamp)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        data = zlib.compress(body, 1)
+        tmp_file = "%s.%d.%d.tmp" % (file, os.getpid(), threading.get_ident())
+        with open(tmp_file, "wb") as f:
+            f.write(data)
+        os.replace(tmp_file, file)
+
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._scan())
+            else:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def usage(self):
+        """returns: 文件数, 总大小 (字节)"""
+
+        entries = self._scan()
+        return len(entries), sum(size for _, size, _ in entries)
+
+    def clear(self):
+        """清空缓存"""
+
+        with self._lock:
+            for file, _, _ in self._scan():
+                self._remove(file)
+            self._size = 0
+
+    def _evict(self):
+        """按最近访问时间从旧到新淘汰，直至总大小不超过上限的`EVICT_RATIO`"""
+
+        entries = sorted(self._scan(), key=lambda entry: entry[2])
+        self._size = sum(size for _, size, _ in entries)
+        for file, size, _ in entries:
+            if self._size <= self.max_bytes * EVICT_RATIO:
+                break
+            self._remove(file)
+            self._size -= size
+            self.stats["evicted"] += 1
+
+    def _scan(self):
+        """returns: [(文件, 大小, 最近访问时间), ...]"""
+
+        entries = []
+        if not os.path.exists(self.cache_dir):
+            return entries
+        for directory in os.scandir(self.cache_dir):
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory.path):
+                if entry.name.endswith(SUFFIX):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:    # 被其他进程淘汰
+                        continue
+                    entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return entries
+
+    @staticmethod
+    def _remove(file):
+        try:
+            os.remove(file)
+        except FileNotFoundError:
+            pass
+
+
+_instance = None
+_config = {"cache_dir": CACHE_DIR, "max_bytes": MAX_BYTES}
+
+
+def configure(cache_dir=CACHE_DIR, max_bytes=MAX_BYTES):
+    """设置缓存目录与大小上限，`cache_dir`为None时不使用缓存"""
+
+    global _instance
+    _config.update(cache_dir=cache_dir, max_bytes=max_bytes)
+    _instance = None
+
+
+def get_instance():
+    """获取全局缓存实例，未启用缓存时返回None"""
+
+    global _instance
+    if _instance is None and _config["cache_dir"] is not None:
+        _instance = KlineCache(_config["cache_dir"], _config["max_bytes"])
+    return _instance
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) < 2:
+        print("Usage: python3 cache.py [cache_dir] [clear]        e.g. python3 cache.py cache")
+        sys.exit(-1)
+    kline_cache = KlineCache(sys.argv[1])
+    if len(sys.argv) > 2 and sys.argv[2] == "clear":
+        kline_cache.clear()
+    count, size = kline_cache.usage()
+    print("`%s`: %d个文件, %.1fMB" % (sys.argv[1], count, size / 1024 ** 2))
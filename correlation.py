@@ -0,0 +1,191 @@
+# 跨币种的联动监控：增量维护各币种分钟收益率相对BTC与综合指数的滚动相关系数与β，识别脱离大盘的走势
+
+import numpy as np
+
+import data_loader
+import indicators
+
+
+BENCHMARKS = ["btc", "index"]    # 基准：BTC，头部币种的等权价格指数 (`price_index.PriceIndex`的收盘价序列)
+DECOUPLE_BASELINE = 0.6    # 长窗口相关系数不低于该值时，视为平时与基准联动
+DECOUPLE_GAP = 0.5    # 短窗口相关系数较长窗口下降超过该值时，视为脱离基准
+
+
+def index_returns(prices):
+    """由价格矩阵 (时间为第0维，缺失为NaN) 计算等权价格指数的收益率，用于由历史数据初始化
+
+    与`price_index.PriceIndex`的构造一致：指数为Σ price_i / init_price_i (基准为各币种的首个价格)，
+    成分变动 (币种的价格缺失) 时链式连接，每分钟只计入前后两分钟均有价格的币种
+    """
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        first = prices[np.argmax(~np.isnan(prices), axis=0), np.arange(prices.shape[1])]
+        ratios = prices / first
+        valid = ~np.isnan(ratios[1:]) & ~np.isnan(ratios[:-1])
+        before = np.where(valid, ratios[:-1], 0).sum(axis=1)
+        now = np.where(valid, ratios[1:], 0).sum(axis=1)
+        return np.where(before > 0, now / before - 1, np.nan)
+
+
+class CoMovement:
+    """各币种相对基准的滚动相关系数与β
+
+    所有币种存于定长数组的各个位置，每分钟以一次向量化计算更新所有币种；
+    每个基准维护短/长两个窗口，短窗口相关系数明显低于长窗口时，识别为脱离基准的走势
+    """
+
+    def __init__(self, windows=(60, data_loader.DAY), btc="BTCUSDT", capacity=256):
+        self.windows = windows
+        self.btc = btc
+        self.symbols = [None] * capacity    # 位置 -> 币种
+        self.slots = {}    # 币种 -> 位置
+        self.last_prices = np.full(capacity, np.nan)
+        self.last_index_level = None    # 上一分钟的价格指数
+        self.correlations = {
+            (benchmark, window): indicators.RollingCorrelation(window, (capacity,))
+            for benchmark in BENCHMARKS for window in windows
+        }
+        self.decoupled = set()    # 当前脱离基准的 (币种, 基准)
+
+    def seed(self, monitors):
+        """由各监控保留的近期价格批量初始化 (按时间戳对齐，缺失为NaN)"""
+
+        for symbol in monitors:
+            self.add(symbol)
+        tics = sorted(set(tic for monitor in monitors.values() for tic in monitor.tics))
+        if len(tics) < 2:
+            return
+        rows = {tic: i for i, tic in enumerate(tics)}
+        prices = np.full((len(tics), len(self.symbols)), np.nan)
+        for symbol, monitor in monitors.items():
+            for tic, price in zip(monitor.tics, monitor.prices.recent):
+                prices[rows[tic], self.slots[symbol]] = price
+        returns = prices[1:] / prices[:-1] - 1
+        benchmarks = {"btc": self._btc_returns(returns), "index": index_returns(prices)}
+        for benchmark, window in self.correlations:
+            self.correlations[benchmark, window] = indicators.RollingCorrelation.from_history(
+                returns, benchmarks[benchmark][:, None], window,
+            )
+        self.last_prices = np.where(np.isnan(prices[-1]), self.last_prices, prices[-1])
+
+    def add(self, symbol):
+        """加入币种 (此前的窗口数据为空，随分钟数据逐步补足)"""
+
+        if symbol in self.slots:
+            return
+        if None not in self.symbols:    # 扩容
+            self._grow()
+        slot = self.symbols.index(None)
+        self.symbols[slot] = symbol
+        self.slots[symbol] = slot
+        self._reset(slot)
+
+    def remove(self, symbol):
+        """移除币种"""
+
+        slot = self.slots.pop(symbol, None)
+        if slot is None:
+            return
+        self.symbols[slot] = None
+        self._reset(slot)
+        self.decoupled = {item for item in self.decoupled if item[0] != symbol}
+
+    def update(self, prices, index_level=None):
+        """并入一分钟的收盘价 `{symbol: price}`，缺失的币种不计入该分钟
+
+        index_level: 该分钟的价格指数 (收盘价口径，见`PriceIndex.value_at`)，为空时该分钟不计入指数基准
+
+        returns: 新出现的脱离基准的 [(symbol, benchmark), ...]
+        """
+
+        current = np.full(len(self.symbols), np.nan)
+        for symbol, price in prices.items():
+            slot = self.slots.get(symbol)
+            if slot is not None:
+                current[slot] = price
+        returns = current / self.last_prices - 1
+        self.last_prices = np.where(np.isnan(current), self.last_prices, current)
+
+        index_return = np.nan
+        if index_level is not None and self.last_index_level is not None:
+            index_return = index_level / self.last_index_level - 1
+        self.last_index_level = index_level
+        benchmarks = {"btc": self._btc_returns(returns[None, :])[0], "index": index_return}
+        for (benchmark, _), correlation in self.correlations.items():
+            correlation.update(returns, benchmarks[benchmark])
+        return self._check_decoupled()
+
+    def correlation(self, symbol, benchmark="btc", window=None):
+        return float(self.correlations[benchmark, window or self.windows[0]].correlation[self.slots[symbol]])
+
+    def beta(self, symbol, benchmark="btc", window=None):
+        return float(self.correlations[benchmark, window or self.windows[0]].beta[self.slots[symbol]])
+
+    def publish(self, monitors):
+        """将相关系数与β写入监控的`indicator_values`，规则中可读取`ind_corr_btc_60m`、`ind_beta_index_1440m`等"""
+
+        arrays = {}
+        for (benchmark, window), correlation in self.correlations.items():
+            arrays["ind_corr_%s_%dm" % (benchmark, window)] = correlation.correlation
+            arrays["ind_beta_%s_%dm" % (benchmark, window)] = correlation.beta
+        for symbol, monitor in monitors.items():
+            slot = self.slots.get(symbol)
+            if slot is None:
+                continue
+            for name, values in arrays.items():
+                monitor.indicator_values[name] = float(values[slot])
+
+    def matrix(self, window=None):
+        """所有币种两两之间的收益率相关系数矩阵 (窗口内数据批量计算)
+
+        returns: symbols, matrix
+        """
+
+        correlation = self.correlations[BENCHMARKS[0], window or self.windows[0]]
+        slots = [slot for slot, symbol in enumerate(self.symbols) if symbol is not None]
+        returns = correlation._x.values()[:, slots]
+        return [self.symbols[slot] for slot in slots], indicators.correlation_matrix(returns)
+
+    def _btc_returns(self, returns):
+        """BTC的收益率序列 (时间为第0维)"""
+
+        btc_slot = self.slots.get(self.btc)
+        return returns[:, btc_slot] if btc_slot is not None else np.full(len(returns), np.nan)
+
+    def _check_decoupled(self):
+        """比较短/长窗口的相关系数，返回新出现的脱离基准的 (symbol, benchmark)"""
+
+        short_window, long_window = self.windows[0], self.windows[-1]
+        decoupled = set()
+        for benchmark in BENCHMARKS:
+            short = self.correlations[benchmark, short_window]
+            long = self.correlations[benchmark, long_window].correlation
+            with np.errstate(invalid="ignore"):
+                mask = (long >= DECOUPLE_BASELINE) & (short.correlation <= long - DECOUPLE_GAP) & (short.count >= short_window * 0.8)
+            for slot in np.flatnonzero(mask):
+                if self.symbols[slot] not in (None, self.btc):
+                    decoupled.add((self.symbols[slot], benchmark))
+        added = sorted(decoupled - self.decoupled)
+        self.decoupled = decoupled
+        return added
+
+    def _reset(self, slot):
+        mask = np.zeros(len(self.symbols), dtype=bool)
+        mask[slot] = True
+        self.last_prices[slot] = np.nan
+        for correlation in self.correlations.values():
+            correlation.reset(mask)
+
+    def _grow(self):
+        """容量加倍 (由当前窗口数据重建)"""
+
+        capacity = len(self.symbols) * 2
+        for key, correlation in self.correlations.items():
+            xs = np.full((correlation._x.count, capacity), np.nan)
+            xs[:, :len(self.symbols)] = correlation._x.values()
+            ys = correlation._y.values()    # 各位置的基准值相同 (数据缺失的位置为NaN)
+            ys = np.where(np.isnan(ys), -np.inf, ys).max(axis=1)
+            ys[np.isinf(ys)] = np.nan
+            self.correlations[key] = indicators.RollingCorrelation.from_history(xs, ys[:, None], key[1])
+        self.symbols += [None] * (capacity - len(self.symbols))
+        self.last_prices = np.concatenate([self.last_prices, np.full(capacity - len(self.last_prices), np.nan)])
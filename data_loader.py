@@ -2,9 +2,12 @@
 
 import os
 import sys
+import json
 import time
-from binance import instance
 
+import binance
+import cache
+import klines
 import utils
 
 
@@ -23,45 +26,57 @@ MONTH = 60 * 24 * 30
 YEAR = 60 * 24 * 365
 TIMESTAMP_UNIT = 1000
 
+# 支持的K线周期 (以分钟计)
+INTERVALS = {
+    "1m": MINUTE,
+    "5m": MINUTE * 5,
+    "15m": MINUTE * 15,
+    "1h": HOUR,
+    "4h": HOUR * 4,
+    "1d": DAY,
+}
+
+
+# 请求失败的处理
+MAX_RETRIES = 3    # 网络问题等造成失败时的最大重试次数，每次的等待时长加倍 (1, 2, 4秒)
+RATE_LIMIT_CODES = (-1003,)    # 触发频率限制 (HTTP 429) 或因此被封禁 (HTTP 418) 的错误码
+RATE_LIMIT_BACKOFF = 60    # 触发频率限制后暂停请求的时长 (秒)，连续触发时加倍
+MAX_BACKOFF = 3600
+
+_rate_limit = {"until": 0, "seconds": 0}    # 频率限制的退避状态 (所有线程共享)
+
+
+def get_interval_ms(interval):
+    """周期对应的毫秒数"""
+    return INTERVALS[interval] * 60 * TIMESTAMP_UNIT
+
 
 class Data:
-    """读取数据文件，生成数据结构体"""
+    """读取数据文件，生成数据结构体
+
+    所有字段以`klines.Klines`按列保存 (`data.klines.high`等)，`tics`/`prices`/`volumes`为开盘时间/收盘价/交易额列的视图
+    """
 
     def __init__(self, file):
 
         print("从`%s`读取数据..." % file)
-        tics = []
-        prices = []
-        volumes = []
-
-        with open(file) as f:
-            for line in f:
-                line = line[:-1].split("\t")
-
-                # 获取当前价格及交易量
-                # 0: 1609294920000,        开盘时间
-                # 1: "27685.07000000",     开盘价
-                # 2: "27690.00000000",     最高价
-                # 3: "27660.62000000",     最低价
-                # 4: "27683.34000000",     收盘价(当前K线未结束的即为最新价)
-                # 5: "52.11377900",        成交量
-                # 6: 1609294979999,        收盘时间
-                # 7: "1442353.58329190",   成交额
-                # 8: 1149,                 成交笔数
-                # 9: "21.07290400",        主动买入成交量
-                # 10: "583235.27944325",    主动买入成交额
-                # 11: "0" ]                 请忽略该参数
-                tic = int(line[0])
-                price = float(line[4])
-                volume = float(line[7])
-
-                tics.append(tic)
-                prices.append(price)
-                volumes.append(volume)
-
-        self.tics = tics
-        self.prices = prices
-        self.volumes = volumes
+
+        # 0: 1609294920000,        开盘时间
+        # 1: "27685.07000000",     开盘价
+        # 2: "27690.00000000",     最高价
+        # 3: "27660.62000000",     最低价
+        # 4: "27683.34000000",     收盘价(当前K线未结束的即为最新价)
+        # 5: "52.11377900",        成交量
+        # 6: 1609294979999,        收盘时间
+        # 7: "1442353.58329190",   成交额
+        # 8: 1149,                 成交笔数
+        # 9: "21.07290400",        主动买入成交量
+        # 10: "583235.27944325",    主动买入成交额
+        # 11: "0" ]                 请忽略该参数
+        self.klines = klines.Klines.from_file(file)
+        self.tics = self.klines.open_time
+        self.prices = self.klines.close
+        self.volumes = self.klines.quote_volume
 
 
 def get_moving_average(prices, interval):
@@ -95,66 +110,142 @@ def get_moving_average(prices, interval):
     return target_prices
 
 
-def update_data_all(data_dir="data", init_data_days=7, verbosity=1):
-    """更新所有数据"""
+def update_data_all(data_dir="data", init_data_days=7, verbosity=1, coins=None):
+    """更新所有数据，`coins`为空时更新`COINS`中的所有币种"""
 
     utils.mkdir(data_dir)
+    if coins is None:
+        coins = COINS
 
     # 遍历所有目标币种，以分钟为单位读取和更新数据
-    for i, coin in enumerate(COINS):
+    for i, coin in enumerate(coins):
         if verbosity:
-            print("%s (%d/%d)" % (coin, i + 1, len(COINS)))
+            print("%s (%d/%d)" % (coin, i + 1, len(coins)))
         update_data(coin, "1m", "%s/%s.1m.data" % (data_dir, coin), init_data_days, verbosity)
 
 
 def update_data(symbol, interval, file, init_data_days=7, verbosity=1):
-    """加载新币种，或更新新数据"""
+    """加载新币种，或更新新数据
+
+    returns: err
+    """
 
     # 新文件从七天前开始取数据，已有文件则继续累积数据
     last_timestamp = get_last_timestamp(file)
     if last_timestamp:
-        init_timestamp = last_timestamp + 60 * TIMESTAMP_UNIT
+        init_timestamp = last_timestamp + INTERVALS[interval] * 60 * TIMESTAMP_UNIT
     else:
         init_timestamp = int(time.time() - init_data_days * 24 * 60 * 60) * TIMESTAMP_UNIT
 
-    # 获取最新数据
-    latest_data = get_latest_data(symbol, interval, init_timestamp, verbosity)
-    with open(file, "a", encoding="utf-8") as f:
-        for item in latest_data:
-            f.write("%s\n" % "\t".join(list(map(str, item))))
+    # 获取最新数据 (响应内容直接转换为数据文件的行)
+    err, lines = get_latest_data(symbol, interval, init_timestamp, verbosity, raw=True)
+    if err is not None:
+        if verbosity:
+            print(err)
+        return err
+    with open(file, "ab") as f:
+        f.writelines(lines)
+    if lines:
+        sync_derived(symbol, file, interval)
+    return None
 
 
-def get_latest_data(symbol, interval, init_timestamp, verbosity=1):
-    """获得最新的区间数据"""
+def sync_derived(symbol, file, interval="1m", items=None, rebuild=False, keep=False):
+    """数据文件追加 (或整理重写) 后，同步由其派生的数据：小时/天汇总表 (见`rollup.py`) 与内存映射存储 (见`store.py`)
 
-    # 根据间隔计算时间戳区间
+    items: 刚追加的K线 (可省去存储从文件读取)
+    rebuild: 文件被整理重写时为True，派生数据从头重建
+    keep: 保留存储的写入方 (见`store.sync`)
+    """
+
+    import rollup
+    import store
+    data_dir = os.path.dirname(file) or "."
     if interval == "1m":
-        timestamp_interval = 500 * 60 * TIMESTAMP_UNIT  # 500条，每条间隔1分钟
+        rollup.catch_up(symbol, data_dir, rebuild=rebuild)
+    store.sync(symbol, data_dir, interval, items=items, rebuild=rebuild, keep=keep)
+
+
+def get_latest_data(symbol, interval, init_timestamp, verbosity=1, now_timestamp=None, raw=False):
+    """获得最新的区间数据，`now_timestamp`为按服务器时间校正的当前时间戳 (默认为本地时间)
+
+    区间跨越完整的500条时按500条的整块对齐请求，已收盘的整块由本地缓存 (见`cache.py`) 提供，只有尚未收盘的末段访问API
+
+    raw: 为True时返回可直接写入数据文件的行 (bytes)，由响应内容直接转换，无逐字段的字符串转换，适用于大批量的历史数据
+
+    网络问题等造成的失败最多重试`MAX_RETRIES`次；错误码响应 (如无效币种) 不再重试；
+    触发频率限制后所有请求暂停`RATE_LIMIT_BACKOFF`秒 (连续触发时加倍)，暂停期间直接返回错误，避免延长封禁
+
+    returns: err, K线列表 (`raw`为True时为数据文件的行)
+    """
+
+    # 根据间隔计算时间戳区间
+    if interval in INTERVALS:
+        timestamp_interval = 500 * INTERVALS[interval] * 60 * TIMESTAMP_UNIT  # 500条
     else:
-        raise ValueError("unsupported interval: %s", interval)
+        raise ValueError("unsupported interval: %s" % interval)
 
     last = -1
-    start_timestamp = init_timestamp
-    now_timestamp = int(time.time() * TIMESTAMP_UNIT)  # 现在
-    if now_timestamp < init_timestamp + 60 + TIMESTAMP_UNIT:    # 时间太近
-        return []
+    offset = now_timestamp - time.time() * TIMESTAMP_UNIT if now_timestamp else 0    # 服务器时间与本地时间的偏差
+    now_timestamp = int(time.time() * TIMESTAMP_UNIT + offset)  # 现在
+    if now_timestamp < init_timestamp + get_interval_ms(interval):    # 起始K线尚未收盘
+        return None, []
     latest_data = []
+    retries = 0
 
-    while True:
-        now = time.time()
-
-        # 睡眠，避免频繁请求
-        if now - last < 0.5:
-            time.sleep(0.5 - now + last)
-            continue
+    # 区间不足一整块时 (如监控中每分钟的更新) 从起始时间请求，避免多余的数据传输
+    kline_cache = cache.get_instance()
+    if kline_cache is not None and now_timestamp - init_timestamp >= timestamp_interval:
+        start_timestamp = init_timestamp // timestamp_interval * timestamp_interval
+    else:
+        start_timestamp = init_timestamp
 
-        # 获取数据
+    while True:
         end_timestamp = start_timestamp + timestamp_interval - 1
-        err, data = instance.get_interval_prices(symbol, interval, start_timestamp, end_timestamp)
-        if err is not None:    # 网络问题等造成失败，重试
-            time.sleep(1)
-            continue
-        latest_data += data
+        closed = (
+            kline_cache is not None
+            and start_timestamp % timestamp_interval == 0
+            and end_timestamp + get_interval_ms(interval) < now_timestamp    # 整块已收盘 (留出一根K线的余量)
+        )
+
+        # 读取缓存
+        data = kline_cache.get(symbol, interval, start_timestamp, end_timestamp) if closed else None
+        if data is None:
+            if time.time() < _rate_limit["until"]:    # 频率限制的暂停期间
+                return "获取%s K线失败: 触发频率限制，%d秒后恢复请求" % (symbol, _rate_limit["until"] - time.time()), []
+
+            # 睡眠，避免频繁请求
+            now = time.time()
+            if now - last < 0.5:
+                time.sleep(0.5 - now + last)
+
+            # 获取数据
+            err, data = binance.get_instance().get_interval_prices(symbol, interval, start_timestamp, end_timestamp, raw=raw or closed)
+            last = time.time()
+            code = None
+            if err is None:
+                err, code = _check_response(data, raw or closed)
+            if code in RATE_LIMIT_CODES:
+                _rate_limit["seconds"] = min(max(_rate_limit["seconds"] * 2, RATE_LIMIT_BACKOFF), MAX_BACKOFF)
+                _rate_limit["until"] = time.time() + _rate_limit["seconds"]
+                return "获取%s K线失败: %s，暂停请求%d秒" % (symbol, err, _rate_limit["seconds"]), []
+            if code is not None:    # 无效币种等，重试无意义
+                return "获取%s K线失败: %s" % (symbol, err), []
+            if err is not None:    # 网络问题等造成失败，重试
+                if retries >= MAX_RETRIES:
+                    return "获取%s K线失败: %s" % (symbol, err), []
+                time.sleep(2 ** retries)
+                retries += 1
+                continue
+            _rate_limit["seconds"] = 0
+            if closed:
+                kline_cache.put(symbol, interval, start_timestamp, end_timestamp, data)
+        if closed and not raw:
+            data = json.loads(data)
+        if raw:
+            latest_data.append(data)
+        else:
+            latest_data += data
 
         # 计算并打印当前进度
         process = (start_timestamp + timestamp_interval - init_timestamp) / (now_timestamp - init_timestamp) * 100
@@ -165,12 +256,51 @@ def get_latest_data(symbol, interval, init_timestamp, verbosity=1):
             print("[%.2f%%]" % process)
 
         # 进入下一次批数据
-        last = time.time()
         start_timestamp += timestamp_interval
         if start_timestamp > now_timestamp:    # 结束
             break
 
-    return latest_data
+    # 丢弃尚未收盘的K线，避免未完成的数据写入文件
+    now_timestamp = int(time.time() * TIMESTAMP_UNIT + offset)
+    if raw:
+        return None, _decode(latest_data, init_timestamp, now_timestamp)
+    return None, [item for item in latest_data if init_timestamp <= item[0] and int(item[6]) < now_timestamp]
+
+
+def _check_response(data, raw):
+    """检查K线接口的响应：币安以`{"code": 错误码, "msg": 说明}`返回错误
+
+    returns: err, 错误码 (非错误码响应的格式错误为None)
+    """
+
+    if raw:
+        if data.startswith(b"["):
+            return None, None
+        try:
+            data = json.loads(data)
+        except ValueError:
+            return "无法解析的响应: %r" % data[:100], None
+    elif isinstance(data, list):
+        return None, None
+    if isinstance(data, dict) and "code" in data:
+        return "%s (%s)" % (data.get("msg"), data["code"]), data["code"]
+    return "无法解析的响应: %s" % str(data)[:100], None
+
+
+def _decode(bodies, init_timestamp, now_timestamp):
+    """解析K线接口的响应内容，丢弃起始时间之前 (整块对齐时) 与尚未收盘的K线
+
+    只解析用于截取的开盘/收盘时间两列，其余字段原样转换为数据文件的行
+
+    returns: lines
+    """
+
+    bodies = [body for body in bodies if body.strip() != b"[]"]
+    columns = klines.decode_columns(b",".join(bodies), ["open_time", "close_time"])
+    lines = [line for body in bodies for line in klines.decode_lines(body)]
+    start = int((columns["open_time"] < init_timestamp).sum())    # K线按时间排序
+    end = int((columns["close_time"] < now_timestamp).sum())    # 已收盘的K线在前
+    return lines[start:end]
 
 
 def get_last_timestamp(file):
@@ -0,0 +1,414 @@
+# 增量计算的滚动指标：每条K线O(1)更新，可由历史数据批量初始化，支持多币种向量化计算
+#
+# 各指标的输入既可以是单个数值，也可以是形状为(币种数,)的数组，此时对所有币种同时计算
+
+import collections
+
+import numpy as np
+
+
+class EMA:
+    """指数移动平均"""
+
+    def __init__(self, span=None, alpha=None):
+        if alpha is None:
+            alpha = 2 / (span + 1)
+        self.alpha = alpha
+        self.value = None
+
+    @classmethod
+    def from_history(cls, values, span=None, alpha=None):
+        """由历史数据 (时间为第0维) 批量初始化"""
+
+        ema = cls(span, alpha)
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return ema
+        n = len(values)
+        weights = ema.alpha * (1 - ema.alpha) ** np.arange(n - 1, -1, -1)
+        weights[0] = (1 - ema.alpha) ** (n - 1)    # 首个数据点作为初始值
+        ema.value = np.tensordot(weights, values, axes=(0, 0))
+        return ema
+
+    def update(self, value):
+        if self.value is None:
+            self.value = np.asarray(value, dtype=np.float64)
+        else:
+            self.value = self.value + self.alpha * (value - self.value)
+        return self.value
+
+
+class _Window:
+    """定长环形缓冲区，保存窗口内的原始值"""
+
+    def __init__(self, window, shape=()):
+        self.window = window
+        self.buffer = np.zeros((window,) + tuple(shape), dtype=np.float64)
+        self.pos = 0    # 下一个写入位置
+        self.count = 0    # 窗口内的数据量
+
+    def push(self, value):
+        """写入新值，返回移出窗口的旧值 (窗口未满时为None)"""
+
+        old = self.buffer[self.pos].copy() if self.count == self.window else None
+        self.buffer[self.pos] = value
+        self.pos = (self.pos + 1) % self.window
+        self.count = min(self.count + 1, self.window)
+        return old
+
+    def values(self):
+        """窗口内的数据 (按时间顺序)"""
+        if self.count < self.window:
+            return self.buffer[:self.count]
+        return np.roll(self.buffer, -self.pos, axis=0)
+
+    def fill(self, values):
+        """以历史数据填充 (取最后`window`条)"""
+
+        values = np.asarray(values, dtype=np.float64)[-self.window:]
+        self.buffer[:len(values)] = values
+        self.count = len(values)
+        self.pos = len(values) % self.window
+
+
+class RollingVariance:
+    """滚动均值/方差 (Welford算法的滑动窗口形式，数值稳定)"""
+
+    def __init__(self, window, shape=(), ddof=0):
+        self._window = _Window(window, shape)
+        self.ddof = ddof
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)    # 离差平方和
+
+    @classmethod
+    def from_history(cls, values, window, ddof=0):
+        values = np.asarray(values, dtype=np.float64)
+        variance = cls(window, values.shape[1:], ddof)
+        tail = values[-window:]
+        variance._window.fill(tail)
+        if len(tail):
+            variance.mean = tail.mean(axis=0)
+            variance.m2 = ((tail - variance.mean) ** 2).sum(axis=0)
+        return variance
+
+    def update(self, value):
+        value = np.asarray(value, dtype=np.float64)
+        old = self._window.push(value)
+        if old is None:    # 窗口未满：加入新值
+            delta = value - self.mean
+            self.mean = self.mean + delta / self._window.count
+            self.m2 = self.m2 + delta * (value - self.mean)
+        else:    # 窗口已满：以新值替换旧值
+            mean = self.mean + (value - old) / self._window.window
+            self.m2 = self.m2 + (value - old) * (value - mean + old - self.mean)
+            self.mean = mean
+        self.m2 = np.maximum(self.m2, 0)    # 消除舍入误差造成的负数
+        return self.variance
+
+    @property
+    def count(self):
+        return self._window.count
+
+    @property
+    def variance(self):
+        n = self._window.count - self.ddof
+        return self.m2 / n if n > 0 else np.zeros_like(self.m2)
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+
+class ZScore:
+    """滚动Z值：新值相对此前窗口均值的标准差倍数"""
+
+    def __init__(self, window, shape=()):
+        self.variance = RollingVariance(window, shape)
+        self.value = None
+
+    @classmethod
+    def from_history(cls, values, window):
+        zscore = cls(window)
+        zscore.variance = RollingVariance.from_history(values, window)
+        return zscore
+
+    def update(self, value):
+        std = self.variance.std
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.value = np.where(std > 0, (value - self.variance.mean) / std, 0.0)
+        self.variance.update(value)
+        return self.value
+
+
+class VWAP:
+    """滚动成交量加权均价 = 窗口内成交额之和 / 成交量之和"""
+
+    def __init__(self, window, shape=()):
+        self._quote = _Window(window, shape)
+        self._base = _Window(window, shape)
+        self.quote_sum = np.zeros(shape)
+        self.base_sum = np.zeros(shape)
+        self._updates = 0
+
+    @classmethod
+    def from_history(cls, quote_volumes, base_volumes, window):
+        quote_volumes = np.asarray(quote_volumes, dtype=np.float64)
+        vwap = cls(window, quote_volumes.shape[1:])
+        vwap._quote.fill(quote_volumes)
+        vwap._base.fill(base_volumes)
+        vwap._resync()
+        return vwap
+
+    def update(self, quote_volume, base_volume):
+        old_quote = self._quote.push(quote_volume)
+        old_base = self._base.push(base_volume)
+        self.quote_sum = self.quote_sum + quote_volume - (0 if old_quote is None else old_quote)
+        self.base_sum = self.base_sum + base_volume - (0 if old_base is None else old_base)
+
+        # 每经过一个窗口长度重新求和，消除累计的舍入误差 (均摊O(1))
+        self._updates += 1
+        if self._updates % self._quote.window == 0:
+            self._resync()
+        return self.value
+
+    def _resync(self):
+        self.quote_sum = self._quote.values().sum(axis=0)
+        self.base_sum = self._base.values().sum(axis=0)
+
+    @property
+    def value(self):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(self.base_sum > 0, self.quote_sum / self.base_sum, np.nan)
+
+
+class RollingHighLow:
+    """滚动最高/最低值
+
+    新值只需与当前极值比较；仅当移出窗口的旧值恰为极值时，才重新扫描对应币种的窗口 (均摊O(1))
+    """
+
+    def __init__(self, window, shape=()):
+        self._window = _Window(window, shape)
+        self.high = np.full(shape, -np.inf)
+        self.low = np.full(shape, np.inf)
+
+    @classmethod
+    def from_history(cls, values, window):
+        values = np.asarray(values, dtype=np.float64)
+        high_low = cls(window, values.shape[1:])
+        high_low._window.fill(values)
+        if high_low._window.count:
+            high_low.high = high_low._window.values().max(axis=0)
+            high_low.low = high_low._window.values().min(axis=0)
+        return high_low
+
+    def update(self, value):
+        value = np.asarray(value, dtype=np.float64)
+        old = self._window.push(value)
+        self.high = np.maximum(self.high, value)
+        self.low = np.minimum(self.low, value)
+        if old is not None:
+            stale = ((old == self.high) & (value != self.high)) | ((old == self.low) & (value != self.low))
+            if np.any(stale):
+                values = self._window.values()
+                self.high = np.where(stale, values.max(axis=0), self.high)
+                self.low = np.where(stale, values.min(axis=0), self.low)
+        return self.high, self.low
+
+
+class MonotonicExtrema:
+    """基于单调队列的时间窗口最高/最低值，并记录极值出现的时间
+
+    队列中只保留可能成为极值的数据点，每个数据点最多入队、出队各一次，均摊O(1)；
+    窗口按时间戳划分，保留开盘时间在`(最新时间 - window_ms, 最新时间]`内的数据点
+    """
+
+    def __init__(self, window_ms):
+        self.window_ms = window_ms
+        self._high = collections.deque()    # (tic, value)，value单调递减
+        self._low = collections.deque()    # (tic, value)，value单调递增
+
+    def update(self, tic, value):
+        while self._high and self._high[-1][1] <= value:
+            self._high.pop()
+        self._high.append((tic, value))
+        while self._low and self._low[-1][1] >= value:
+            self._low.pop()
+        self._low.append((tic, value))
+
+        # 移出窗口
+        while self._high[0][0] <= tic - self.window_ms:
+            self._high.popleft()
+        while self._low[0][0] <= tic - self.window_ms:
+            self._low.popleft()
+
+    @property
+    def high(self):
+        return self._high[0][1] if self._high else None
+
+    @property
+    def high_tic(self):
+        return self._high[0][0] if self._high else None
+
+    @property
+    def low(self):
+        return self._low[0][1] if self._low else None
+
+    @property
+    def low_tic(self):
+        return self._low[0][0] if self._low else None
+
+
+class SparseTable:
+    """稀疏表：O(n log n)预处理后，以O(1)查询任意区间的最大/最小值及其位置，用于历史数据的批量回放"""
+
+    def __init__(self, values, mode="max"):
+        self.values = np.asarray(values, dtype=np.float64)
+        self.mode = mode
+        n = len(self.values)
+        self.table = [np.arange(n)]    # table[k][i]: 区间[i, i + 2^k)中极值的位置
+        k = 1
+        while (1 << k) <= n:
+            prev = self.table[-1]
+            half = 1 << (k - 1)
+            left = prev[:n - (1 << k) + 1]
+            right = prev[half:half + n - (1 << k) + 1]
+            self.table.append(self._pick(left, right))
+            k += 1
+
+    def _pick(self, left, right):
+        """两组位置中取极值所在的位置 (相等时取靠后的位置)"""
+        if self.mode == "max":
+            return np.where(self.values[right] >= self.values[left], right, left)
+        return np.where(self.values[right] <= self.values[left], right, left)
+
+    def query(self, left, right):
+        """区间[left, right]中极值的位置，`left`/`right`可以为数组
+
+        returns: 位置 (极值为`values[位置]`)
+        """
+
+        left = np.asarray(left)
+        right = np.asarray(right)
+        k = np.floor(np.log2(right - left + 1)).astype(int)
+        result = np.empty(np.broadcast(left, right).shape, dtype=int)
+        for level in np.unique(k):
+            selected = k == level
+            l = np.broadcast_to(left, result.shape)[selected]
+            r = np.broadcast_to(right, result.shape)[selected] - (1 << level) + 1
+            result[selected] = self._pick(self.table[level][l], self.table[level][r])
+        return result
+
+
+def rolling_extrema(values, window, mode="max"):
+    """批量计算每个时间点往前`window`个数据点 (含当前) 的极值位置
+
+    returns: 位置数组
+    """
+
+    table = SparseTable(values, mode)
+    right = np.arange(len(table.values))
+    left = np.maximum(right - window + 1, 0)
+    return table.query(left, right)
+
+
+class RollingCorrelation:
+    """滚动相关系数与β (x相对y)：维护窗口内Σx、Σy、Σx²、Σy²、Σxy，每条K线O(1)更新
+
+    x或y为NaN (数据缺失) 的数据点不计入对应序列的统计；每经过一个窗口长度由窗口数据批量重算，消除累计的舍入误差
+    """
+
+    def __init__(self, window, shape=()):
+        self._x = _Window(window, shape)
+        self._y = _Window(window, shape)
+        self.sums = np.zeros((5,) + tuple(shape))    # Σx, Σy, Σx², Σy², Σxy
+        self.count = np.zeros(shape)    # 窗口内的有效数据量
+        self._updates = 0
+
+    @classmethod
+    def from_history(cls, xs, ys, window):
+        """由历史数据 (时间为第0维) 批量初始化，`ys`可广播到`xs`的形状"""
+
+        xs, ys = np.broadcast_arrays(np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64))
+        correlation = cls(window, xs.shape[1:])
+        correlation._x.fill(xs)
+        correlation._y.fill(ys)
+        correlation._resync()
+        return correlation
+
+    def update(self, x, y):
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))
+        missing = np.isnan(x) | np.isnan(y)
+        x = np.where(missing, np.nan, x)
+        y = np.where(missing, np.nan, y)
+        old_x = self._x.push(x)
+        old_y = self._y.push(y)
+
+        terms, valid = self._terms(x, y)
+        self.sums = self.sums + terms
+        self.count = self.count + valid
+        if old_x is not None:
+            terms, valid = self._terms(old_x, old_y)
+            self.sums = self.sums - terms
+            self.count = self.count - valid
+
+        # 每经过一个窗口长度重新求和 (均摊O(1))
+        self._updates += 1
+        if self._updates % self._x.window == 0:
+            self._resync()
+        return self.correlation
+
+    def reset(self, mask):
+        """清空`mask`选中的序列 (如移出监控的币种所占的位置)"""
+
+        self._x.buffer[:, mask] = np.nan
+        self._y.buffer[:, mask] = np.nan
+        self.sums[:, mask] = 0
+        self.count[mask] = 0
+
+    @staticmethod
+    def _terms(x, y):
+        """各累加项，以及数据是否有效"""
+        valid = ~(np.isnan(x) | np.isnan(y))
+        x = np.where(valid, x, 0)
+        y = np.where(valid, y, 0)
+        return np.stack([x, y, x * x, y * y, x * y]), valid
+
+    def _resync(self):
+        terms, valid = self._terms(self._x.values(), self._y.values())
+        self.sums = terms.sum(axis=1)
+        self.count = valid.sum(axis=0).astype(np.float64)
+
+    def _moments(self):
+        """n²倍的协方差与方差 (避免除法)"""
+        sx, sy, sxx, syy, sxy = self.sums
+        n = self.count
+        return n * sxy - sx * sy, n * sxx - sx * sx, n * syy - sy * sy
+
+    @property
+    def correlation(self):
+        covariance, variance_x, variance_y = self._moments()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where((variance_x > 0) & (variance_y > 0), covariance / np.sqrt(variance_x * variance_y), np.nan)
+
+    @property
+    def beta(self):
+        covariance, _, variance_y = self._moments()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(variance_y > 0, covariance / variance_y, np.nan)
+
+
+def correlation_matrix(values):
+    """批量计算多个序列两两之间的相关系数矩阵 (时间为第0维，返回形状为(序列数, 序列数))
+
+    缺失值 (NaN) 以该序列的均值填充，即不贡献协方差
+    """
+
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    mean = np.where(valid, values, 0).sum(axis=0) / np.maximum(valid.sum(axis=0), 1)
+    centered = np.where(valid, values - mean, 0)
+    norms = np.sqrt((centered ** 2).sum(axis=0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        standardized = centered / np.where(norms > 0, norms, np.nan)
+    return standardized.T @ standardized
@@ -0,0 +1,195 @@
+# K线数据完整性：检测缺失/重复的K线，并发补齐缺失区间，整理数据文件
+
+import os
+import sys
+import time
+import concurrent.futures
+
+import binance
+import data_loader
+
+
+def read_timestamps(file):
+    """读取数据文件中各行的开盘时间"""
+
+    tics = []
+    with open(file, encoding="utf-8") as f:
+        for line in f:
+            tics.append(int(line[:line.index("\t")]))
+    return tics
+
+
+def find_gaps(tics, interval="1m"):
+    """根据排序后的开盘时间查找缺失区间与重复数量
+
+    returns: gaps, duplicates
+        gaps: [(首个缺失K线的开盘时间, 末个缺失K线的开盘时间), ...]
+        duplicates: 重复的K线数量
+    """
+
+    unit = data_loader.get_interval_ms(interval)
+    gaps = []
+    duplicates = 0
+    tics = sorted(tics)
+    for i in range(1, len(tics)):
+        delta = tics[i] - tics[i - 1]
+        if delta == 0:
+            duplicates += 1
+        elif delta > unit:
+            gaps.append((tics[i - 1] + unit, tics[i] - unit))
+    return gaps, duplicates
+
+
+def scan(file, interval="1m"):
+    """检查数据文件
+
+    returns: {
+        "count": K线数量,
+        "gaps": 缺失区间,
+        "missing": 缺失K线数量,
+        "duplicates": 重复K线数量,
+        "unsorted": 是否存在乱序,
+    }
+    """
+
+    tics = read_timestamps(file)
+    gaps, duplicates = find_gaps(tics, interval)
+    unit = data_loader.get_interval_ms(interval)
+    return {
+        "count": len(tics),
+        "gaps": gaps,
+        "missing": sum((end - start) // unit + 1 for start, end in gaps),
+        "duplicates": duplicates,
+        "unsorted": any(tics[i] < tics[i - 1] for i in range(1, len(tics))),
+    }
+
+
+def backfill(symbol, gaps, interval="1m", workers=4, retries=3):
+    """并发请求缺失区间的K线，每个请求最多500条
+
+    returns: 获取到的K线 (按开盘时间排序)
+    """
+
+    # 将缺失区间切分为批次
+    unit = data_loader.get_interval_ms(interval)
+    batches = []
+    for start, end in gaps:
+        while start <= end:
+            batch_end = min(start + 499 * unit, end)
+            batches.append((start, batch_end + unit - 1))
+            start = batch_end + unit
+
+    def fetch(batch):
+        for _ in range(retries):
+            err, data = binance.get_instance().get_interval_prices(symbol, interval, batch[0], batch[1])
+            if err is None and isinstance(data, list):
+                return data
+            time.sleep(1)
+        return []
+
+    items = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for data in executor.map(fetch, batches):
+            items += data
+    items.sort(key=lambda item: int(item[0]))
+    return items
+
+
+def compact(file, items=()):
+    """合并新数据，按开盘时间去重、排序后重写文件 (写入临时文件后替换，避免写入中断损坏数据)
+
+    returns: 重写后的K线数量
+    """
+
+    # 以开盘时间为键，后出现的数据覆盖先出现的数据
+    rows = {}
+    if os.path.exists(file):
+        with open(file, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    rows[int(line[:line.index("\t")])] = line if line.endswith("\n") else line + "\n"
+    for item in items:
+        rows[int(item[0])] = "%s\n" % "\t".join(map(str, item))
+
+    tmp_file = file + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        for tic in sorted(rows):
+            f.write(rows[tic])
+    os.replace(tmp_file, file)
+    return len(rows)
+
+
+def repair(symbol, file, interval="1m", workers=4, verbosity=1):
+    """检查数据文件，补齐缺失区间并去重整理
+
+    returns: 检查结果 (见`scan`)
+    """
+
+    report = scan(file, interval)
+    items = []
+    if report["gaps"]:
+        items = backfill(symbol, report["gaps"], interval, workers)
+    if items or report["duplicates"] or report["unsorted"]:
+        compact(file, items)
+        data_loader.sync_derived(symbol, file, interval, rebuild=True)    # 补齐的K线插入在文件中间，派生数据需重建
+    if verbosity:
+        print("%s: %d条, 缺失%d条 (%d处, 补齐%d条), 重复%d条%s" % (
+            symbol,
+            report["count"],
+            report["missing"],
+            len(report["gaps"]),
+            len(items),
+            report["duplicates"],
+            ", 存在乱序" if report["unsorted"] else "",
+        ))
+    return report
+
+
+def repair_all(data_dir="data", interval="1m", workers=4, verbosity=1):
+    """检查并修复数据目录中所有指定周期的数据文件"""
+
+    suffix = ".%s.data" % interval
+    for file in sorted(os.listdir(data_dir)):
+        if file.endswith(suffix):
+            repair(file[:-len(suffix)], "%s/%s" % (data_dir, file), interval, workers, verbosity)
+
+
+def align(symbol, items, last_timestamp, last_close=None, interval="1m"):
+    """实时数据对齐：去除已记录的K线，补齐与上一条记录之间缺失的K线
+
+    无法补齐的分钟 (如交易暂停) 以上一收盘价、零交易额的K线填充，仅用于保持监控窗口对齐，不写入文件
+
+    returns: feed_items, save_items (供监控更新的连续K线, 需写入文件的K线)
+    """
+
+    unit = data_loader.get_interval_ms(interval)
+    merged = {int(item[0]): item for item in items if int(item[0]) > last_timestamp}    # 去重
+    if not merged:
+        return [], []
+
+    # 补齐缺失区间
+    gaps, _ = find_gaps([last_timestamp] + list(merged), interval)
+    if gaps:
+        for item in backfill(symbol, gaps, interval):
+            merged.setdefault(int(item[0]), item)
+    save_items = [merged[tic] for tic in sorted(merged)]
+
+    # 填充仍然缺失的分钟
+    feed_items = []
+    for item in save_items:
+        tic = int(item[0])
+        while last_close is not None and tic - unit > last_timestamp:
+            last_timestamp += unit
+            feed_items.append([last_timestamp, last_close, last_close, last_close, last_close, "0", last_timestamp + unit - 1, "0", 0, "0", "0", "0"])
+        feed_items.append(item)
+        last_timestamp = tic
+        last_close = item[4]
+    return feed_items, save_items
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) < 2:
+        print("Usage: python3 integrity.py [data_dir]        e.g. python3 integrity.py data")
+        sys.exit(-1)
+    repair_all(data_dir=sys.argv[1])
@@ -1,12 +1,45 @@
 # 主程序，监控市场，提供行情提示
 
 import os
+import sys
 import time
-import pygame
+import collections
+import concurrent.futures
 
-from binance import instance
+import binance
+import book
+import correlation
 import data_loader
+import indicators
+import integrity
+import portfolio as portfolio_lib
+import price_index
+import resample
+import rules
+import scheduler
+import store
+import trades
+import universe
 import utils
+import window
+
+
+SNAPSHOT_INTERVAL = 3    # 快照模式下全市场价格的轮询间隔 (秒)
+BURST_WORKERS = 8    # K线收盘后并发请求的线程数
+BURST_RETRIES = 5    # K线收盘后请求的最多轮数 (交易所数据尚未就绪时重试)
+
+_mixer = None
+
+
+def play_alarm():
+    """播放提示音，首次调用时才加载pygame"""
+    global _mixer
+    if _mixer is None:
+        import pygame
+        pygame.mixer.init()
+        pygame.mixer.music.load("refs/alarm.mp3")
+        _mixer = pygame.mixer
+    _mixer.music.play()
 
 
 class Monitor:
@@ -18,181 +51,502 @@ class Monitor:
         tics,                                   # 时间戳
         prices,                                 # 价格
         volumes,                                # 交易额
-        volume_break_out_ratio=10,              # 超出均交易额多大比例认为交易额突增
+        high=None,                              # 最新K线的最高价，为空时等于最新价
+        low=None,                               # 最新K线的最低价，为空时等于最新价
+        taker_volume=0.0,                       # 最新K线的主动买入交易额
     ):
         self.symbol = symbol
-        self.tics = tics
-        self.prices = prices
-        self.volumes = volumes
-        self.volume_break_out_ratio = volume_break_out_ratio
-        self.last_alarm = None    # 上一次提示内容
+        self.prices = window.MultiResolutionWindow.from_history(tics, prices, short_windows=(7, 420))    # 价格
+        self.volumes = window.MultiResolutionWindow.from_history(tics, volumes, short_windows=(420,))    # 交易额
+        self.tics = collections.deque(tics[-len(self.prices):], maxlen=len(self.prices.recent))
+        self.high = prices[-1] if high is None else high    # 最新K线的最高价
+        self.low = prices[-1] if low is None else low    # 最新K线的最低价
+        self.taker_volume = taker_volume    # 最新K线的主动买入交易额
+        self.last_alarm = None    # 上一次提示的规则组
         self.last_alarm_tic = -1    # 上一次提示时间戳 (避免同一条信息重复提醒)
+        self.indices = []    # 该币种所属的价格指数，K线收盘时同步更新
+        self.live_indices = []    # 需要实时价格的指标 (如持仓价值)，快照价格也同步更新
+        self.resampler = None    # 多周期K线合成器，规则可通过`resampler.bars`直接使用5m/15m/1h/1d等收盘K线
+        self.indicators = {}    # 滚动指标 name -> (indicator, inputs)
+        self.indicator_values = {}    # 滚动指标的最新值，规则中以`ind_`开头的特征读取
+        self.extrema = {}    # 窗口分钟数 -> 窗口最高/最低价 (单调队列，含最新收盘价)
+        self.candle_extrema = {}    # 窗口分钟数 -> 最新收盘价之前的窗口 (low, low_tic, high, high_tic)
+        self._update_means()
 
-        self.ma_7m_price = data_loader.get_moving_average(prices, "7m")[-1]    # 7分钟滑动平均价
-        self.ma_7h_price = data_loader.get_moving_average(prices, "7h")[-1]    # 7小时滑动平均价
-        self.ma_7h_volume = data_loader.get_moving_average(volumes, "7h")[-1]    # 7日滑动平均交易额
-        self.ma_7d_price = data_loader.get_moving_average(prices, "7d")[-1]    # 7日滑动平均价
-        self.ma_7d_volume = data_loader.get_moving_average(volumes, "7d")[-1]    # 7日滑动平均交易额
+    def track_extrema(self, minutes):
+        """跟踪`minutes`分钟窗口内的最高/最低价 (以保留的近期价格初始化，更长的窗口随运行补足)"""
 
-    def update(self, tic, price, volume):
+        if minutes in self.extrema:
+            return
+        extrema = indicators.MonotonicExtrema(minutes * 60 * data_loader.TIMESTAMP_UNIT)
+        for tic, price in zip(list(self.tics)[:-1], list(self.prices.recent)[:-1]):
+            extrema.update(tic, price)
+        self.candle_extrema[minutes] = (extrema.low, extrema.low_tic, extrema.high, extrema.high_tic)
+        extrema.update(self.tics[-1], self.prices[-1])
+        self.extrema[minutes] = extrema
+
+    def add_indicator(self, name, indicator, inputs):
+        """加入滚动指标，每条K线以`inputs(tic, price, volume)`的返回值更新"""
+        self.indicators[name] = (indicator, inputs)
+
+    def _update_means(self):
+        self.ma_7m_price = self.prices.mean(7)    # 7分钟滑动平均价
+        self.ma_7h_price = self.prices.mean(420)    # 7小时滑动平均价
+        self.ma_7h_volume = self.volumes.mean(420)    # 7小时滑动平均交易额
+        self.ma_7d_price = self.prices.mean(data_loader.DAY * 7)    # 7日滑动平均价
+        self.ma_7d_volume = self.volumes.mean(data_loader.DAY * 7)    # 7日滑动平均交易额
+
+    def update(self, tic, price, volume, high=None, low=None, taker_volume=0.0):
         """更新最新数据"""
-        self.ma_7m_price += price / 7 - self.prices[-7] / 7
-        self.ma_7h_price += price / 420 - self.prices[-420] / 420
-        self.ma_7h_volume += volume / 420 - self.volumes[-420] / 420
-        self.ma_7d_price += price / 10080 - self.prices[-10080] / 10080
-        self.ma_7d_volume += volume / 10080 - self.volumes[-10080] / 10080
+        self.high = price if high is None else high
+        self.low = price if low is None else low
+        self.taker_volume = taker_volume
+        for minutes, extrema in self.extrema.items():    # 收盘价规则与此前的窗口比较
+            self.candle_extrema[minutes] = (extrema.low, extrema.low_tic, extrema.high, extrema.high_tic)
+            extrema.update(tic, price)
         self.tics.append(tic)
-        self.prices.append(price)
-        self.volumes.append(volume)
-        self.tics.pop(0)
-        self.prices.pop(0)
-        self.volumes.pop(0)
-
-    def implement(self):
-        """执行监控，同类提示每10分钟最多一次"""
-
-        tic = self.tics[-1]
-        price = self.prices[-1]
-        volume = self.volumes[-1]
-
-        # 突破7天/7小时均交易额一定倍数，且在50万美元以上；价格大于7天/7小时/7分钟均价
-        if (volume > self.ma_7d_volume * self.volume_break_out_ratio and volume > self.ma_7h_volume * self.volume_break_out_ratio) and \
-                (price > self.ma_7d_price and price > self.ma_7h_price and price > self.ma_7m_price) and volume > 1000000:
-
-            if self.last_alarm != 1 or time.time() - self.last_alarm_tic > 600:
-                print("%s >>> %s, $%s, 交易额突增%.1f倍 ($%d万)" % (
-                    utils.tic2time(tic),
-                    self.symbol,
-                    utils.standardize(price),
-                    volume / self.ma_7h_volume - 1,
-                    int(volume/10000),
-                ))
-                pygame.mixer.music.play()    # 播放提示音
-                self.last_alarm = 1
-                self.last_alarm_tic = time.time()
-            return
+        self.prices.append(tic, price)
+        self.volumes.append(tic, volume)
+        self._update_means()
+        for name, (indicator, inputs) in self.indicators.items():
+            self.indicator_values[name] = indicator.update(*inputs(tic, price, volume))
+        for index in self.indices + self.live_indices:
+            index.update(self.symbol, price, tic)
 
-        # 一定时间内价格上涨5%
-        for i in range(1, 10):
-            if price < self.prices[-1-i] * 1.05:
-                continue
-
-            if self.last_alarm != 1 or time.time() - self.last_alarm_tic > 600:
-                print("%s >>> %s, $%s, %s分钟内价格上涨%.1f%%" % (
-                    utils.tic2time(tic),
-                    self.symbol,
-                    utils.standardize(price),
-                    i,
-                    (price / self.prices[-1-i] - 1) * 100,
-                ))
-                pygame.mixer.music.play()    # 播放提示音
-                self.last_alarm = 1
-                self.last_alarm_tic = time.time()
-            return
+    def update_snapshot(self, tic, price):
+        """以全市场快照的最新价 (当前K线尚未收盘) 更新实时指标；价格指数只计收盘价，不受快照影响"""
+        for index in self.live_indices:
+            index.update(self.symbol, price, tic)
 
-        # 一定时间内价格下跌1%
-        if self.symbol not in {"BTCUSDT"}:
-            return
-        for i in range(1, 10):
-            if price > self.prices[-1-i] * 0.99:
-                continue
-
-            # 一键平仓 (建议开启)
-            err, info = instance.sell_all()
-            if err is None and info["success"]:
-                print("\033[1;31m%s <<< 强制平仓\033[0m" % (
-                    utils.tic2time(tic),
-                ))
 
-            if self.last_alarm != -1 or time.time() - self.last_alarm_tic > 600:
-                print("\033[1;31m%s >>> %s, $%s, %s分钟内价格下跌%.1f%%\033[0m" % (    # 显示红色字体
-                    utils.tic2time(tic),
-                    self.symbol,
-                    utils.standardize(price),
-                    i,
-                    (1 - price / self.prices[-1-i]) * 100,
-                ))
-                for _ in range(5):
-                    pygame.mixer.music.play()    # 重复播放提示音
-                    time.sleep(0.5)
-                self.last_alarm = -1
-                self.last_alarm_tic = time.time()
-            return
+def alarm(monitor, tic, times=1):
+    """提示动作：播放提示音`times`次"""
+    for i in range(times):
+        play_alarm()
+        if i < times - 1:
+            time.sleep(0.5)
 
 
-if __name__ == "__main__":
+def sell_all(monitor, tic, _):
+    """平仓动作：一键平仓"""
+    err, info = binance.get_instance().sell_all()
+    if err is None and info["success"]:
+        print("\033[1;31m%s <<< 强制平仓\033[0m" % (
+            utils.tic2time(tic),
+        ))
+
+
+def load_monitor(coin, data_dir="data", update=False):
+    """读取历史数据并创建监控，数据不满足监控条件时返回None"""
+
+    file = "%s/%s.1m.data" % (data_dir, coin)
+    if update:
+        data_loader.update_data(coin, "1m", file, verbosity=0)
+    if not os.path.exists(file):
+        return None
+    data = data_loader.Data(file)    # 读取历史数据
+    if len(data.prices) < data_loader.DAY * 7:    # 数据不满足监控条件（需要计算滑动平均价/交易额）
+        return None
+    monitor = Monitor(    # 创建模型
+        coin,
+        data.tics[-data_loader.DAY*7:].tolist(),
+        data.prices[-data_loader.DAY*7:].tolist(),
+        data.volumes[-data_loader.DAY*7:].tolist(),
+        high=data.klines.high[-1].item(),
+        low=data.klines.low[-1].item(),
+        taker_volume=data.klines.taker_buy_quote_volume[-1].item(),
+    )
+
+    # 滚动指标 (由历史数据批量初始化，此后每条K线O(1)更新)，可在`rules.json`中以特征名使用
+    monitor.add_indicator(
+        "ind_price_ema_30m",
+        indicators.EMA.from_history(data.prices[-data_loader.DAY:], span=30),
+        lambda tic, price, volume: (price,),
+    )
+    monitor.add_indicator(
+        "ind_volume_zscore_60m",
+        indicators.ZScore.from_history(data.volumes[-data_loader.HOUR:], 60),
+        lambda tic, price, volume: (volume,),
+    )
+    return monitor
+
+
+def poll_klines(coin, monitor, last_timestamp, data_dir="data", latest_data=None):
+    """获取最新收盘的K线：去重补齐、合成多周期K线、追加写入文件；监控的更新与规则的执行见`update_monitors`
+
+    latest_data: 已获取的最新K线，为空时在此请求
+    returns: 供监控更新的连续K线 (含填充的K线，按开盘时间排序)，未获得新K线时为空列表
+    """
+
+    # 获取最新数据
+    if latest_data is None:
+        err, latest_data = data_loader.get_latest_data(coin, "1m", last_timestamp + data_loader.get_interval_ms("1m"), verbosity=0)
+        if err is not None:
+            return []
+    if not isinstance(latest_data, list) or len(latest_data) == 0:
+        return []
+
+    # 去除重复的K线，补齐缺失的K线，避免监控窗口错位
+    feed_items, save_items = integrity.align(coin, latest_data, last_timestamp, monitor.prices[-1])
+    if not feed_items:
+        return []
+
+    # 合成多周期K线 (填充的K线不参与合成，与文件及重启后`catch_up`的结果一致)
+    if monitor.resampler is not None:
+        for item in save_items:
+            monitor.resampler.update(item)
+
+    # 更新文件
+    file = "%s/%s.1m.data" % (data_dir, coin)
+    with open(file, "a", encoding="utf-8") as f:
+        for item in save_items:
+            f.write("%s\n" % "\t".join(list(map(str, item))))
+    data_loader.sync_derived(coin, file, items=save_items, keep=True)    # 增量更新小时/天汇总表与内存映射存储 (供其他进程零拷贝读取)
+    return feed_items
+
+
+def update_monitors(updates, engine):
+    """按开盘时间逐分钟更新监控，每分钟对该分钟有新K线的所有监控批量执行一次收盘价规则
+
+    updates: [(monitor, feed_items), ...]，feed_items为`poll_klines`的返回值
+    returns: 更新的监控
+    """
+
+    minutes = collections.defaultdict(list)
+    for monitor, feed_items in updates:
+        for item in feed_items:
+            minutes[int(item[0])].append((monitor, item))
+    for minute in sorted(minutes):    # 补齐的K线按分钟依次执行，与逐条K线的结果一致
+        monitors = []
+        for monitor, item in minutes[minute]:
+            monitor.update(
+                tic=float(item[0]),
+                price=float(item[4]),
+                volume=float(item[7]),
+                high=float(item[2]),
+                low=float(item[3]),
+                taker_volume=float(item[10]),
+            )
+            monitors.append(monitor)
+        engine.evaluate(monitors, "candle")
+    return [monitor for monitor, feed_items in updates if feed_items]
+
+
+def run(snapshot_mode=False, rules_file="rules.json", handlers=None, top_n=150, on_sweep=None, poll_budget=None,
+        track_portfolio=False, record_book=False, watch_trades=False):
+    """运行监控主循环 (不返回)
+
+    snapshot_mode: 快照模式，等待K线收盘期间轮询全市场价格
+    handlers: 规则动作，默认为提示音与一键平仓
+    on_sweep: 每轮收盘处理完成后的回调 on_sweep(close_tic, seconds)，seconds为本轮处理耗时 (不含等待)
+    poll_budget: 每分钟的请求预算，为空时等于监控的币种数 (见`scheduler.PriorityPoller`)
+    track_portfolio: 跟踪持仓价值 (需API权限)，以监控的最新价增量更新，回撤过大时提示
+    record_book: 等待K线收盘期间每隔几秒采集监控币种的最优挂单 (见`book.py`)
+    watch_trades: 跟踪最热门币种的逐笔成交，以5秒K线检测秒级的急涨急跌与交易额突增 (见`trades.py`)
+    """
+
+    print("获取可交易币种...")
+    err, coins = universe.get_symbols()
+    if err is not None:
+        print(err)
+        coins = data_loader.COINS
 
     print("更新所有币种最新数据...")
-    data_loader.update_data_all()
+    data_loader.update_data_all(coins=coins)
 
     print("为所有币种创建监控...")
     monitors = {}
-    last_timestamps = {}
-    for coin in data_loader.COINS:
-        file = "data/%s.1m.data" % coin
-        if not os.path.exists(file):
-            continue
-        data = data_loader.Data(file)    # 读取历史数据
-        if len(data.prices) < data_loader.DAY * 7:    # 数据不满足监控条件（需要计算滑动平均价/交易额）
-            continue
-        monitors[coin] = Monitor(    # 创建模型
-            coin,
-            data.tics[-data_loader.DAY*7:],
-            data.prices[-data_loader.DAY*7:],
-            data.volumes[-data_loader.DAY*7:],
-            volume_break_out_ratio=10,
-        )
-        last_timestamps[coin] = data.tics[-1]
+    for coin in coins:
+        monitor = load_monitor(coin)
+        if monitor is not None:
+            monitors[coin] = monitor
 
-    print("计算头部交易额币种...")
-    items = [(coin, monitors[coin].ma_7d_volume) for coin in monitors]
-    items.sort(key=lambda x: x[1], reverse=True)
-    top = {}
-    for i, item in enumerate(items[:150]):
-        coin = item[0]
-        mean_volume = item[1]
-        print("No.%d %s $%d" % (i + 1, coin, mean_volume))
-        top[coin] = monitors[coin]
+    print("加载监控规则...")
+    handlers = handlers or {"alarm": alarm, "sell_all": sell_all}
+    engine = rules.RuleEngine(rules_file, handlers=handlers)
+
+    portfolio = None
+    if track_portfolio:
+        print("读取持仓...")
+
+        def on_drawdown(portfolio, drawdown):
+            portfolio_lib.print_drawdown(portfolio, drawdown)
+            if "alarm" in handlers:
+                handlers["alarm"](None, None, 3)
+
+        portfolio = portfolio_lib.Portfolio(on_drawdown=on_drawdown)
+        err = portfolio.load()
+        if err is not None:
+            print(err)
 
     print("准备当期指数计算...")
-    init_prices = {}
-    for coin, monitor in top.items():
-        init_prices[coin] = monitor.prices[-1]
+    index = price_index.PriceIndex("价格指数", file="data/index.1m.data")    # 等权指数
+    volume_index = price_index.PriceIndex("交易额加权指数", file="data/index_volume.1m.data")    # 以7日均交易额加权
+    last_timestamps = {}
+    volume_scale = None    # 交易额加权指数的权重系数，使权重之和约等于币种数量
     last_cal_index_tic = -1
+    comovement = correlation.CoMovement()    # 各币种相对BTC/价格指数的滚动相关系数与β
+    comovement_closes = collections.defaultdict(dict)    # 尚未计入联动的收盘价 开盘时间 -> {coin: price}
+    last_comovement_tic = -1    # 已计入联动的最新分钟
+    clock = scheduler.ServerClock()    # 以服务器时间为准 (K线收盘、成交时间、挂单采样时间)
+    book_recorder = book.BookRecorder(clock=clock) if record_book else None    # 最优挂单的采集
+
+    trade_feed = None
+    if watch_trades:
 
-    print("开始执行价量监控...")
-    pygame.mixer.init()
-    pygame.mixer.music.load("refs/alarm.mp3")
-    while True:
-
-        # 计算top综合价格指数
-        index = 0
-        for coin, monitor in top.items():
-            index += monitor.prices[-1] / init_prices[coin]
-        if time.time() - last_cal_index_tic > 600:
-            print("%s --- 价格指数, %.1f" % (
-                utils.tic2time(time.time()),
-                index,
+        def on_surge(coin, kind, value, bar):
+            """秒级K线检测到突变：打印提示并播放提示音"""
+            if kind == "volume":
+                message = "交易额突增%.1f倍 ($%d万)" % (value, bar[5] / 10000)
+            else:
+                message = "%d秒内价格%s%.1f%%" % (trades.PRICE_WINDOW, "上涨" if kind == "rise" else "下跌", value * 100)
+            print("%s >>> %s, $%s, %s (%d秒K线)" % (
+                utils.tic2time(bar[0] + trade_feed.bar_seconds * data_loader.TIMESTAMP_UNIT),
+                coin,
+                utils.standardize(bar[4]),
+                message,
+                trade_feed.bar_seconds,
             ))
-            last_cal_index_tic = time.time()
-
-        # 跟踪价量
-        for coin, monitor in top.items():
-
-            # 获取最新数据
-            latest_data = data_loader.get_latest_data(coin, "1m", last_timestamps[coin] + 1, verbosity=0)
-            if not isinstance(latest_data, list) or len(latest_data) == 0:    # 未能获得最新数据
-                continue
-
-            # 更新文件
-            file = "data/%s.1m.data" % coin
-            with open(file, "a", encoding="utf-8") as f:
-                for item in latest_data:
-                    monitor.update(
-                        tic=float(item[0]),
-                        price=float(item[4]),
-                        volume=float(item[7]),
-                    )
-                    monitor.implement()
-                    f.write("%s\n" % "\t".join(list(map(str, item))))
-            last_timestamps[coin] = int(latest_data[-1][0])
+            if "alarm" in handlers and coin in top:
+                handlers["alarm"](top[coin], bar[0], 1)
+
+        # 交易额基准为各币种的7小时均交易额 (每分钟)
+        trade_feed = trades.TradeFeed(
+            on_surge=on_surge,
+            baselines=lambda coin: top[coin].ma_7h_volume if coin in top else None,
+            clock=clock,
+        )
+
+    def on_add(coin, monitor):
+        """加入监控：纳入指数计算"""
+        comovement.add(coin)
+        index.add(coin, monitor.prices[-1])
+        volume_index.add(coin, monitor.prices[-1], weight=monitor.ma_7d_volume * volume_scale)
+        monitor.indices = [index, volume_index]
+        monitor.live_indices = [portfolio] if portfolio is not None else []    # 持仓价值随实时价格更新
+        for minutes in engine.horizons:
+            monitor.track_extrema(minutes)
+        monitor.resampler = resample.Resampler(coin)
+        monitor.resampler.catch_up()
+        last_timestamps[coin] = int(monitor.tics[-1])
+
+    def on_remove(coin, monitor):
+        """移除监控：退出指数计算"""
+        comovement.remove(coin)
+        index.remove(coin)
+        volume_index.remove(coin)
+        monitor.indices = []
+        monitor.live_indices = []
+        monitor.resampler = None
+        last_timestamps.pop(coin, None)
+        store.close_writer(coin)    # 释放存储的文件与写入锁
+        if book_recorder is not None:
+            book_recorder.remove(coin)
+        if trade_feed is not None:
+            trade_feed.remove(coin)
+
+    print("计算头部交易额币种...")
+    items = sorted(monitors.items(), key=lambda x: x[1].ma_7d_volume, reverse=True)[:top_n]
+    volume_scale = len(items) / sum(monitor.ma_7d_volume for _, monitor in items)
+    for i, (coin, monitor) in enumerate(items):
+        print("No.%d %s $%d" % (i + 1, coin, monitor.ma_7d_volume))
+    coin_universe = universe.Universe(
+        top_n,
+        factory=lambda coin: load_monitor(coin, update=True),
+        on_add=on_add,
+        on_remove=on_remove,
+        verbosity=0,
+    )
+    coin_universe.seed(monitors)
+    coin_universe.verbosity = 1
+    top = coin_universe.monitors
+    del monitors
+    comovement.seed(top)    # 以近期价格批量初始化相关系数
+
+    # 快照模式：等待K线收盘期间每隔几秒通过一次请求获取全市场价格，用于盘中价格监控；
+    # 逐币种的K线请求只在新K线收盘后发起，用于交易额等收盘数据的更新
+    last_snapshot_tic = -1
+
+    def poll_snapshot():
+        """获取全市场价格快照并执行价格监控"""
+        nonlocal last_snapshot_tic
+        if time.time() - last_snapshot_tic < SNAPSHOT_INTERVAL:
+            return
+        last_snapshot_tic = time.time()
+        err, markets = binance.get_instance().get_prices()
+        if err is not None:
+            return
+        tic = time.time() * data_loader.TIMESTAMP_UNIT
+        snapshot_monitors = []
+        snapshot_prices = []
+        for market in markets:
+            monitor = top.get(market["symbol"])
+            if monitor is not None:
+                price = float(market["price"])
+                monitor.update_snapshot(tic, price)
+                snapshot_monitors.append(monitor)
+                snapshot_prices.append(price)
+        engine.evaluate(snapshot_monitors, "snapshot", snapshot_prices, tic)    # 所有币种批量执行规则
+
+    # 按K线收盘对齐：每根K线收盘后并发请求所有币种刚收盘的K线，收盘之间不再空转请求
+    candle_scheduler = scheduler.CandleScheduler(clock)
+    latency = scheduler.LatencyTracker()
+    poller = scheduler.PriorityPoller(clock, budget=poll_budget, checks=not snapshot_mode)    # 按活跃度分配请求
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=BURST_WORKERS)
+    unit = data_loader.get_interval_ms("1m")
+
+    def fetch(coin, last_timestamp):
+        """请求`last_timestamp`之后收盘的K线
+
+        returns: err, K线列表
+        """
+        return data_loader.get_latest_data(coin, "1m", last_timestamp + unit, verbosity=0, now_timestamp=clock.now())
+
+    def check_prices():
+        """盘中检查热门币种的最新价并执行价格监控 (非快照模式下，以冷门币种节省的请求进行)"""
+        coins = [coin for coin in poller.due_checks() if coin in top]
+        if not coins:
+            return
+        results = list(executor.map(binance.get_instance().get_price, coins))
+        tic = clock.now()
+        check_monitors = []
+        latest_prices = []
+        for coin, (err, market) in zip(coins, results):
+            if err is None and coin in top:
+                price = float(market["price"])
+                top[coin].update_snapshot(tic, price)
+                check_monitors.append(top[coin])
+                latest_prices.append(price)
+        engine.evaluate(check_monitors, "snapshot", latest_prices, tic)
+
+    def idle():
+        """等待K线收盘期间：轮询全市场价格 (快照模式) 或检查热门币种，并采集最优挂单与热门币种的成交"""
+        if snapshot_mode:
+            poll_snapshot()
+        else:
+            check_prices()
+        if book_recorder is not None:
+            err = book_recorder.poll(top)
+            if err is not None:
+                print(err)
+        if trade_feed is not None:    # 活跃度最高的币种，请求计入预算
+            _, requests = trade_feed.poll(trade_feed.select({coin: score for coin, score in poller.scores.items() if coin in top}), executor)
+            poller.charge(requests)
+
+    print("开始执行价量监控%s..." % ("(快照模式)" if snapshot_mode else ""))
+    try:
+        while True:
+
+            # 打印top综合价格指数 (随各币种价格更新增量维护)
+            if time.time() - last_cal_index_tic > 600:
+                print("%s --- 价格指数, %.3f, 交易额加权指数, %.3f" % (
+                    utils.tic2time(time.time()),
+                    index.mean,
+                    volume_index.mean,
+                ))
+                if portfolio is not None:
+                    print("%s --- 持仓总价值$%s, 自高点回撤%.1f%%" % (
+                        utils.tic2time(time.time()),
+                        utils.standardize(portfolio.value),
+                        (1 - portfolio.value / portfolio.peak) * 100 if portfolio.peak else 0,
+                    ))
+                if trade_feed is not None:
+                    print("%s --- 秒级成交跟踪%d个币种, 请求%d次, 成交%d笔, 突变提示%d次" % (
+                        utils.tic2time(time.time()),
+                        len(trade_feed.bars),
+                        trade_feed.stats["requests"],
+                        trade_feed.stats["trades"],
+                        trade_feed.stats["surges"],
+                    ))
+                engine.report()
+                latency.report()
+                poller.report()
+                last_cal_index_tic = time.time()
+
+            # 接入新进入头部的币种，移除退出头部的币种
+            coin_universe.poll()
+            if portfolio is not None:
+                portfolio.poll()    # 委托后或每30分钟刷新余额
+
+            # 等待K线收盘 (快照模式下等待期间轮询全市场价格)
+            close_tic = candle_scheduler.wait(idle=idle)
+            sweep_start = time.perf_counter()
+
+            # 跟踪价量：按活跃度从高到低请求刚收盘的K线 (冷门币种隔几分钟请求一次)，交易所数据尚未就绪的币种稍后重试
+            poller.score(top, engine.proximity(list(top.values())))
+            pending = poller.plan(close_tic, last_timestamps)
+            for _ in range(BURST_RETRIES):
+                futures = {coin: executor.submit(fetch, coin, last_timestamps[coin]) for coin in pending}
+                updates = []
+                errors = []
+                for coin, future in futures.items():
+                    monitor = top.get(coin)
+                    if monitor is None:    # 已移出监控
+                        continue
+
+                    # 处理最新收盘的K线 (未能获得最新数据时为空)
+                    err, latest_data = future.result()
+                    if err is not None:
+                        errors.append(err)
+                        continue
+                    feed_items = poll_klines(coin, monitor, last_timestamps[coin], latest_data=latest_data)
+                    if feed_items:
+                        updates.append((coin, monitor, feed_items))
+
+                if errors:    # 频率限制等错误只打印一次
+                    print("%s --- %d个币种请求失败, 如%s" % (utils.tic2time(time.time()), len(errors), errors[0]))
+
+                # 本轮获得新K线的所有币种逐分钟批量执行收盘价规则
+                update_monitors([(monitor, feed_items) for _, monitor, feed_items in updates], engine)
+                for coin, monitor, feed_items in updates:
+                    if coin not in top:    # 排名调整中已移出监控
+                        continue
+                    for item in feed_items:    # 按分钟缓存新收盘价
+                        if int(item[0]) > last_comovement_tic:
+                            comovement_closes[int(item[0])][coin] = float(item[4])
+                    last_timestamp = int(feed_items[-1][0])
+                    last_timestamps[coin] = last_timestamp
+                    if last_timestamp == close_tic:
+                        latency.record(coin, close_tic + unit, clock.now())
+                    coin_universe.update(coin, monitor.ma_7d_volume)    # 增量调整排名
+
+                pending = [coin for coin in pending if coin in top and last_timestamps[coin] < close_tic]
+                if not pending:
+                    break
+                time.sleep(1)
+
+            # 跨币种联动：每分钟以该分钟的收盘价更新一次所有币种的相关系数，提示脱离大盘的走势；
+            # 冷门币种的K线最多推迟`QUIET_INTERVAL`分钟获取，联动相应延后计算，保证收益率均为1分钟收益率
+            ready_tic = close_tic - (scheduler.QUIET_INTERVAL - 1) * unit
+            for minute in sorted(tic for tic in comovement_closes if tic <= ready_tic):
+                closes = comovement_closes.pop(minute)
+                last_comovement_tic = minute
+                for coin, benchmark in comovement.update(closes, index.value_at(minute)):
+                    if coin not in top:
+                        continue
+                    print("%s >>> %s, $%s, 与%s的联动减弱, %d分钟相关系数%.2f (%d分钟%.2f)" % (
+                        utils.tic2time(minute + unit),
+                        coin,
+                        utils.standardize(closes[coin]),
+                        "BTC" if benchmark == "btc" else "价格指数",
+                        comovement.windows[0],
+                        comovement.correlation(coin, benchmark, comovement.windows[0]),
+                        comovement.windows[-1],
+                        comovement.correlation(coin, benchmark, comovement.windows[-1]),
+                    ))
+            comovement.publish(top)    # 规则中可读取`ind_corr_btc_60m`等特征
+            if on_sweep is not None:
+                on_sweep(close_tic, time.perf_counter() - sweep_start)
+    finally:
+        if book_recorder is not None:    # 写入未结束分钟的采样与汇总
+            book_recorder.close()
+
+
+if __name__ == "__main__":
+
+    run(
+        snapshot_mode="--snapshot" in sys.argv,
+        track_portfolio="--portfolio" in sys.argv,
+        record_book="--book" in sys.argv,
+        watch_trades="--trades" in sys.argv,
+    )
@@ -0,0 +1,198 @@
+# 持仓价值的流式跟踪：余额只在委托后或按较长间隔刷新，价值由监控已有的最新价增量更新，几乎不产生额外请求
+
+import sys
+import time
+
+import binance
+import utils
+
+
+REFRESH_INTERVAL = 30 * 60    # 余额的定期刷新间隔 (秒)，委托后立即刷新
+DRAWDOWN = 0.05    # 总价值自高点回撤超过该比例时提示
+SMALL_VALUE = 10    # 小额资产 (美元)，汇总时不予显示
+
+
+class Portfolio:
+    """持仓价值的流式跟踪
+
+    - `load()`读取一次账户余额，持仓币种的价格优先使用监控推送的最新价
+    - `update(symbol, price, tic)`与`PriceIndex.update`接口一致，可直接加入`Monitor.live_indices`，每次价格更新O(1)
+    - 委托 (`BinanceAPI.buy/sell`) 后标记余额过期，在下次`poll()`时刷新；否则每`refresh_interval`秒刷新一次
+    - 总价值自高点回撤超过`drawdown`时调用`on_drawdown(portfolio, drawdown)`，创出新高后重新启用
+    """
+
+    def __init__(self, api=None, refresh_interval=REFRESH_INTERVAL, drawdown=DRAWDOWN, on_drawdown=None):
+        self.api = api or binance.get_instance()
+        self.refresh_interval = refresh_interval
+        self.drawdown = drawdown
+        self.on_drawdown = on_drawdown
+
+        self.quantities = {}    # 资产 -> 数量
+        self.prices = {}    # 资产 -> 最新价 (美元)
+        self.price_tics = {}    # 资产 -> 最新价的更新时间 (秒)
+        self.symbols = {}    # 交易对 -> 资产，如"BTCUSDT" -> "BTC"
+        self.value = 0.0    # 总价值 (美元)
+        self.peak = 0.0    # 总价值的高点
+        self.last_update_tic = None    # 最近一次价格更新的时间戳 (毫秒)
+        self.last_refresh_tic = -1
+        self.stale = True    # 余额是否过期
+        self._alarmed = False    # 本轮高点之后是否已提示回撤
+        self.api.order_callbacks.append(lambda symbol: self.mark_stale())
+
+    def load(self):
+        """读取账户余额，没有监控推送价格的持仓币种以一次全市场请求获取现价 (至多一次签名请求与一次价格请求)
+
+        returns: err
+        """
+
+        self.last_refresh_tic = time.time()
+        err, account = self.api.get_account()
+        if err is not None:
+            return "读取账户余额失败: %s" % err
+        quantities = {}
+        for balance in account["balances"]:
+            quantity = float(balance["free"]) + float(balance["locked"])
+            if quantity > 0:
+                quantities[balance["asset"]] = quantity
+        self.quantities = quantities
+        self.symbols = {asset + self.api.basic_currency: asset for asset in quantities if "USD" not in asset}
+        for asset in quantities:
+            if "USD" in asset:
+                self.prices[asset] = 1.0
+        self.stale = False
+        now = time.time()
+        err = self.fetch_prices([
+            asset for asset in self.symbols.values() if now - self.price_tics.get(asset, -1) > self.refresh_interval
+        ])
+        self._revalue()
+        return err
+
+    def fetch_prices(self, assets=None):
+        """以一次全市场请求获取持仓币种的现价 (默认为所有非稳定币资产)，不论持仓币种的数量
+
+        returns: err
+        """
+
+        if assets is None:
+            assets = list(self.symbols.values())
+        if not assets:
+            return None
+        err, markets = self.api.get_prices()
+        if err is not None:
+            return "获取现价失败: %s" % err
+        prices = {market["symbol"]: market["price"] for market in markets}
+        errors = []
+        for asset in assets:
+            symbol = asset + self.api.basic_currency
+            if symbol not in prices:    # 无对应交易对的资产 (如已下架) 不计价值
+                errors.append(asset)
+                continue
+            self.update(symbol, float(prices[symbol]))
+        return "获取现价失败: %s" % ", ".join(errors) if errors else None
+
+    def mark_stale(self):
+        """标记余额过期 (委托后调用)"""
+        self.stale = True
+
+    def poll(self):
+        """在主循环中调用：余额过期或超过刷新间隔时重新读取
+
+        returns: err
+        """
+
+        if self.stale or time.time() - self.last_refresh_tic > self.refresh_interval:
+            return self.load()
+        return None
+
+    def update(self, symbol, price, tic=None):
+        """以最新价增量更新总价值，非持仓币种直接忽略"""
+
+        asset = self.symbols.get(symbol)
+        if asset is None:
+            return
+        self.value += self.quantities[asset] * (price - self.prices.get(asset, 0.0))
+        self.prices[asset] = price
+        self.price_tics[asset] = time.time()
+        self.last_update_tic = tic if tic is not None else time.time() * 1000
+        self._check_drawdown()
+
+    def fractions(self):
+        """returns: {资产: 价值占比}"""
+
+        if self.value <= 0:
+            return {}
+        return {asset: quantity * self.prices.get(asset, 0.0) / self.value for asset, quantity in self.quantities.items()}
+
+    def summary(self, ignore_small_amount_asset=True):
+        """与`BinanceAPI.get_account_value`格式一致的持仓汇总
+
+        returns: {"value": 总价值, "assets": {资产: {"quantity", "price", "value", "fraction"}}}
+        """
+
+        assets = {}
+        for asset, quantity in self.quantities.items():
+            value = quantity * self.prices.get(asset, 0.0)
+            if ignore_small_amount_asset and value < SMALL_VALUE:    # 小额资产不予显示
+                continue
+            assets[asset] = {
+                "quantity": quantity,
+                "price": self.prices.get(asset, 0.0),
+                "value": float(utils.standardize(value)),
+                "fraction": "%.2f%%" % (value / self.value * 100 if self.value > 0 else 0),
+            }
+        return {"value": float("%.1f" % self.value), "assets": assets}
+
+    def _revalue(self):
+        """按数量与价格重新计算总价值 (刷新余额时，消除增量累加的误差)"""
+
+        self.value = sum(quantity * self.prices.get(asset, 0.0) for asset, quantity in self.quantities.items())
+        self._check_drawdown()
+
+    def _check_drawdown(self):
+        if self.value > self.peak:
+            self.peak = self.value
+            self._alarmed = False
+            return
+        drawdown = 1 - self.value / self.peak if self.peak > 0 else 0
+        if drawdown >= self.drawdown and not self._alarmed:
+            self._alarmed = True
+            if self.on_drawdown is not None:
+                self.on_drawdown(self, drawdown)
+
+
+def print_drawdown(portfolio, drawdown):
+    """回撤提示：打印总价值与回撤幅度"""
+
+    print("\033[1;31m%s >>> 持仓总价值$%s, 自高点$%s回撤%.1f%%\033[0m" % (
+        utils.tic2time(time.time()),
+        utils.standardize(portfolio.value),
+        utils.standardize(portfolio.peak),
+        drawdown * 100,
+    ))
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) < 2:
+        print("Usage: python3 portfolio.py [seconds]        e.g. python3 portfolio.py 5")
+        sys.exit(-1)
+
+    # 独立运行时没有监控推送的价格，每隔`seconds`秒以一次全市场请求获取持仓币种的现价
+    interval = float(sys.argv[1])
+    portfolio = Portfolio(on_drawdown=print_drawdown)
+    err = portfolio.load()
+    if err is not None:
+        print(err)
+    last_value = None
+    while True:
+        portfolio.poll()
+        portfolio.fetch_prices()
+        if portfolio.value != last_value:
+            last_value = portfolio.value
+            print("%s --- 持仓总价值$%s, %s" % (
+                utils.tic2time(time.time()),
+                utils.standardize(portfolio.value),
+                ", ".join("%s %.1f%%" % (asset, fraction * 100) for asset, fraction in sorted(
+                    portfolio.fractions().items(), key=lambda x: -x[1]) if fraction >= 0.001),
+            ))
+        time.sleep(interval)
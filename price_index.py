@@ -0,0 +1,134 @@
+# 综合价格指数的增量计算
+
+import os
+import collections
+
+import utils
+
+
+KEEP_MINUTES = 24 * 60    # 内存中保留的分钟数，更早的指数只保存在文件中
+BASE = 100    # 指数的基准点位
+
+
+class PriceIndex:
+    """增量维护的综合价格指数
+
+    index = Σ weight_i * price_i / init_price_i / divisor
+
+    每次价格更新只将该币种的变动量计入累加值，无需遍历所有币种；
+    成分变动 (加入/移除币种) 时调整除数，使指数点位保持连续 (链式连接)，不因成分更替而跳变；
+    同时按分钟记录指数的时间序列 (内存中只保留最近`KEEP_MINUTES`分钟，完整序列见`file`)，可用于作图或回放
+    """
+
+    def __init__(self, name="index", file=None):
+        self.name = name
+        self.file = file    # 指数时间序列的保存文件，为空时不保存
+
+        self.init_prices = {}    # 基准价格
+        self.last_prices = {}    # 最新价格
+        self.weights = {}    # 权重
+        self.total_weight = 0
+        self.raw = 0    # Σ weight_i * price_i / init_price_i
+        self.divisor = None    # 除数，成分变动时调整
+        self.value = BASE    # 指数点位
+
+        self.tics = collections.deque(maxlen=KEEP_MINUTES)    # 分钟时间戳 (毫秒)
+        self.values = collections.deque(maxlen=KEEP_MINUTES)    # 对应分钟的指数
+
+    def add(self, symbol, price, weight=1.0):
+        """加入新币种，以当前价格作为基准价格"""
+
+        if symbol in self.weights:
+            self.remove(symbol)
+        self.init_prices[symbol] = price
+        self.last_prices[symbol] = price
+        self.weights[symbol] = weight
+        self.total_weight += weight
+        self.raw += weight
+        self._rebase()
+
+    def remove(self, symbol):
+        """移除币种"""
+
+        if symbol not in self.weights:
+            return
+        weight = self.weights.pop(symbol)
+        self.raw -= weight * self.last_prices.pop(symbol) / self.init_prices.pop(symbol)
+        self.total_weight -= weight
+        self._rebase()
+
+    def update(self, symbol, price, tic=None):
+        """更新币种价格，仅累加其变动量
+
+        只应传入收盘价 (tic为K线开盘时间)，分钟序列与`value`均为收盘价口径
+        """
+
+        if symbol not in self.weights:
+            return
+        self.raw += self.weights[symbol] * (price - self.last_prices[symbol]) / self.init_prices[symbol]
+        self.last_prices[symbol] = price
+        if self.divisor:
+            self.value = self.raw / self.divisor
+        if tic is not None:
+            self._record(tic)
+
+    @property
+    def mean(self):
+        """归一化的指数，基准为1"""
+        return self.value / BASE
+
+    def _rebase(self):
+        """成分变动后调整除数，使变动前后的指数点位相同"""
+        self.divisor = self.raw / self.value if self.raw > 0 else None
+
+    def value_at(self, tic):
+        """`tic`所在分钟的指数 (内存中保留的分钟序列)，不存在时返回None"""
+
+        minute_tic = int(tic) // 60000 * 60000
+        for recorded_tic, value in zip(reversed(self.tics), reversed(self.values)):
+            if recorded_tic == minute_tic:
+                return value
+            if recorded_tic < minute_tic:
+                break
+        return None
+
+    def _record(self, tic):
+        """记录分钟级别的指数"""
+
+        minute_tic = int(tic) // 60000 * 60000
+        if self.tics and minute_tic <= self.tics[-1]:    # 同一分钟内 (或迟到的K线) 覆盖该分钟的值
+            self.values[-1] = self.value
+            return
+
+        # 上一分钟结束，写入文件
+        if self.file and self.tics:
+            with open(self.file, "a", encoding="utf-8") as f:
+                f.write("%d\t%s\n" % (self.tics[-1], self.values[-1]))
+        self.tics.append(minute_tic)
+        self.values.append(self.value)
+
+
+def load_series(file):
+    """读取保存的指数时间序列
+
+    returns: tics, values
+    """
+
+    tics = []
+    values = []
+    if not os.path.exists(file):
+        return tics, values
+    with open(file, encoding="utf-8") as f:
+        for line in f:
+            tic, value = line.strip().split("\t")
+            tics.append(int(tic))
+            values.append(float(value))
+    return tics, values
+
+
+if __name__ == "__main__":
+
+    # 打印保存的指数时间序列
+    tics, values = load_series("data/index.1m.data")
+    for tic, value in zip(tics, values):
+        print("%s --- 价格指数, %.3f" % (utils.tic2time(tic), value))
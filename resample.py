@@ -0,0 +1,162 @@
+# 由1分钟K线增量合成更大周期的K线 (5m/15m/1h/1d)
+
+import os
+import sys
+import collections
+
+import data_loader
+import store
+
+
+INTERVALS = ["5m", "15m", "1h", "1d"]    # 默认合成的周期
+
+
+class Bar:
+    """合成中的K线"""
+
+    __slots__ = (
+        "open_time", "open", "high", "low", "close", "volume", "close_time",
+        "quote_volume", "trades", "taker_buy_volume", "taker_buy_quote_volume",
+    )
+
+    def __init__(self, open_time, close_time, item):
+        self.open_time = open_time
+        self.close_time = close_time
+        self.open = float(item[1])
+        self.high = float(item[2])
+        self.low = float(item[3])
+        self.close = float(item[4])
+        self.volume = float(item[5])
+        self.quote_volume = float(item[7])
+        self.trades = int(item[8])
+        self.taker_buy_volume = float(item[9])
+        self.taker_buy_quote_volume = float(item[10])
+
+    def add(self, item):
+        """并入一条1分钟K线"""
+        self.high = max(self.high, float(item[2]))
+        self.low = min(self.low, float(item[3]))
+        self.close = float(item[4])
+        self.volume += float(item[5])
+        self.quote_volume += float(item[7])
+        self.trades += int(item[8])
+        self.taker_buy_volume += float(item[9])
+        self.taker_buy_quote_volume += float(item[10])
+
+    def to_item(self):
+        """转换为与币安K线一致的12字段格式"""
+        return [
+            self.open_time, self.open, self.high, self.low, self.close, self.volume, self.close_time,
+            self.quote_volume, self.trades, self.taker_buy_volume, self.taker_buy_quote_volume, "0",
+        ]
+
+
+class Resampler:
+    """单一交易对的多周期K线合成器
+
+    每条1分钟K线只需O(周期数)的计算；周期内最后一分钟到达 (或下一周期的K线到达) 时该周期K线收盘，
+    收盘K线写入`data_dir/symbol.interval.data`，并在内存中保留最近`keep`条供监控规则使用
+    """
+
+    def __init__(self, symbol, intervals=INTERVALS, data_dir="data", keep=200):
+        self.symbol = symbol
+        self.intervals = intervals
+        self.data_dir = data_dir
+        self.units = {interval: data_loader.get_interval_ms(interval) for interval in intervals}
+        self.bars = {interval: collections.deque(maxlen=keep) for interval in intervals}    # 已收盘的K线
+        self.current = {interval: None for interval in intervals}    # 合成中的K线
+        self.last_timestamps = {}    # 各周期已保存的最后一根K线的开盘时间
+        self.last_minute = -1    # 最后并入的1分钟K线的开盘时间
+        for interval in intervals:
+            if data_dir:
+                self.last_timestamps[interval] = data_loader.get_last_timestamp(self._file(interval))
+
+    def catch_up(self, file=None):
+        """从1分钟K线文件中补齐已保存K线之后的数据 (从文件末尾向前读取，只解析各周期最后保存的K线之后的分钟)"""
+
+        file = file or "%s/%s.1m.data" % (self.data_dir, self.symbol)
+        if not os.path.exists(file):
+            return
+        if any(self.last_timestamps.get(interval) is None for interval in self.intervals):
+            start = None    # 存在尚未保存过的周期，从头合成
+        else:
+            start = min(self.last_timestamps[interval] + self.units[interval] for interval in self.intervals)
+        for item in store.read_text_after(file, None if start is None else start - 1).tolist():
+            self.update(item)
+
+    def update(self, item):
+        """并入一条1分钟K线
+
+        returns: {interval: 收盘K线}
+        """
+
+        closed = {}
+        open_time = int(item[0])
+        if open_time <= self.last_minute:    # 重复的K线
+            return closed
+        self.last_minute = open_time
+        for interval in self.intervals:
+            unit = self.units[interval]
+            bucket = open_time // unit * unit
+
+            # 该周期K线已保存过
+            last_timestamp = self.last_timestamps.get(interval)
+            if last_timestamp is not None and bucket <= last_timestamp:
+                continue
+
+            bar = self.current[interval]
+            if bar is not None and bar.open_time != bucket:    # 进入新周期，上一周期收盘 (末尾分钟缺失)
+                closed[interval] = self._close(interval)
+                bar = None
+            if bar is None:
+                self.current[interval] = Bar(bucket, bucket + unit - 1, item)
+            else:
+                bar.add(item)
+
+            # 周期内最后一分钟，收盘
+            if open_time + 60 * data_loader.TIMESTAMP_UNIT > self.current[interval].close_time:
+                closed[interval] = self._close(interval)
+        return closed
+
+    def _close(self, interval):
+        """收盘当前周期K线"""
+
+        bar = self.current[interval]
+        self.current[interval] = None
+        self.bars[interval].append(bar)
+        self.last_timestamps[interval] = bar.open_time
+        if self.data_dir:
+            with open(self._file(interval), "a", encoding="utf-8") as f:
+                f.write("%s\n" % "\t".join(map(str, bar.to_item())))
+        return bar
+
+    def _file(self, interval):
+        return "%s/%s.%s.data" % (self.data_dir, self.symbol, interval)
+
+
+def resample(items, interval):
+    """将1分钟K线批量合成为指定周期 (不写入文件，末尾未收盘的K线不返回)"""
+
+    resampler = Resampler(None, [interval], data_dir=None, keep=None)
+    for item in items:
+        resampler.update(item)
+    return [bar.to_item() for bar in resampler.bars[interval]]
+
+
+def build_all(data_dir="data", intervals=INTERVALS, verbosity=1):
+    """为数据目录中所有1分钟K线文件合成 (或续写) 各周期K线文件"""
+
+    files = sorted(file for file in os.listdir(data_dir) if file.endswith(".1m.data"))
+    for i, file in enumerate(files):
+        symbol = file[:-len(".1m.data")]
+        if verbosity:
+            print("%s (%d/%d)" % (symbol, i + 1, len(files)))
+        Resampler(symbol, intervals, data_dir=data_dir).catch_up()
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) < 2:
+        print("Usage: python3 resample.py [data_dir]        e.g. python3 resample.py data")
+        sys.exit(-1)
+    build_all(data_dir=sys.argv[1])
@@ -0,0 +1,185 @@
+# 按小时/天汇总的统计表：由1分钟K线增量维护，供数据分析直接查询
+#
+# 汇总表保存于`data_dir/symbol.rollup.1h.data`与`data_dir/symbol.rollup.1d.data`，每行一个周期，字段见`FIELDS`；
+# 处理进度保存于`data_dir/symbol.rollup.state`，新增分钟数据时只读取1分钟K线文件中新追加的部分
+
+import os
+import sys
+import json
+
+import data_loader
+
+
+PERIODS = {"1h": data_loader.HOUR, "1d": data_loader.DAY}    # 汇总周期 (分钟)
+
+FIELDS = [
+    "open_time",       # 开盘时间
+    "open",            # 开盘价
+    "high",            # 最高价
+    "low",             # 最低价
+    "close",           # 收盘价
+    "quote_volume",    # 成交额
+    "trades",          # 成交笔数
+    "minutes",         # 分钟数
+    "return_sum",      # 分钟涨跌幅 (相对上一分钟收盘价) 之和，除以分钟数即为平均每分钟涨跌幅
+]
+
+
+class Table:
+    """汇总表，各字段按列读取为列表，如`table.quote_volume[i]`；`tics`与`data_loader.Data`一致"""
+
+    def __init__(self, file):
+        for field in FIELDS:
+            setattr(self, field, [])
+        with open(file, encoding="utf-8") as f:
+            for line in f:
+                values = line[:-1].split("\t")
+                for field, value in zip(FIELDS, values):
+                    getattr(self, field).append(int(value) if field in ("open_time", "trades", "minutes") else float(value))
+        self.tics = self.open_time
+
+    def __len__(self):
+        return len(self.tics)
+
+
+def load(symbol, period="1h", data_dir="data"):
+    """读取汇总表，不存在时返回None"""
+
+    file = _file(symbol, period, data_dir)
+    if not os.path.exists(file):
+        return None
+    return Table(file)
+
+
+def catch_up(symbol, data_dir="data", rebuild=False):
+    """将1分钟K线文件中新追加的数据并入汇总表 (文件被重写时从头重建，`rebuild`为True时强制重建)
+
+    returns: {period: 新增的汇总行数}
+    """
+
+    file = "%s/%s.1m.data" % (data_dir, symbol)
+    closed = {period: [] for period in PERIODS}
+    if not os.path.exists(file):
+        return {period: 0 for period in PERIODS}
+    state = _load_state(symbol, data_dir)
+    if rebuild or not _is_valid(file, state):
+        state = _reset(symbol, data_dir)
+
+    # 只读取上次处理位置之后的数据
+    with open(file, "rb") as f:
+        f.seek(state["offset"])
+        for line in f:
+            if not line.endswith(b"\n"):    # 尚未写完的行
+                break
+            if line.strip():
+                _add(state, line.decode("utf-8")[:-1].split("\t"), closed)
+            state["offset"] += len(line)
+
+    for period, rows in closed.items():
+        if rows:
+            with open(_file(symbol, period, data_dir), "a", encoding="utf-8") as f:
+                for row in rows:
+                    f.write("%s\n" % "\t".join(map(str, row)))
+    _save_state(symbol, data_dir, state)
+    return {period: len(rows) for period, rows in closed.items()}
+
+
+def _add(state, item, closed):
+    """并入一条1分钟K线，收盘的周期行加入`closed`"""
+
+    open_time = int(item[0])
+    if open_time <= state["last_minute"]:    # 重复的K线
+        return
+    close = float(item[4])
+    change = close / state["last_close"] - 1 if state["last_close"] else 0.0    # 首条K线没有上一分钟收盘价
+    for period, minutes in PERIODS.items():
+        unit = minutes * 60 * data_loader.TIMESTAMP_UNIT
+        bucket = open_time // unit * unit
+        row = state["current"].get(period)
+        if row is not None and row[0] != bucket:    # 进入新周期，上一周期收盘 (末尾分钟缺失)
+            closed[period].append(row)
+            row = None
+        if row is None:
+            row = [bucket, float(item[1]), float(item[2]), float(item[3]), close, float(item[7]), int(item[8]), 1, change]
+        else:
+            row[2] = max(row[2], float(item[2]))
+            row[3] = min(row[3], float(item[3]))
+            row[4] = close
+            row[5] += float(item[7])
+            row[6] += int(item[8])
+            row[7] += 1
+            row[8] += change
+        state["current"][period] = row
+
+        # 周期内最后一分钟，收盘
+        if open_time + 60 * data_loader.TIMESTAMP_UNIT >= bucket + unit:
+            closed[period].append(row)
+            state["current"][period] = None
+    state["last_minute"] = open_time
+    state["last_close"] = close
+
+
+def _is_valid(file, state):
+    """检查处理进度是否仍与1分钟K线文件对应 (文件被整理重写后需重建)"""
+
+    if state["offset"] == 0:
+        return True
+    if os.path.getsize(file) < state["offset"]:
+        return False
+    with open(file, "rb") as f:
+        f.seek(max(state["offset"] - 1024, 0))
+        lines = f.read(state["offset"] - max(state["offset"] - 1024, 0)).split(b"\n")
+    if len(lines) < 2 or lines[-1]:    # 进度不在行末
+        return False
+    return lines[-2].startswith(b"%d\t" % state["last_minute"])
+
+
+def _reset(symbol, data_dir):
+    """删除汇总表，从头开始"""
+
+    for period in PERIODS:
+        if os.path.exists(_file(symbol, period, data_dir)):
+            os.remove(_file(symbol, period, data_dir))
+    return {"offset": 0, "last_minute": -1, "last_close": None, "current": {}}
+
+
+def _load_state(symbol, data_dir):
+    file = "%s/%s.rollup.state" % (data_dir, symbol)
+    if not os.path.exists(file):
+        return _reset(symbol, data_dir)
+    with open(file, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_state(symbol, data_dir, state):
+    """写入临时文件后替换，避免写入中断损坏进度"""
+
+    file = "%s/%s.rollup.state" % (data_dir, symbol)
+    with open(file + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(file + ".tmp", file)
+
+
+def _file(symbol, period, data_dir):
+    return "%s/%s.rollup.%s.data" % (data_dir, symbol, period)
+
+
+def build_all(data_dir="data", verbosity=1):
+    """为数据目录中所有1分钟K线文件建立 (或续写) 汇总表"""
+
+    files = sorted(file for file in os.listdir(data_dir) if file.endswith(".1m.data"))
+    for i, file in enumerate(files):
+        symbol = file[:-len(".1m.data")]
+        added = catch_up(symbol, data_dir)
+        if verbosity:
+            print("%s (%d/%d): 新增%s" % (
+                symbol, i + 1, len(files), ", ".join("%d条%s" % (n, period) for period, n in added.items()),
+            ))
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) < 2:
+        print("Usage: python3 rollup.py [data_dir]        e.g. python3 rollup.py data")
+        sys.exit(-1)
+    build_all(data_dir=sys.argv[1])
@@ -0,0 +1,328 @@
+# 声明式的监控规则：从配置文件读取规则，编译为对多个币种批量计算的判断函数
+
+import re
+import json
+import time
+import string
+import operator
+import itertools
+
+import numpy as np
+
+import data_loader
+import utils
+
+
+# 比较运算
+OPERATORS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+# 基础特征：直接读取监控的属性
+BASIC_FEATURES = [
+    "volume", "high", "low", "taker_volume",    # 最新K线的交易额/最高价/最低价/主动买入交易额
+    "ma_7m_price", "ma_7h_price", "ma_7h_volume", "ma_7d_price", "ma_7d_volume",
+]
+
+# 衍生特征：由其他特征计算
+DERIVED_FEATURES = {
+    "volume_ratio_7h": (["volume", "ma_7h_volume"], lambda c: c["volume"] / c["ma_7h_volume"] - 1),    # 交易额相对7小时均值的增幅 (倍)
+    "volume_ratio_7d": (["volume", "ma_7d_volume"], lambda c: c["volume"] / c["ma_7d_volume"] - 1),    # 交易额相对7日均值的增幅 (倍)
+    "volume_10k": (["volume"], lambda c: c["volume"] / 10000),    # 交易额 (万美元)
+    "taker_ratio": (["taker_volume", "volume"], lambda c: np.divide(c["taker_volume"], c["volume"], out=np.zeros(len(c.monitors)), where=c["volume"] > 0)),    # 主动买入交易额的占比
+    "range": (["high", "low"], lambda c: c["high"] / c["low"] - 1),    # 最新K线的振幅
+}
+
+# 数据来源：收盘K线 / 全市场价格快照；快照只有最新价，以下特征只能用于收盘K线
+SOURCES = ("candle", "snapshot")
+CANDLE_ONLY_FEATURES = {"volume", "high", "low", "taker_volume"}
+
+# 滚动指标：以`ind_`开头，读取监控的`indicator_values` (见`Monitor.add_indicator`)
+INDICATOR_PREFIX = "ind_"
+
+# 窗口特征：如`rise_9m` (相对9分钟内最低价的涨幅)，`drop_240m_minutes` (240分钟内的最高价出现在几分钟前)
+# 监控通过`Monitor.track_extrema`以单调队列跟踪规则用到的窗口，每条K线均摊O(1)，窗口长度不受限制；
+# 未跟踪该窗口的监控退回逐分钟扫描近期价格
+WINDOW_FEATURE_PATTERN = re.compile(r"^(rise|drop)_(\d+)m(_minutes|_percent)?$")
+
+SELL_ALL_COOLDOWN = 60    # 平仓动作的冷却时间 (秒)：快照模式下规则每几秒执行一次，下跌持续期间每个币种每分钟最多平仓一次
+
+
+def requires_candle(name):
+    """特征是否只能由收盘K线计算 (含由此衍生的特征)"""
+
+    if name in DERIVED_FEATURES:
+        return any(requires_candle(dependency) for dependency in DERIVED_FEATURES[name][0])
+    return name in CANDLE_ONLY_FEATURES
+
+
+class Context:
+    """一次批量计算的上下文：按需计算并缓存各币种的特征数组"""
+
+    def __init__(self, monitors, source, prices=None):
+        self.monitors = monitors
+        self.source = source
+        self.offset = 0 if source == "snapshot" else 1    # 快照价格尚未收盘，与`prices[-i]`比较；收盘价与`prices[-1-i]`比较
+        self.cache = {}
+        if prices is None:
+            prices = [monitor.prices[-1] for monitor in monitors]
+        self.cache["price"] = np.asarray(prices, dtype=np.float64)
+
+    def __getitem__(self, name):
+        if name not in self.cache:
+            self.cache[name] = self._compute(name)
+        return self.cache[name]
+
+    def _compute(self, name):
+        if name in BASIC_FEATURES:
+            if name in CANDLE_ONLY_FEATURES and self.source == "snapshot":
+                raise ValueError("快照数据只有最新价，规则需设定 \"on\": [\"candle\"]")
+            if name == "volume":
+                return np.array([monitor.volumes[-1] for monitor in self.monitors], dtype=np.float64)
+            return np.array([getattr(monitor, name) for monitor in self.monitors], dtype=np.float64)
+        if name in DERIVED_FEATURES:
+            return DERIVED_FEATURES[name][1](self)
+        if name.startswith(INDICATOR_PREFIX):
+            return np.array([monitor.indicator_values.get(name, np.nan) for monitor in self.monitors], dtype=np.float64)
+
+        kind, minutes, suffix = WINDOW_FEATURE_PATTERN.match(name).groups()
+        minutes = int(minutes)
+        extreme_prices, extreme_minutes = self._extrema(kind, minutes)
+        if kind == "rise":
+            value = self["price"] / extreme_prices - 1
+        else:
+            value = 1 - self["price"] / extreme_prices
+        self.cache["%s_%dm_minutes" % (kind, minutes)] = extreme_minutes
+        self.cache["%s_%dm_percent" % (kind, minutes)] = value * 100
+        self.cache["%s_%dm" % (kind, minutes)] = value
+        return self.cache[name]
+
+    def _extrema(self, kind, minutes):
+        """各币种窗口内的最低价 (rise) 或最高价 (drop)，及其距今的分钟数"""
+
+        unit = 60 * data_loader.TIMESTAMP_UNIT
+        prices = np.empty(len(self.monitors))
+        distances = np.empty(len(self.monitors), dtype=int)
+        scan = []    # 未跟踪该窗口的监控
+        for i, monitor in enumerate(self.monitors):
+            if minutes not in monitor.extrema:
+                scan.append(i)
+                continue
+            if self.source == "snapshot":    # 窗口含最新收盘价
+                extrema = monitor.extrema[minutes]
+                low, low_tic, high, high_tic = extrema.low, extrema.low_tic, extrema.high, extrema.high_tic
+            else:
+                low, low_tic, high, high_tic = monitor.candle_extrema[minutes]
+            price, tic = (low, low_tic) if kind == "rise" else (high, high_tic)
+            prices[i] = price if price is not None else np.nan
+            distances[i] = (monitor.tics[-1] - tic) // unit + (1 - self.offset) if tic is not None else 0
+
+        if scan:
+            history = self._history(minutes, [self.monitors[i] for i in scan])    # 第j列为j+1分钟前的价格
+            extreme = np.argmin(history, axis=1) if kind == "rise" else np.argmax(history, axis=1)
+            prices[scan] = history[np.arange(len(scan)), extreme]
+            distances[scan] = extreme + 1
+        return prices, distances
+
+    def _history(self, minutes, monitors):
+        """最近`minutes`分钟的价格矩阵 (币种数 x minutes)"""
+
+        rows = []
+        for monitor in monitors:
+            recent = monitor.prices.recent
+            rows.append(list(itertools.islice(reversed(recent), self.offset, self.offset + minutes)))
+        return np.array(rows, dtype=np.float64).reshape(len(monitors), minutes)
+
+
+class Rule:
+    """编译后的规则"""
+
+    def __init__(self, config):
+        self.name = config["name"]
+        self.on = set(config.get("on", SOURCES))
+        self.include = set(config.get("symbols", {}).get("include", []))
+        self.exclude = set(config.get("symbols", {}).get("exclude", []))
+        self.message = config["message"]
+        self.color = config.get("color")
+        self.group = config.get("group", self.name)
+        self.cooldown = config.get("cooldown", 600)
+        self.stop = config.get("stop", True)
+        self.actions = config.get("actions", {})
+
+        # 编译判断条件：[左侧特征, 运算符, 右侧特征或常数, 右侧乘数 (可选)]
+        self.conditions = []
+        self.features = set()
+        for condition in config["conditions"]:
+            left, op, right = condition[:3]
+            factor = condition[3] if len(condition) > 3 else 1
+            if op not in OPERATORS:
+                raise ValueError("规则`%s`不支持的运算符: %s" % (self.name, op))
+            self.conditions.append((left, OPERATORS[op], right, factor))
+            for name in (left, right):
+                if isinstance(name, str):
+                    self.features.add(name)
+        for _, name, _, _ in string.Formatter().parse(self.message):
+            if name and name not in ("symbol", "price", "time"):
+                self.features.add(name)
+        for name in self.features:
+            if name not in BASIC_FEATURES and name not in DERIVED_FEATURES and name != "price" and \
+                    not name.startswith(INDICATOR_PREFIX) and not WINDOW_FEATURE_PATTERN.match(name):
+                raise ValueError("规则`%s`不支持的特征: %s" % (self.name, name))
+
+        # 检查特征与数据来源，配置错误在加载时报错，而不是在执行中
+        for source in self.on:
+            if source not in SOURCES:
+                raise ValueError("规则`%s`不支持的数据来源: %s" % (self.name, source))
+        if "snapshot" in self.on:
+            for name in self.features:
+                if requires_candle(name):
+                    raise ValueError("规则`%s`的特征`%s`需要收盘数据 (快照只有最新价)，请设定 \"on\": [\"candle\"]" % (self.name, name))
+
+        self._symbols = None
+        self._symbol_mask = None
+
+    def symbol_mask(self, symbols):
+        """币种过滤 (币种列表不变时复用上次结果)"""
+
+        if symbols != self._symbols:
+            self._symbols = symbols
+            self._symbol_mask = np.array([
+                (not self.include or symbol in self.include) and symbol not in self.exclude
+                for symbol in symbols
+            ], dtype=bool)
+        return self._symbol_mask
+
+    def evaluate(self, context):
+        """对所有币种批量计算
+
+        returns: 满足条件的币种掩码
+        """
+
+        mask = np.ones(len(context.monitors), dtype=bool)
+        for left, op, right, factor in self.conditions:
+            left_value = context[left]
+            right_value = context[right] if isinstance(right, str) else right
+            mask &= op(left_value, right_value * factor)
+            if not mask.any():
+                break
+        return mask
+
+    def proximity(self, context):
+        """各币种与满足规则的接近程度 (0~1，1为满足)：各大小比较条件两侧之比的最小值
+
+        returns: 接近程度数组
+        """
+
+        value = np.ones(len(context.monitors))
+        for left, op, right, factor in self.conditions:
+            if op not in (operator.gt, operator.ge, operator.lt, operator.le):
+                continue
+            left_value = context[left]
+            right_value = (context[right] if isinstance(right, str) else right) * factor
+            with np.errstate(divide="ignore", invalid="ignore"):
+                ratio = left_value / right_value if op in (operator.gt, operator.ge) else right_value / left_value
+            value = np.minimum(value, np.clip(np.nan_to_num(ratio, nan=0, posinf=1, neginf=0), 0, 1))
+        return value
+
+
+class RuleEngine:
+    """规则引擎：编译规则，批量计算，执行提示/平仓等动作，统计每条规则的耗时"""
+
+    def __init__(self, file="rules.json", handlers=None):
+        with open(file, encoding="utf-8") as f:
+            self.rules = [Rule(config) for config in json.load(f)]
+        self.handlers = handlers or {}    # 动作名 -> 处理函数 handler(monitor, tic, value)
+        self.horizons = set()    # 规则用到的窗口分钟数，供监控跟踪窗口极值
+        for rule in self.rules:
+            for name in rule.features:
+                match = WINDOW_FEATURE_PATTERN.match(name)
+                if match:
+                    self.horizons.add(int(match.group(2)))
+        self.stats = {rule.name: {"calls": 0, "seconds": 0.0, "fired": 0} for rule in self.rules}
+        self.last_sell_all_tics = {}    # symbol -> 上一次平仓时间
+
+    def evaluate(self, monitors, source="candle", prices=None, tic=None):
+        """对一批监控执行所有适用的规则
+
+        source: "candle" (收盘K线) 或 "snapshot" (全市场价格快照，`prices`为对应的最新价)
+        """
+
+        if not monitors:
+            return
+        context = Context(monitors, source, prices)
+        symbols = tuple(monitor.symbol for monitor in monitors)
+        tics = [tic or monitor.tics[-1] for monitor in monitors]
+        active = np.ones(len(monitors), dtype=bool)    # 尚未被`stop`规则命中的币种
+
+        for rule in self.rules:
+            if source not in rule.on:
+                continue
+            start = time.perf_counter()
+            mask = rule.evaluate(context) & rule.symbol_mask(symbols) & active
+            stats = self.stats[rule.name]
+            stats["calls"] += 1
+            stats["seconds"] += time.perf_counter() - start
+            if not mask.any():
+                continue
+            if rule.stop:
+                active &= ~mask
+            for i in np.flatnonzero(mask):
+                stats["fired"] += 1
+                self._fire(rule, context, i, monitors[i], tics[i])
+
+    def proximity(self, monitors, source="candle"):
+        """各币种与触发任一规则的接近程度 (0~1)，供调度按活跃度分配请求
+
+        returns: 接近程度数组
+        """
+
+        value = np.zeros(len(monitors))
+        if not monitors:
+            return value
+        context = Context(monitors, source)
+        symbols = tuple(monitor.symbol for monitor in monitors)
+        for rule in self.rules:
+            if source in rule.on:
+                value = np.maximum(value, rule.proximity(context) * rule.symbol_mask(symbols))
+        return value
+
+    def _fire(self, rule, context, i, monitor, tic):
+        """执行规则的动作，提示类动作同组每`cooldown`秒最多一次"""
+
+        if rule.actions.get("sell_all") and "sell_all" in self.handlers:    # 平仓不受提示的冷却时间限制，单独冷却
+            if time.time() - self.last_sell_all_tics.get(monitor.symbol, -SELL_ALL_COOLDOWN) >= SELL_ALL_COOLDOWN:
+                self.last_sell_all_tics[monitor.symbol] = time.time()
+                self.handlers["sell_all"](monitor, tic, True)
+
+        if monitor.last_alarm == rule.group and time.time() - monitor.last_alarm_tic <= rule.cooldown:
+            return
+        values = {name: context[name][i] for name in rule.features if name != "price"}
+        message = "%s >>> %s" % (
+            utils.tic2time(tic),
+            rule.message.format(symbol=monitor.symbol, price=utils.standardize(float(context["price"][i])), **values),
+        )
+        if rule.color == "red":
+            message = "\033[1;31m%s\033[0m" % message
+        print(message)
+        for action, value in rule.actions.items():
+            if action != "sell_all" and action in self.handlers:
+                self.handlers[action](monitor, tic, value)
+        monitor.last_alarm = rule.group
+        monitor.last_alarm_tic = time.time()
+
+    def report(self):
+        """打印每条规则的平均耗时"""
+
+        for name, stats in self.stats.items():
+            if stats["calls"]:
+                print("规则`%s`: 执行%d次, 平均%.1fµs, 命中%d次" % (
+                    name,
+                    stats["calls"],
+                    stats["seconds"] / stats["calls"] * 1e6,
+                    stats["fired"],
+                ))
@@ -0,0 +1,231 @@
+# 按K线收盘对齐的调度：以服务器时间为准，在每根K线收盘后集中请求所有币种刚收盘的K线，并统计检测延迟
+
+import time
+import zlib
+import collections
+
+import binance
+import data_loader
+import utils
+
+
+SYNC_INTERVAL = 3600    # 服务器时间的校准间隔 (秒)
+SETTLE_DELAY = 1.0    # K线收盘后等待交易所数据就绪的时长 (秒)
+
+# 按活跃度分配请求 (活跃度0~1，取以下各项的最大值)
+VOLUME_SCALE = 5    # 交易额达到7小时均值的该倍数时，交易额一项记为1
+RETURN_SCALE = 0.02    # 近`RETURN_MINUTES`分钟的涨跌幅达到该值时，涨跌幅一项记为1
+RETURN_MINUTES = 5
+QUIET_SCORE = 0.3    # 活跃度低于该值的币种为冷门币种，每`QUIET_INTERVAL`分钟请求一次 (一次获取期间收盘的所有K线)
+QUIET_INTERVAL = 3
+HOT_SCORE = 0.6    # 活跃度不低于该值的币种为热门币种，以节省的请求在K线收盘之间检查最新价
+MAX_CHECKS = 3    # 每个热门币种每分钟最多的盘中检查次数
+
+
+class ServerClock:
+    """按服务器时间校正的时钟
+
+    以请求往返的中点估计本地时钟与服务器时钟的偏差，每`SYNC_INTERVAL`秒重新校准
+    """
+
+    def __init__(self, sync_interval=SYNC_INTERVAL):
+        self.sync_interval = sync_interval
+        self.offset = 0    # 服务器时间 - 本地时间 (毫秒)
+        self.last_sync_tic = None
+
+    def sync(self):
+        """校准时钟偏差
+
+        returns: err
+        """
+
+        start = time.time()
+        err, data = binance.get_instance().get_time()
+        end = time.time()
+        self.last_sync_tic = end    # 失败时同样等待下一个校准周期，避免反复请求
+        if err is not None:
+            return err
+        self.offset = data["serverTime"] - (start + end) / 2 * data_loader.TIMESTAMP_UNIT
+        return None
+
+    def now(self):
+        """当前的服务器时间戳 (毫秒)"""
+        if self.last_sync_tic is None or time.time() - self.last_sync_tic > self.sync_interval:
+            self.sync()
+        return int(time.time() * data_loader.TIMESTAMP_UNIT + self.offset)
+
+
+class CandleScheduler:
+    """在每根K线收盘后唤醒"""
+
+    def __init__(self, clock=None, interval="1m", delay=SETTLE_DELAY):
+        self.clock = clock or ServerClock()
+        self.unit = data_loader.get_interval_ms(interval)
+        self.delay = delay
+
+    def wait(self, idle=None, idle_interval=0.1):
+        """等待下一根K线收盘，等待期间每隔`idle_interval`秒调用一次`idle` (如快照模式的价格轮询)
+
+        returns: 刚收盘的K线的开盘时间
+        """
+
+        close_tic = (self.clock.now() // self.unit + 1) * self.unit
+        while True:
+            remaining = (close_tic - self.clock.now()) / data_loader.TIMESTAMP_UNIT + self.delay
+            if remaining <= 0:
+                break
+            if idle is None:
+                time.sleep(remaining)
+                continue
+            idle()
+            time.sleep(min(remaining, idle_interval))
+        return close_tic - self.unit
+
+
+class LatencyTracker:
+    """检测延迟统计：从K线收盘到完成规则判断 (即发出提示) 的时长，按币种分别记录最近`keep`次"""
+
+    def __init__(self, keep=100):
+        self.latencies = collections.defaultdict(lambda: collections.deque(maxlen=keep))    # symbol -> 延迟 (秒)
+
+    def record(self, symbol, close_tic, detect_tic):
+        """记录一次检测，`close_tic`/`detect_tic`为毫秒时间戳"""
+        self.latencies[symbol].append((detect_tic - close_tic) / data_loader.TIMESTAMP_UNIT)
+
+    def summary(self):
+        """returns: {"count": 次数, "mean": 均值, "p95": 95分位, "max": 最大值, "slowest": 平均延迟最大的币种}"""
+
+        latencies = sorted(latency for values in self.latencies.values() for latency in values)
+        if not latencies:
+            return None
+        slowest = max(self.latencies, key=lambda symbol: sum(self.latencies[symbol]) / max(len(self.latencies[symbol]), 1))
+        return {
+            "count": len(latencies),
+            "mean": sum(latencies) / len(latencies),
+            "p95": latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)],
+            "max": latencies[-1],
+            "slowest": slowest,
+        }
+
+    def report(self):
+        """打印检测延迟"""
+
+        summary = self.summary()
+        if summary is None:
+            return
+        print("%s --- 检测延迟: 平均%.1f秒, P95 %.1f秒, 最大%.1f秒 (%d次), 最慢币种%s" % (
+            utils.tic2time(time.time()),
+            summary["mean"],
+            summary["p95"],
+            summary["max"],
+            summary["count"],
+            summary["slowest"],
+        ))
+
+
+class PriorityPoller:
+    """按活跃度分配每分钟固定的请求预算
+
+    - 活跃度由交易额相对7小时均值的倍数、近期涨跌幅、与触发规则的接近程度 (见`RuleEngine.proximity`) 得到
+    - 每根K线收盘后按活跃度从高到低请求，活跃币种的提示最先发出
+    - 冷门币种每`QUIET_INTERVAL`分钟请求一次 (按币种错开)，节省的请求用于热门币种在收盘之间的最新价检查
+    - 其他请求 (如逐笔成交) 通过`charge(requests)`计入预算，先占用盘中检查的份额；K线请求优先，不因此推迟
+    """
+
+    def __init__(self, clock, budget=None, interval="1m", checks=True):
+        self.clock = clock
+        self.budget = budget    # 每分钟的请求数，为空时等于监控的币种数 (与逐一请求所有币种相同)
+        self.unit = data_loader.get_interval_ms(interval)
+        self.checks = checks    # 是否进行盘中检查 (快照模式下已有全市场价格，无需检查)
+        self.scores = {}    # symbol -> 最近一次计算的活跃度
+        self.schedule = []    # 本分钟内待执行的盘中检查 [(时间戳, [symbol, ...]), ...]
+        self.charged = 0    # 上次规划以来计入预算的其他请求数
+        self.stats = {"klines": 0, "checks": 0, "deferred": 0, "charged": 0}    # K线请求/盘中检查/推迟请求的币种次数/其他请求
+
+    def score(self, monitors, proximity=None):
+        """计算活跃度
+
+        monitors: {symbol: monitor}
+        proximity: 与`monitors`顺序一致的规则接近程度，为空时不计入
+        returns: {symbol: 活跃度}
+        """
+
+        for i, (symbol, monitor) in enumerate(monitors.items()):
+            volume = monitor.volumes[-1] / monitor.ma_7h_volume / VOLUME_SCALE if monitor.ma_7h_volume else 0
+            recent = monitor.prices.recent
+            change = abs(recent[-1] / recent[-1 - RETURN_MINUTES] - 1) / RETURN_SCALE if len(recent) > RETURN_MINUTES else 0
+            self.scores[symbol] = min(max(volume, change, proximity[i] if proximity is not None else 0), 1)
+        for symbol in list(self.scores):
+            if symbol not in monitors:
+                del self.scores[symbol]
+        return self.scores
+
+    def plan(self, close_tic, last_timestamps):
+        """规划本分钟的请求
+
+        close_tic: 刚收盘的K线的开盘时间
+        last_timestamps: {symbol: 已获得的最新K线的开盘时间}
+        returns: 本轮请求K线的币种，按活跃度从高到低排列
+        """
+
+        minute = close_tic // self.unit
+        budget = self.budget or len(last_timestamps)
+        must, due, deferred = [], [], []
+        for symbol, last_timestamp in last_timestamps.items():
+            if last_timestamp >= close_tic:
+                continue
+            behind = (close_tic - last_timestamp) // self.unit
+            score = self.scores.get(symbol, 1)
+            if behind >= QUIET_INTERVAL:    # 冷门币种最多推迟`QUIET_INTERVAL`分钟
+                must.append(symbol)
+            elif score >= QUIET_SCORE or (minute + zlib.crc32(symbol.encode())) % QUIET_INTERVAL == 0:
+                due.append(symbol)
+            else:
+                deferred.append(symbol)
+        key = lambda symbol: -self.scores.get(symbol, 1)
+        due.sort(key=key)
+        symbols = sorted(must + due[:max(budget - len(must), 0)], key=key)
+        self.stats["klines"] += len(symbols)
+        self.stats["deferred"] += len(deferred) + len(due) - (len(symbols) - len(must))
+
+        # 以剩余的预算安排热门币种的盘中检查，在收盘之间均匀分布
+        self.schedule = []
+        spare = budget - len(symbols) - self.charged    # 上一分钟的其他请求
+        self.charged = 0
+        hot = [symbol for symbol in sorted(self.scores, key=key) if self.scores[symbol] >= HOT_SCORE]
+        if self.checks and hot and spare > 0:
+            rounds = min(spare // len(hot), MAX_CHECKS) or 1
+            hot = hot[:spare // rounds]
+            for i in range(rounds):
+                self.schedule.append((close_tic + self.unit + self.unit * (i + 1) // (rounds + 1), hot))
+        return symbols
+
+    def charge(self, requests):
+        """将其他请求计入本分钟的预算"""
+        self.charged += requests
+        self.stats["charged"] += requests
+
+    def due_checks(self):
+        """returns: 已到检查时间的币种 (在等待K线收盘期间调用)"""
+
+        now = self.clock.now()
+        symbols = []
+        while self.schedule and self.schedule[0][0] <= now:
+            symbols += self.schedule.pop(0)[1]
+        self.stats["checks"] += len(symbols)
+        return symbols
+
+    def report(self):
+        """打印请求分配情况"""
+
+        hot = sum(score >= HOT_SCORE for score in self.scores.values())
+        quiet = sum(score < QUIET_SCORE for score in self.scores.values())
+        print("%s --- 请求分配: K线请求%d次, 盘中检查%d次, 其他请求%d次, 推迟%d次; 热门币种%d个, 冷门币种%d个" % (
+            utils.tic2time(time.time()),
+            self.stats["klines"],
+            self.stats["checks"],
+            self.stats["charged"],
+            self.stats["deferred"],
+            hot,
+            quiet,
+        ))
@@ -0,0 +1,282 @@
+# 分片的多进程监控：币种分配到多个工作进程，各进程独立完成数据获取、监控更新与规则计算；
+# 各币种的最新价量写入共享内存，由协调进程计算综合价格指数、交易额排名与平仓决策，并重启失效的分片
+#
+# 用法: python3 shard.py [分片数量]        e.g. python3 shard.py 8
+
+import os
+import sys
+import time
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import binance
+import data_loader
+import monitor as monitor_lib
+import price_index
+import resample
+import rules
+import universe
+import utils
+
+
+HEARTBEAT_TIMEOUT = 300    # 分片超过该时长 (秒) 未更新心跳则视为失效并重启
+HEALTH_CHECK_INTERVAL = 10    # 健康检查间隔 (秒)
+IDLE_SLEEP = 1    # 一轮请求均无新K线时的等待时长 (秒)
+FAILED = -1    # 分片未能载入的币种 (历史数据不足、请求失败等) 写入该时间戳
+
+
+class SharedState:
+    """共享内存中的最新价量状态
+
+    每个币种占一个槽位，仅由其所属的分片写入 (单一写入方，无需加锁)；
+    每个分片另有心跳时间与平仓请求时间。所有数组均为float64，直接映射共享内存，读写无需拷贝
+    """
+
+    FIELDS = ["tic", "price", "volume", "ma_7d_volume"]
+
+    def __init__(self, capacity, shards, name=None):
+        self.capacity = capacity
+        self.shards = shards
+        size = (len(self.FIELDS) * capacity + 2 * shards) * 8
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self.name = self.shm.name
+        buffer = np.ndarray((size // 8,), dtype=np.float64, buffer=self.shm.buf)
+        if name is None:
+            buffer[:] = 0
+
+        for i, field in enumerate(self.FIELDS):
+            setattr(self, field, buffer[i * capacity:(i + 1) * capacity])
+        offset = len(self.FIELDS) * capacity
+        self.heartbeats = buffer[offset:offset + shards]    # 分片最后活跃的时间
+        self.liquidations = buffer[offset + shards:offset + 2 * shards]    # 分片最后一次请求平仓的K线时间
+
+    def write(self, slot, tic, price, volume, ma_7d_volume):
+        """写入一个币种的最新状态，时间戳最后写入，读取方据此识别更新"""
+
+        self.price[slot] = price
+        self.volume[slot] = volume
+        self.ma_7d_volume[slot] = ma_7d_volume
+        self.tic[slot] = tic
+
+    def close(self, unlink=False):
+        for field in self.FIELDS:
+            setattr(self, field, None)
+        self.heartbeats = self.liquidations = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def partition(symbols, shards):
+    """按顺序轮流分配币种 (输入按交易额排序时，各分片的负载较为均衡)
+
+    returns: [[分片0的币种], [分片1的币种], ...]
+    """
+
+    assignment = [[] for _ in range(shards)]
+    for i, symbol in enumerate(symbols):
+        assignment[i % shards].append(symbol)
+    return assignment
+
+
+def run_shard(shard_id, symbols, slots, state_name, capacity, shards, data_dir="data"):
+    """分片工作进程：监控分配的币种，收盘K线执行规则，最新价量写入共享内存"""
+
+    state = SharedState(capacity, shards, name=state_name)
+    state.heartbeats[shard_id] = time.time()
+
+    def sell_all(monitor, tic, _):
+        """平仓请求交由协调进程统一执行，避免多个分片重复下单"""
+        state.liquidations[shard_id] = max(state.liquidations[shard_id], tic)
+
+    engine = rules.RuleEngine("rules.json", handlers={"alarm": monitor_lib.alarm, "sell_all": sell_all})
+
+    # 创建监控 (同时补齐本分片币种的历史数据)
+    monitors = {}
+    last_timestamps = {}
+    for symbol in symbols:
+        monitor = monitor_lib.load_monitor(symbol, data_dir, update=True)
+        state.heartbeats[shard_id] = time.time()
+        if monitor is None:
+            state.tic[slots[symbol]] = FAILED    # 告知协调进程不再等待该币种
+            continue
+        for minutes in engine.horizons:
+            monitor.track_extrema(minutes)
+        monitor.resampler = resample.Resampler(symbol, data_dir=data_dir)
+        monitor.resampler.catch_up()
+        monitors[symbol] = monitor
+        last_timestamps[symbol] = int(monitor.tics[-1])
+        state.write(slots[symbol], monitor.tics[-1], monitor.prices[-1], monitor.volumes[-1], monitor.ma_7d_volume)
+
+    while True:
+        updates = []
+        for symbol, monitor in monitors.items():
+            feed_items = monitor_lib.poll_klines(symbol, monitor, last_timestamps[symbol], data_dir)
+            state.heartbeats[shard_id] = time.time()
+            if feed_items:
+                updates.append((symbol, monitor, feed_items))
+
+        # 本轮获得新K线的币种逐分钟批量执行收盘价规则
+        monitor_lib.update_monitors([(monitor, feed_items) for _, monitor, feed_items in updates], engine)
+        for symbol, monitor, feed_items in updates:
+            last_timestamps[symbol] = int(feed_items[-1][0])
+            state.write(slots[symbol], monitor.tics[-1], monitor.prices[-1], monitor.volumes[-1], monitor.ma_7d_volume)
+        if not updates:
+            time.sleep(IDLE_SLEEP)
+
+
+class Coordinator:
+    """协调进程：启动分片并检查健康状态，从共享内存汇总各币种最新价量"""
+
+    def __init__(self, symbols, shards=None, top_n=150, data_dir="data", verbosity=1):
+        self.symbols = list(symbols)
+        self.shards = min(shards or os.cpu_count() or 1, len(self.symbols))
+        self.data_dir = data_dir
+        self.verbosity = verbosity
+        self.slots = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.assignment = partition(self.symbols, self.shards)
+        self.state = SharedState(len(self.symbols), self.shards)
+        self.processes = [None] * self.shards
+        self.restarts = [0] * self.shards    # 各分片的重启次数
+
+        self.seen = np.zeros(len(self.symbols))    # 各槽位已汇总的时间戳
+        self.handled_liquidation = 0    # 已执行平仓的请求时间
+        self.ranking = universe.TopN(top_n)    # 按7日均交易额的头部排名，与单进程监控一致，只有排名内的币种计入指数
+        self.index = price_index.PriceIndex("价格指数", file="%s/index.1m.data" % data_dir)    # 等权指数
+        self.volume_index = price_index.PriceIndex("交易额加权指数", file="%s/index_volume.1m.data" % data_dir)    # 以7日均交易额加权
+
+    def start(self, shard_id):
+        """启动 (或重启) 分片进程"""
+
+        self.state.heartbeats[shard_id] = time.time()
+        process = multiprocessing.Process(
+            target=run_shard,
+            args=(
+                shard_id,
+                self.assignment[shard_id],
+                {symbol: self.slots[symbol] for symbol in self.assignment[shard_id]},
+                self.state.name,
+                self.state.capacity,
+                self.shards,
+                self.data_dir,
+            ),
+            daemon=True,
+        )
+        process.start()
+        self.processes[shard_id] = process
+
+    def check_health(self):
+        """重启已退出或心跳超时的分片"""
+
+        now = time.time()
+        for shard_id, process in enumerate(self.processes):
+            if process.is_alive() and now - self.state.heartbeats[shard_id] < HEARTBEAT_TIMEOUT:
+                continue
+            reason = "心跳超时" if process.is_alive() else "进程退出 (%s)" % process.exitcode
+            if process.is_alive():
+                process.terminate()
+            process.join(5)
+            self.restarts[shard_id] += 1
+            print("\033[1;31m%s <<< 分片%d%s, 第%d次重启\033[0m" % (
+                utils.tic2time(now), shard_id, reason, self.restarts[shard_id],
+            ))
+            self.start(shard_id)
+
+    def collect(self):
+        """汇总自上次以来更新过的币种：增量调整排名，只有头部交易额排名内的币种计入指数
+
+        returns: 更新的币种数量
+        """
+
+        tics = self.state.tic.copy()    # 先读时间戳，之后读到的价量不早于该时间
+        changed = np.flatnonzero(tics != self.seen)
+        for slot in changed:
+            symbol = self.symbols[slot]
+            if tics[slot] == FAILED:    # 未能载入：不计入指数与排名
+                if self.seen[slot] <= 0:
+                    self.seen[slot] = FAILED
+                continue
+            price = float(self.state.price[slot])
+            added, removed = self.ranking.update(symbol, float(self.state.ma_7d_volume[slot]))
+            for other in removed:    # 退出排名：移出指数
+                self.index.remove(other)
+                self.volume_index.remove(other)
+            for other in added:    # 进入排名：以当前价格作为基准价格加入指数
+                other_slot = self.slots[other]
+                self.index.add(other, float(self.state.price[other_slot]))
+                self.volume_index.add(other, float(self.state.price[other_slot]), weight=float(self.state.ma_7d_volume[other_slot]))
+            if symbol in self.ranking.members and symbol not in added:
+                self.index.update(symbol, price, tics[slot])
+                self.volume_index.update(symbol, price, tics[slot])
+            if self.verbosity and self.seen.all():    # 所有币种均已载入 (或确认载入失败) 后才提示排名变化
+                for other in added:
+                    print("%s --- %s进入头部交易额排名" % (utils.tic2time(time.time()), other))
+                for other in removed:
+                    print("%s --- %s退出头部交易额排名" % (utils.tic2time(time.time()), other))
+            self.seen[slot] = tics[slot]
+        return len(changed)
+
+    def liquidate(self):
+        """执行分片提交的平仓请求 (同一K线时间只执行一次)"""
+
+        tic = float(self.state.liquidations.max())
+        if tic > self.handled_liquidation:
+            self.handled_liquidation = tic
+            monitor_lib.sell_all(None, tic, True)
+
+    def run(self):
+        """启动所有分片并持续汇总"""
+
+        for shard_id in range(self.shards):
+            self.start(shard_id)
+        print("启动%d个分片, 监控%d个币种..." % (self.shards, len(self.symbols)))
+
+        last_health_check_tic = time.time()
+        last_cal_index_tic = -1
+        try:
+            while True:
+                self.collect()
+                self.liquidate()
+                if time.time() - last_health_check_tic > HEALTH_CHECK_INTERVAL:
+                    self.check_health()
+                    last_health_check_tic = time.time()
+                if time.time() - last_cal_index_tic > 600:
+                    print("%s --- 价格指数, %.3f, 交易额加权指数, %.3f, 已载入%d/%d个币种" % (
+                        utils.tic2time(time.time()),
+                        self.index.mean,
+                        self.volume_index.mean,
+                        np.count_nonzero(self.seen > 0),
+                        len(self.symbols),
+                    ))
+                    last_cal_index_tic = time.time()
+                time.sleep(0.1)
+        finally:
+            self.stop()
+
+    def stop(self):
+        """结束所有分片并释放共享内存"""
+
+        for process in self.processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+                process.join(5)
+        self.state.close(unlink=True)
+
+
+if __name__ == "__main__":
+
+    print("获取可交易币种...")
+    err, coins = universe.get_symbols()
+    if err is not None:
+        print(err)
+        coins = data_loader.COINS
+
+    # 按24小时交易额排序，使各分片负载均衡
+    err, tickers = binance.get_instance().get_price_change()
+    if err is None:
+        volumes = {ticker["symbol"]: float(ticker["quoteVolume"]) for ticker in tickers}
+        coins = sorted(coins, key=lambda coin: volumes.get(coin, 0), reverse=True)
+
+    Coordinator(coins, shards=int(sys.argv[1]) if len(sys.argv) > 1 else None).run()
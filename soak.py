@@ -0,0 +1,294 @@
+# 长时间运行测试：在本地模拟市场上以加速的模拟时间运行完整的监控主循环 (`monitor.run`)，
+# 定期采样RSS、Python对象数量与内存 (tracemalloc)、打开的文件数及每轮收盘处理耗时，增长超过预算时判定失败
+#
+# 模拟时间通过替换`time.time`/`time.sleep`实现：主线程的等待直接推进模拟时钟，每轮收盘处理的耗时为真实耗时
+
+import os
+import gc
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+import tracemalloc
+import contextlib
+
+import numpy as np
+
+import binance
+import data_loader
+import monitor as monitor_lib
+
+
+SAMPLE_INTERVAL = 60 * 60    # 采样间隔 (模拟秒)
+WARMUP = 2 * 60 * 60    # 预热时长 (模拟秒)，预热结束时的采样作为基线
+
+# 预热之后允许的增长
+BUDGETS = {
+    "rss_mb": 64,            # 常驻内存 (MB)
+    "traced_mb": 16,         # tracemalloc跟踪的Python内存 (MB)
+    "objects": 50000,        # gc跟踪的对象数量
+    "fds": 4,                # 打开的文件数
+    "sweep_ratio": 1.5,      # 末段与首段每轮处理平均耗时之比
+}
+
+
+class SoakFinished(Exception):
+    """模拟时间到达终点"""
+
+
+class SimClock:
+    """模拟时钟：替换`time.time`/`time.sleep`，主线程的睡眠直接推进时间，后台线程的睡眠立即返回"""
+
+    def __init__(self, start, end):
+        self.now = start
+        self.end = end
+        self._time = time.time
+        self._sleep = time.sleep
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        if threading.current_thread() is not threading.main_thread():
+            return
+        self.now += max(seconds, 0)
+        if self.now >= self.end:
+            raise SoakFinished()
+
+    def install(self):
+        time.time = self.time
+        time.sleep = self.sleep
+
+    def uninstall(self):
+        time.time = self._time
+        time.sleep = self._sleep
+
+
+class SimulatedMarket:
+    """本地模拟市场：预先生成各币种每分钟的价格 (随机游走，偶有急涨急跌) 与交易额 (按天变化的活跃度，偶有突增)，
+    按模拟时钟实现监控用到的接口，未收盘的K线与真实接口一样包含在返回结果中
+    """
+
+    def __init__(self, symbols, start, minutes, clock, seed=0):
+        rng = np.random.default_rng(seed)
+        n = len(symbols)
+        self.symbols = symbols
+        self.start = start    # 首根K线的开盘时间 (毫秒)
+        self.clock = clock
+
+        returns = rng.normal(0, 0.0015, (minutes, n))
+        jumps = rng.random((minutes, n)) < 2e-4
+        returns[jumps] += rng.choice([-0.04, 0.04], jumps.sum())
+        self.closes = 10 ** rng.uniform(-2, 4, n) * np.exp(np.cumsum(returns, axis=0))
+        self.opens = np.vstack([self.closes[:1], self.closes[:-1]])
+        spread = np.abs(rng.normal(0, 0.001, (minutes, n)))
+        self.highs = np.maximum(self.opens, self.closes) * (1 + spread)
+        self.lows = np.minimum(self.opens, self.closes) * (1 - spread)
+
+        days = minutes // data_loader.DAY + 1
+        activity = np.repeat(rng.lognormal(0, 0.5, (days, n)), data_loader.DAY, axis=0)[:minutes]    # 按天变化的活跃度
+        self.quote_volumes = 10 ** rng.uniform(4, 5.5, n) * activity * rng.lognormal(0, 0.6, (minutes, n))
+        surges = rng.random((minutes, n)) < 2e-4
+        self.quote_volumes[surges] *= 30
+        self.trades = (self.quote_volumes / 500).astype(int) + 1
+        self.cum_quote_volumes = np.vstack([np.zeros(n), np.cumsum(self.quote_volumes, axis=0)])
+
+    def _minute(self, tic):
+        return int((tic - self.start) // 60000)
+
+    def _now(self):
+        return int(self.clock.time() * data_loader.TIMESTAMP_UNIT)
+
+    def get_time(self):
+        return None, {"serverTime": self._now()}
+
+    def get_interval_prices(self, symbol, interval="1m", startTime=None, endTime=None, raw=False):
+        j = self.symbols.index(symbol)
+        first = max(self._minute(startTime + 59999), 0)
+        last = min(self._minute(min(endTime, self._now())), len(self.closes) - 1)
+        items = []
+        for i in range(first, last + 1):
+            open_time = self.start + i * 60000
+            close = self.closes[i, j]
+            quote_volume = self.quote_volumes[i, j]
+            items.append([
+                open_time, "%.8f" % self.opens[i, j], "%.8f" % self.highs[i, j], "%.8f" % self.lows[i, j],
+                "%.8f" % close, "%.8f" % (quote_volume / close), open_time + 59999, "%.8f" % quote_volume,
+                int(self.trades[i, j]), "%.8f" % (quote_volume / close / 2), "%.8f" % (quote_volume / 2), "0",
+            ])
+        body = json.dumps(items, separators=(",", ":")).encode()
+        return None, body if raw else json.loads(body)
+
+    def get_price(self, symbol):
+        i = min(self._minute(self._now()), len(self.closes) - 1)
+        return None, {"symbol": symbol, "price": "%.8f" % self.closes[i, self.symbols.index(symbol)]}
+
+    def get_prices(self):
+        i = min(self._minute(self._now()), len(self.closes) - 1)
+        return None, [{"symbol": symbol, "price": "%.8f" % self.closes[i, j]} for j, symbol in enumerate(self.symbols)]
+
+    def get_exchange_info(self):
+        return None, {"symbols": [
+            {"symbol": symbol, "status": "TRADING", "quoteAsset": "USDT", "baseAsset": symbol[:-4]} for symbol in self.symbols
+        ]}
+
+    def get_price_change(self, symbol=None, interval="24hr"):
+        i = min(self._minute(self._now()), len(self.closes) - 1)
+        volumes = self.cum_quote_volumes[i] - self.cum_quote_volumes[max(i - data_loader.DAY, 0)]
+        return None, [{"symbol": symbol, "quoteVolume": "%.8f" % volumes[j]} for j, symbol in enumerate(self.symbols)]
+
+    def sell_all(self):
+        return None, {"success": True}
+
+
+def sample():
+    """returns: 当前进程的资源占用"""
+
+    rss = None
+    if os.path.exists("/proc/self/statm"):
+        with open("/proc/self/statm") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    return {
+        "rss_mb": rss,
+        "traced_mb": tracemalloc.get_traced_memory()[0] / 1024 ** 2,
+        "objects": len(gc.get_objects()),
+        "fds": len(os.listdir("/proc/self/fd")) if os.path.exists("/proc/self/fd") else None,
+    }
+
+
+def run_soak(days=3, n_symbols=30, top_n=20, budgets=None, work_dir=None, seed=0, snapshot_mode=False, verbosity=1):
+    """在模拟市场上运行监控主循环`days`天 (模拟时间)，检查资源占用的增长
+
+    returns: err (超出预算的项目，未超出时为None), {
+        "samples": [每小时的采样, ...],
+        "growth": {项目: 预热之后的增长},
+        "sweeps": 收盘处理的轮数,
+        "actions": {动作: 次数},
+        "top_growth": tracemalloc中增长最多的代码位置,
+    }
+    """
+
+    budgets = dict(BUDGETS, **(budgets or {}))
+    rules_file = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules.json"))
+    work_dir = work_dir or tempfile.mkdtemp(prefix="soak-")
+    cwd = os.getcwd()
+    stdout = sys.stdout
+
+    # 模拟市场：监控启动前8天的历史数据 + 运行期间的数据
+    start = (int(time.time()) // 60 + 1) * 60
+    history = 8 * data_loader.DAY
+    symbols = ["BTCUSDT"] + ["SIM%02dUSDT" % i for i in range(n_symbols - 1)]
+    clock = SimClock(start, start + days * 24 * 60 * 60)
+    market = SimulatedMarket(
+        symbols, (start - history * 60) * data_loader.TIMESTAMP_UNIT, history + int((days + 1) * data_loader.DAY), clock, seed,
+    )
+
+    samples = []
+    sweep_seconds = []
+    actions = {"alarm": 0, "sell_all": 0}
+    snapshots = []
+    next_sample = [start + WARMUP]
+
+    def on_sweep(close_tic, seconds):
+        """每轮收盘处理后记录耗时，每`SAMPLE_INTERVAL`采样一次"""
+        sweep_seconds.append(seconds)
+        if clock.time() < next_sample[0]:
+            return
+        next_sample[0] += SAMPLE_INTERVAL
+        item = sample()
+        item["hours"] = (clock.time() - start) / 3600
+        item["sweeps"] = len(sweep_seconds)
+        item["sweep_ms"] = np.mean(sweep_seconds[-60:]) * 1000
+        samples.append(item)
+        if not snapshots:
+            snapshots.append(tracemalloc.take_snapshot())
+        if verbosity:
+            print("[%5.1fh] RSS %sMB, Python内存%.1fMB, 对象%d个, 打开文件%s个, 每轮处理%.1fms" % (
+                item["hours"],
+                "%.1f" % item["rss_mb"] if item["rss_mb"] is not None else "-",
+                item["traced_mb"],
+                item["objects"],
+                item["fds"] if item["fds"] is not None else "-",
+                item["sweep_ms"],
+            ), file=stdout)
+
+    def count(action):
+        def handler(monitor, tic, value):
+            actions[action] += 1
+        return handler
+
+    os.makedirs(work_dir, exist_ok=True)
+    os.chdir(work_dir)
+    binance._instance = market
+    clock.install()
+    tracemalloc.start()
+    try:
+        with open("soak.log", "w", encoding="utf-8") as log, contextlib.redirect_stdout(log):
+            data_loader.update_data_all(init_data_days=8, verbosity=0, coins=symbols)    # 满足7日均值所需的历史数据
+            try:
+                monitor_lib.run(
+                    snapshot_mode=snapshot_mode,
+                    rules_file=rules_file,
+                    handlers={action: count(action) for action in actions},
+                    top_n=top_n,
+                    on_sweep=on_sweep,
+                )
+            except SoakFinished:
+                pass
+        top_growth = []
+        if snapshots:
+            top_growth = [str(stat) for stat in tracemalloc.take_snapshot().compare_to(snapshots[0], "lineno")[:10]]
+    finally:
+        tracemalloc.stop()
+        clock.uninstall()
+        binance._instance = None
+        os.chdir(cwd)
+
+    # 预热之后的增长
+    growth = {}
+    exceeded = []
+    if len(samples) >= 2:
+        for name in ("rss_mb", "traced_mb", "objects", "fds"):
+            if samples[0][name] is not None:
+                growth[name] = samples[-1][name] - samples[0][name]
+        measured = sweep_seconds[samples[0]["sweeps"]:]
+        third = max(len(measured) // 3, 1)
+        growth["sweep_ratio"] = np.mean(measured[-third:]) / max(np.mean(measured[:third]), 1e-9)
+        exceeded = ["%s增长%.2f (预算%s)" % (name, value, budgets[name]) for name, value in growth.items() if value > budgets[name]]
+    err = "; ".join(exceeded) if exceeded else None
+    if err is None and len(samples) < 2:
+        err = "运行时间不足，无法比较预热之后的增长"
+    return err, {
+        "samples": samples,
+        "growth": growth,
+        "sweeps": len(sweep_seconds),
+        "actions": actions,
+        "top_growth": top_growth,
+        "work_dir": work_dir,
+    }
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) < 2:
+        print("Usage: python3 soak.py [days] [symbols]        e.g. python3 soak.py 3 30")
+        sys.exit(-1)
+    err, report = run_soak(
+        days=float(sys.argv[1]),
+        n_symbols=int(sys.argv[2]) if len(sys.argv) > 2 else 30,
+        snapshot_mode="--snapshot" in sys.argv,
+    )
+    print("\n收盘处理%d轮, 提示%d次, 平仓%d次" % (report["sweeps"], report["actions"]["alarm"], report["actions"]["sell_all"]))
+    print("预热之后的增长: %s" % ", ".join("%s %.2f" % item for item in report["growth"].items()))
+    if report["top_growth"]:
+        print("Python内存增长最多的位置:")
+        for line in report["top_growth"]:
+            print("  %s" % line)
+    print("运行目录 (数据/日志): %s" % report["work_dir"])
+    if err is not None:
+        print("\033[1;31m未通过: %s\033[0m" % err)
+        sys.exit(1)
+    print("通过")
+    shutil.rmtree(report["work_dir"], ignore_errors=True)
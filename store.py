@@ -0,0 +1,293 @@
+# 内存映射的K线存储：单一写入方追加，多个读取方通过内存映射直接读取，无需解析文本、不复制数据
+#
+# 文件格式：64字节的文件头 (标识、版本、每行字节数、已提交行数)，其后为定长的二进制行 (字段见`klines.COLUMNS`)。
+# 写入方先写入行数据，再更新文件头中的已提交行数 (8字节对齐的单次写入)；读取方只读取已提交的行，
+# 不会读到写入一半的数据。写入中断时，重新打开的写入方会截去未提交的部分
+
+import os
+import sys
+import time
+import struct
+
+import numpy as np
+
+import klines
+import utils
+
+try:
+    import fcntl    # 写入锁 (仅类Unix系统)
+except ImportError:
+    fcntl = None
+
+
+MAGIC = b"KLSTORE1"
+HEADER_SIZE = 64
+HEADER_FORMAT = "<8sqqq"    # 标识, 版本, 每行字节数, 已提交行数
+COUNT_OFFSET = struct.calcsize("<8sqq")    # 已提交行数在文件头中的位置 (8字节对齐)
+TAIL_BLOCK = 64 * 1024    # 从文本数据文件末尾向前读取的块大小 (字节)
+LOCK_RETRY_INTERVAL = 60    # 其他进程持有写入方时，重新尝试获取写入锁的间隔 (秒)
+
+# 行结构 (按字段对齐)
+ROW_DTYPE = np.dtype(
+    [(name, klines.DTYPE_POLICIES["float64"][kind]) for name, kind in klines.COLUMNS],
+    align=True,
+)
+
+
+class StoreLockedError(Exception):
+    """已有其他进程作为写入方打开该存储"""
+
+
+class KlineStore:
+    """内存映射的K线存储
+
+    - `mode="r"`: 读取方，`store.close`/`store["close"]`返回已提交数据的只读视图 (零拷贝)，`refresh()`读取新提交的行
+    - `mode="w"`: 写入方，同一文件同时只能有一个写入方，`append(items)`追加币安K线格式的数据
+    """
+
+    def __init__(self, file, mode="r"):
+        self.file = file
+        self.mode = mode
+        self._map = None
+        self._count = 0
+        if mode == "w":
+            self._fd = os.open(file, os.O_RDWR | os.O_CREAT, 0o644)
+            if fcntl is not None:
+                try:
+                    fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    os.close(self._fd)
+                    raise StoreLockedError("`%s`已有写入方" % file)
+            if os.fstat(self._fd).st_size < HEADER_SIZE:    # 新文件
+                os.pwrite(self._fd, struct.pack(HEADER_FORMAT, MAGIC, 1, ROW_DTYPE.itemsize, 0).ljust(HEADER_SIZE, b"\0"), 0)
+            self._count = self._read_count()
+            os.ftruncate(self._fd, HEADER_SIZE + self._count * ROW_DTYPE.itemsize)    # 截去未提交的部分
+        else:
+            self._fd = os.open(file, os.O_RDONLY)
+            self._read_count()
+        self.refresh()
+
+    def _read_count(self):
+        """读取文件头，返回已提交行数"""
+
+        magic, _, row_size, count = struct.unpack(HEADER_FORMAT, os.pread(self._fd, struct.calcsize(HEADER_FORMAT), 0))
+        if magic != MAGIC or row_size != ROW_DTYPE.itemsize:
+            raise ValueError("`%s`不是有效的K线存储文件" % self.file)
+        return count
+
+    def refresh(self):
+        """读取最新的已提交行数，文件增长后重新映射
+
+        returns: 已提交行数
+        """
+
+        if self.mode == "r":
+            self._count = self._read_count()
+        mapped = len(self._map) if self._map is not None else 0
+        if self._count > mapped or self._map is None:
+            rows = (os.fstat(self._fd).st_size - HEADER_SIZE) // ROW_DTYPE.itemsize
+            if rows > 0:
+                self._map = np.memmap(self.file, dtype=ROW_DTYPE, mode="r", offset=HEADER_SIZE, shape=(rows,))
+        return self._count
+
+    def append(self, items):
+        """追加币安K线格式的数据 (开盘时间不晚于已有数据的K线将被忽略)
+
+        returns: 追加的行数
+        """
+
+        if not items:
+            return 0
+        return self.append_table(np.array([item[:len(klines.COLUMNS)] for item in items], dtype=np.float64))
+
+    def append_table(self, table):
+        """追加二维数组 (行为K线，列为`klines.COLUMNS`中的字段)
+
+        returns: 追加的行数
+        """
+
+        if self.mode != "w":
+            raise ValueError("`%s`以只读方式打开" % self.file)
+        last = self.last_timestamp
+        if last is not None:
+            table = table[table[:, 0] > last]
+        if not len(table):
+            return 0
+        rows = np.zeros(len(table), dtype=ROW_DTYPE)
+        for i, (name, _) in enumerate(klines.COLUMNS):
+            rows[name] = table[:, i]
+
+        # 先写入行数据，再提交行数
+        os.pwrite(self._fd, rows.tobytes(), HEADER_SIZE + self._count * ROW_DTYPE.itemsize)
+        self._count += len(rows)
+        os.pwrite(self._fd, struct.pack("<q", self._count), COUNT_OFFSET)
+        self.refresh()
+        return len(rows)
+
+    def clear(self):
+        """清空已提交的行 (文本数据文件被整理重写后重建)；文件不截短，避免读取方的内存映射越界"""
+
+        if self.mode != "w":
+            raise ValueError("`%s`以只读方式打开" % self.file)
+        self._count = 0
+        os.pwrite(self._fd, struct.pack("<q", 0), COUNT_OFFSET)
+
+    @property
+    def last_timestamp(self):
+        """最后一行的开盘时间，无数据时为None"""
+        if not self._count:
+            return None
+        return int(self._map["open_time"][self._count - 1])
+
+    def column(self, name):
+        """获取已提交数据中一列的只读视图"""
+        if self._map is None:
+            return np.empty(0, dtype=ROW_DTYPE[name])
+        return self._map[name][:self._count]
+
+    def __getitem__(self, name):
+        return self.column(name)
+
+    def __getattr__(self, name):
+        if name in klines.COLUMN_INDICES:
+            return self.column(name)
+        raise AttributeError(name)
+
+    def __len__(self):
+        return self._count
+
+    def release(self):
+        """关闭文件 (`close`为收盘价列)"""
+        self._map = None
+        if self._fd is not None:
+            os.close(self._fd)    # 关闭文件的同时释放写入锁
+            self._fd = None
+
+
+def get_file(symbol, data_dir="data", interval="1m"):
+    return "%s/%s.%s.store" % (data_dir, symbol, interval)
+
+
+def open_reader(symbol, data_dir="data", interval="1m"):
+    """以读取方打开币种的存储，不存在时返回None"""
+
+    file = get_file(symbol, data_dir, interval)
+    if not os.path.exists(file):
+        return None
+    return KlineStore(file, "r")
+
+
+def read_text_after(text_file, timestamp=None):
+    """从文本数据文件 (按开盘时间升序) 的末尾向前按块读取，只解析开盘时间晚于`timestamp`的K线
+
+    returns: 二维数组 (列为`klines.COLUMNS`中的字段)，`timestamp`为None时为全部K线
+    """
+
+    with open(text_file, "rb") as f:
+        pos = f.seek(0, os.SEEK_END)
+        data = b""
+        while pos > 0:
+            start = max(pos - TAIL_BLOCK, 0) if timestamp is not None else 0
+            f.seek(start)
+            data = f.read(pos - start) + data
+            pos = start
+            lines = data.split(b"\n", 2)    # 块的首行可能不完整，以第二行判断
+            if pos > 0 and len(lines) == 3 and int(lines[1].split(b"\t", 1)[0]) <= timestamp:
+                break
+    lines = data.split(b"\n")[1 if pos > 0 else 0:]
+    if timestamp is not None:
+        lines = [line for line in lines if line and int(line.split(b"\t", 1)[0]) > timestamp]
+    lines = [line.decode("utf-8") for line in lines if line]
+    if not lines:
+        return np.empty((0, len(klines.COLUMNS)))
+    return np.loadtxt(lines, delimiter="\t", usecols=range(len(klines.COLUMNS)), dtype=np.float64, ndmin=2)
+
+
+_writers = {}
+_locked = {}    # 其他进程持有写入方的存储 -> 上一次尝试的时间
+
+
+def get_writer(symbol, data_dir="data", interval="1m"):
+    """获取 (并缓存) 本进程对币种存储的写入方，首次打开时从文本数据文件补齐存储之后的K线；
+    其他进程持有写入方时返回None，每`LOCK_RETRY_INTERVAL`秒重新尝试
+    """
+
+    file = get_file(symbol, data_dir, interval)
+    if file not in _writers:
+        if time.time() - _locked.get(file, -LOCK_RETRY_INTERVAL) < LOCK_RETRY_INTERVAL:
+            return None
+        try:
+            writer = KlineStore(file, "w")
+        except StoreLockedError:
+            _locked[file] = time.time()
+            return None
+        _locked.pop(file, None)
+        text_file = "%s/%s.%s.data" % (data_dir, symbol, interval)
+        if os.path.exists(text_file):
+            writer.append_table(read_text_after(text_file, writer.last_timestamp))
+        _writers[file] = writer
+    return _writers[file]
+
+
+def sync(symbol, data_dir="data", interval="1m", items=None, rebuild=False, keep=False):
+    """将文本数据文件的新数据同步到存储
+
+    items: 刚追加到文件的K线，为空时从文件末尾读取存储之后的K线
+    rebuild: 文件被整理重写 (中间插入了补齐的K线) 时为True，清空存储后重新写入
+    keep: 保留写入方 (如监控中的币种每分钟同步，移出监控时由`close_writer`释放)；否则本次新打开的写入方同步后即释放
+    其他进程持有写入方时跳过 (由该进程打开写入方时补齐)
+    returns: 同步的行数
+    """
+
+    file = get_file(symbol, data_dir, interval)
+    opened = file in _writers
+    writer = get_writer(symbol, data_dir, interval)
+    if writer is None:
+        return 0
+    try:
+        if rebuild:
+            writer.clear()
+        elif items is not None:
+            return writer.append(items)
+        text_file = "%s/%s.%s.data" % (data_dir, symbol, interval)
+        if not os.path.exists(text_file):
+            return 0
+        return writer.append_table(read_text_after(text_file, writer.last_timestamp))
+    finally:
+        if not opened and not keep:
+            close_writer(symbol, data_dir, interval)
+
+
+def close_writer(symbol, data_dir="data", interval="1m"):
+    """释放本进程对币种存储的写入方 (关闭文件与写入锁)，如币种移出监控时"""
+
+    file = get_file(symbol, data_dir, interval)
+    writer = _writers.pop(file, None)
+    if writer is not None:
+        writer.release()
+    _locked.pop(file, None)
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) < 3:
+        print("Usage: python3 store.py [data_dir] [symbol]        e.g. python3 store.py data BTCUSDT")
+        sys.exit(-1)
+
+    # 以读取方跟踪监控程序写入的最新K线
+    reader = open_reader(sys.argv[2], data_dir=sys.argv[1])
+    if reader is None:
+        print("`%s`尚无存储文件，运行监控程序后自动创建" % get_file(sys.argv[2], sys.argv[1]))
+        sys.exit(-1)
+    count = 0
+    while True:
+        if reader.refresh() > count:
+            count = len(reader)
+            print("%s --- %s, %d条, 收盘价%s, 成交额%.0f" % (
+                utils.tic2time(reader.open_time[-1]),
+                sys.argv[2],
+                count,
+                utils.standardize(float(reader.close[-1])),
+                reader.quote_volume[-1],
+            ))
+        time.sleep(1)
@@ -0,0 +1,264 @@
+# 秒级的急涨急跌检测：按归集成交ID增量获取最活跃币种的成交 (aggTrades)，流式合成5秒K线，
+# 在K线收盘时检查价格与交易额的突变，无需等待1分钟K线收盘；原始成交合成后即丢弃，内存占用固定
+
+import sys
+import time
+import collections
+
+import binance
+import data_loader
+import scheduler
+import utils
+
+
+BAR_SECONDS = 5    # 秒级K线的周期
+KEEP_BARS = 720    # 每个币种保留的秒级K线数量 (5秒K线即最近1小时)
+POLL_INTERVAL = 2    # 成交的轮询间隔 (秒)
+MAX_SYMBOLS = 10    # 同时跟踪成交的币种数量上限
+TRACK_MARGIN = 0.1    # 已跟踪的币种在选择时的活跃度加成，新币种须高出该值才能替换 (避免在边界反复进出而丢失状态)
+PAGE_LIMIT = 1000    # 每次请求的成交数量 (接口上限)
+MAX_PAGES = 3    # 每次轮询每个币种最多请求的页数，剩余的成交在下次轮询中获取
+SETTLE_DELAY = 1000    # 秒级K线结束后等待迟到成交的时长 (毫秒)，之后无新成交也视为收盘
+
+PRICE_WINDOW = 60    # 价格突变的检查窗口 (秒)
+PRICE_SURGE = 0.015    # 窗口内相对最低价的涨幅 (或相对最高价的跌幅) 达到该值时提示
+VOLUME_SURGE = 10    # 单根秒级K线的交易额达到平均值的该倍数时提示
+MIN_VOLUME = 100000    # 交易额突增的最低交易额 (美元)
+COOLDOWN = 120    # 同一币种同类提示的冷却时间 (秒)
+
+
+class TradeBars:
+    """由逐笔成交流式合成的秒级K线
+
+    每根K线为 (开盘时间, 开盘价, 最高价, 最低价, 收盘价, 成交额, 成交笔数, 主动买入成交额)；
+    没有成交的周期以上一收盘价补齐 (成交额为0)，保证按位置计算时间窗口
+    """
+
+    def __init__(self, symbol, bar_seconds=BAR_SECONDS, keep=KEEP_BARS):
+        self.symbol = symbol
+        self.unit = bar_seconds * data_loader.TIMESTAMP_UNIT
+        self.bars = collections.deque(maxlen=keep)    # 已收盘的K线
+        self.current = None    # 未收盘的K线 (列表)
+        self.next_open_time = None    # 下一根K线的开盘时间 (首笔成交之前为None)
+        self.last_close = None
+
+    def add(self, tic, price, quantity, is_sell):
+        """并入一笔成交 (`is_sell`为主动卖出)
+
+        returns: 因此收盘的K线
+        """
+
+        open_time = tic // self.unit * self.unit
+        if self.next_open_time is not None:    # 迟到的成交计入当前 (或下一根) K线
+            open_time = max(open_time, self.next_open_time)
+        closed = self._advance(open_time)
+        quote = price * quantity
+        if self.current is None:
+            self.current = [open_time, price, price, price, price, 0.0, 0, 0.0]
+        bar = self.current
+        bar[2] = max(bar[2], price)
+        bar[3] = min(bar[3], price)
+        bar[4] = price
+        bar[5] += quote
+        bar[6] += 1
+        if not is_sell:
+            bar[7] += quote
+        return closed
+
+    def close_until(self, tic):
+        """时间推进至`tic`：已结束 (并留出迟到成交的等待时间) 的K线即使没有新成交也予以收盘
+
+        returns: 收盘的K线
+        """
+
+        return self._advance((tic - SETTLE_DELAY) // self.unit * self.unit)
+
+    def _advance(self, open_time):
+        """收盘`open_time`之前的当前K线，并以上一收盘价补齐空白周期 (最多补齐保留的数量)
+
+        returns: 收盘的K线
+        """
+
+        closed = []
+        if self.current is not None:
+            if self.current[0] >= open_time:
+                return closed
+            closed.append(tuple(self.current))
+            self.last_close = self.current[4]
+            self.next_open_time = self.current[0] + self.unit
+            self.current = None
+        if self.next_open_time is not None and open_time > self.next_open_time:
+            gap = (open_time - self.next_open_time) // self.unit
+            price = self.last_close
+            for i in range(max(gap - self.bars.maxlen, 0), gap):
+                closed.append((self.next_open_time + i * self.unit, price, price, price, price, 0.0, 0, 0.0))
+            self.next_open_time = open_time
+        self.bars.extend(closed)
+        return closed
+
+
+class TradeFeed:
+    """跟踪最活跃币种的成交，合成秒级K线并检查突变
+
+    - `poll(symbols)`在主循环中调用，每`POLL_INTERVAL`秒按上次的归集成交ID增量请求`symbols`的成交，
+      `select(scores)`按活跃度选择跟踪的币种
+    - 每个币种每次轮询1~`MAX_PAGES`次请求，即每分钟至少`60 / POLL_INTERVAL * max_symbols`次 (默认300次)
+    - 时间以服务器时间为准 (与成交时间比较)；达到`MAX_PAGES`时只合成已获取的成交，剩余成交所在的K线暂不收盘
+    - 新加入的币种从最新成交开始 (不回补历史成交)，移出的币种释放状态
+    - 检测到突变时调用`on_surge(symbol, kind, value, bar)`，kind为"rise"/"drop"/"volume"
+    """
+
+    def __init__(self, on_surge=None, baselines=None, bar_seconds=BAR_SECONDS, max_symbols=MAX_SYMBOLS, clock=None):
+        self.on_surge = on_surge
+        self.baselines = baselines    # baselines(symbol) 返回每分钟的平均交易额 (如`monitor.ma_7h_volume`)，为空时以近期秒级K线的均值为准
+        self.bar_seconds = bar_seconds
+        self.max_symbols = max_symbols
+        self.clock = clock or scheduler.ServerClock()
+        self.bars = {}    # symbol -> TradeBars
+        self.last_ids = {}    # symbol -> 已处理的最新归集成交ID
+        self.last_alarm_tics = {}    # (symbol, kind) -> 上一次提示时间
+        self.last_poll_tic = -1
+        self.stats = {"requests": 0, "trades": 0, "bars": 0, "surges": 0}
+
+    def poll(self, symbols, executor=None):
+        """增量获取成交并合成秒级K线，`executor`不为空时并发请求各币种
+
+        returns: 本次收盘的秒级K线数量, 请求次数
+        """
+
+        if time.time() - self.last_poll_tic < POLL_INTERVAL:
+            return 0, 0
+        self.last_poll_tic = time.time()
+        symbols = list(symbols)[:self.max_symbols]
+        for symbol in list(self.bars):
+            if symbol not in symbols:
+                self.remove(symbol)
+
+        # 请求 (网络请求可并发)，合成在主线程中依次进行
+        fetch = lambda symbol: self._fetch(symbol, self.last_ids.get(symbol))
+        results = list(executor.map(fetch, symbols)) if executor is not None else [fetch(symbol) for symbol in symbols]
+        now = self.clock.now()
+        count = 0
+        total_requests = 0
+        for symbol, (trades, requests, complete) in zip(symbols, results):
+            total_requests += requests
+            bars = self.bars.get(symbol)
+            if bars is None:
+                bars = self.bars[symbol] = TradeBars(symbol, self.bar_seconds)
+            if symbol not in self.last_ids:    # 首次请求只取得起始ID
+                if trades:
+                    self.last_ids[symbol] = trades[-1]["a"]
+                continue
+            closed = []
+            for trade in trades:
+                closed += bars.add(trade["T"], float(trade["p"]), float(trade["q"]), trade["m"])
+            if trades:
+                self.last_ids[symbol] = trades[-1]["a"]
+                self.stats["trades"] += len(trades)
+            if complete:    # 尚有未获取的成交时，其所在的K线不能收盘
+                closed += bars.close_until(now)
+            for bar in closed:
+                self._check(symbol, bars, bar)
+            count += len(closed)
+        self.stats["bars"] += count
+        self.stats["requests"] += total_requests
+        return count, total_requests
+
+    def select(self, scores):
+        """按活跃度选择跟踪的币种：已跟踪的币种有`TRACK_MARGIN`的加成
+
+        scores: {symbol: 活跃度}
+        returns: 活跃度最高的`max_symbols`个币种
+        """
+
+        key = lambda symbol: -scores[symbol] - (TRACK_MARGIN if symbol in self.bars else 0)
+        return sorted(scores, key=key)[:self.max_symbols]
+
+    def remove(self, symbol):
+        """停止跟踪币种"""
+
+        self.bars.pop(symbol, None)
+        self.last_ids.pop(symbol, None)
+
+    def _fetch(self, symbol, last_id):
+        """returns: 成交列表, 请求次数, 是否已获取截至当前的全部成交"""
+
+        api = binance.get_instance()
+        if last_id is None:
+            err, trades = api.get_historical_trades(symbol, limit=1)
+            return (trades if err is None and isinstance(trades, list) else []), 1, False
+        trades = []
+        requests = 0
+        for _ in range(MAX_PAGES):
+            err, page = api.get_historical_trades(symbol, limit=PAGE_LIMIT, fromId=last_id + 1)
+            requests += 1
+            if err is not None or not isinstance(page, list):
+                return trades, requests, False
+            trades += page
+            if len(page) < PAGE_LIMIT:
+                return trades, requests, True
+            last_id = page[-1]["a"]
+        return trades, requests, False
+
+    def _check(self, symbol, bars, bar):
+        """秒级K线收盘时检查价格与交易额的突变"""
+
+        start = bar[0] - PRICE_WINDOW * data_loader.TIMESTAMP_UNIT
+        window = [item for item in bars.bars if start < item[0] <= bar[0]]    # 一次收盘多根K线时不含之后的K线
+        low = min(item[3] for item in window)
+        high = max(item[2] for item in window)
+        if bar[4] / low - 1 >= PRICE_SURGE:
+            self._fire(symbol, "rise", bar[4] / low - 1, bar)
+        elif 1 - bar[4] / high >= PRICE_SURGE:
+            self._fire(symbol, "drop", 1 - bar[4] / high, bar)
+
+        # 交易额：与每分钟平均交易额折算的每根K线均值比较
+        baseline = self.baselines(symbol) if self.baselines is not None else None
+        if baseline:
+            baseline *= self.bar_seconds / 60
+        elif len(bars.bars) > 60:
+            baseline = (sum(item[5] for item in bars.bars) - bar[5]) / (len(bars.bars) - 1)
+        if baseline and bar[5] >= MIN_VOLUME and bar[5] >= baseline * VOLUME_SURGE:
+            self._fire(symbol, "volume", bar[5] / baseline, bar)
+
+    def _fire(self, symbol, kind, value, bar):
+        """同一币种同类提示每`COOLDOWN`秒最多一次"""
+
+        if time.time() - self.last_alarm_tics.get((symbol, kind), -COOLDOWN - 1) <= COOLDOWN:
+            return
+        self.last_alarm_tics[(symbol, kind)] = time.time()
+        self.stats["surges"] += 1
+        if self.on_surge is not None:
+            self.on_surge(symbol, kind, value, bar)
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) < 2:
+        print("Usage: python3 trades.py [symbol ...]        e.g. python3 trades.py BTCUSDT ETHUSDT")
+        sys.exit(-1)
+
+    # 独立运行时以近期秒级K线的均值为交易额基准
+    def print_surge(symbol, kind, value, bar):
+        print("%s >>> %s, $%s, %s" % (
+            utils.tic2time(bar[0] + BAR_SECONDS * data_loader.TIMESTAMP_UNIT),
+            symbol,
+            utils.standardize(bar[4]),
+            "交易额突增%.1f倍" % value if kind == "volume" else "%d秒内价格%s%.1f%%" % (
+                PRICE_WINDOW, "上涨" if kind == "rise" else "下跌", value * 100),
+        ))
+
+    feed = TradeFeed(on_surge=print_surge)
+    last_report_tic = time.time()
+    while True:
+        feed.poll(sys.argv[1:])
+        if time.time() - last_report_tic > 600:
+            last_report_tic = time.time()
+            print("%s --- 请求%d次, 成交%d笔, 秒级K线%d根, 突变提示%d次" % (
+                utils.tic2time(time.time()),
+                feed.stats["requests"],
+                feed.stats["trades"],
+                feed.stats["bars"],
+                feed.stats["surges"],
+            ))
+        time.sleep(0.5)
@@ -0,0 +1,299 @@
+# 动态监控范围：发现可交易币种，按7日均交易额维护头部排名，增删监控
+
+import os
+import json
+import time
+import heapq
+import queue
+import threading
+
+import binance
+import data_loader
+import utils
+
+
+# 不纳入监控的基础资产 (稳定币/法币)
+EXCLUDED_ASSETS = {"USDC", "BUSD", "TUSD", "USDP", "PAX", "DAI", "FDUSD", "EUR", "GBP", "AUD"}
+
+# 杠杆代币后缀 (看涨币/看跌币)
+LEVERAGED_SUFFIXES = ("UP", "DOWN", "BULL", "BEAR")
+
+
+def get_symbols(quote_asset="USDT", cache_file="data/exchange_info.json", max_age=24 * 60 * 60):
+    """获取所有可交易的现货交易对，交易对信息在本地缓存`max_age`秒
+
+    returns: None, ["BTCUSDT", "ETHUSDT", ...]
+    """
+
+    # 读取本地缓存
+    exchange_info = None
+    if os.path.exists(cache_file) and time.time() - os.path.getmtime(cache_file) < max_age:
+        with open(cache_file, encoding="utf-8") as f:
+            exchange_info = json.load(f)
+
+    # 请求并写入缓存
+    if exchange_info is None:
+        err, exchange_info = binance.get_instance().get_exchange_info()
+        if err is not None:
+            return "获取可交易币种失败: %s" % err, None
+        if "symbols" not in exchange_info:
+            return "获取可交易币种失败: %s" % exchange_info.get("msg"), None
+        utils.mkdir(os.path.dirname(cache_file) or ".")
+        with open(cache_file, "w", encoding="utf-8") as f:
+            json.dump(exchange_info, f)
+
+    symbols = []
+    for item in exchange_info["symbols"]:
+        if item["status"] != "TRADING" or item["quoteAsset"] != quote_asset:
+            continue
+        if not item.get("isSpotTradingAllowed", True):
+            continue
+        base_asset = item["baseAsset"]
+        if base_asset in EXCLUDED_ASSETS or (base_asset.endswith(LEVERAGED_SUFFIXES) and len(base_asset) > 4):
+            continue
+        symbols.append(item["symbol"])
+    return None, symbols
+
+
+class TopN:
+    """基于堆的头部排名，分数变化时增量调整
+
+    - 头部成员存于最小堆，其余候选存于最大堆，比较两堆堆顶即可完成换位
+    - 分数更新时只压入新记录，旧记录在出堆时按版本号识别并丢弃 (惰性删除)
+    """
+
+    def __init__(self, n):
+        self.n = n
+        self.scores = {}    # symbol -> 分数
+        self.members = set()    # 头部成员
+        self._versions = {}    # symbol -> 版本号，用于识别堆中的过期记录
+        self._counter = 0    # 全局递增的版本号
+        self._top = []    # 最小堆 (score, version, symbol)
+        self._rest = []    # 最大堆 (-score, version, symbol)
+
+    def update(self, symbol, score):
+        """更新分数
+
+        returns: added, removed (进入/退出头部的币种)
+        """
+
+        self._counter += 1
+        version = self._counter
+        self._versions[symbol] = version
+        self.scores[symbol] = score
+        if symbol in self.members:
+            heapq.heappush(self._top, (score, version, symbol))
+        else:
+            heapq.heappush(self._rest, (-score, version, symbol))
+        return self._rebalance()
+
+    def remove(self, symbol):
+        """移除币种
+
+        returns: added, removed
+        """
+
+        if symbol not in self.scores:
+            return [], []
+        self.scores.pop(symbol)
+        self._versions.pop(symbol)
+        removed = []
+        if symbol in self.members:
+            self.members.remove(symbol)
+            removed.append(symbol)
+        added, removed_ = self._rebalance()
+        return added, removed + removed_
+
+    def ranking(self):
+        """按分数从高到低排列的头部成员"""
+        return sorted(self.members, key=lambda symbol: self.scores[symbol], reverse=True)
+
+    def _peek(self, heap):
+        """丢弃过期记录后返回堆顶，堆为空时返回None"""
+
+        while heap:
+            _, version, symbol = heap[0]
+            if self._versions.get(symbol) == version and (symbol in self.members) == (heap is self._top):
+                return heap[0]
+            heapq.heappop(heap)
+        return None
+
+    def _rebalance(self):
+        """补足头部成员，并将候选中分数更高者与头部末位换位"""
+
+        added = []
+        removed = []
+
+        # 补足头部
+        while len(self.members) < self.n:
+            item = self._peek(self._rest)
+            if item is None:
+                break
+            heapq.heappop(self._rest)
+            self._promote(item[2])
+            added.append(item[2])
+
+        # 换位
+        while True:
+            worst = self._peek(self._top)
+            best = self._peek(self._rest)
+            if worst is None or best is None or -best[0] <= worst[0]:
+                break
+            heapq.heappop(self._top)
+            heapq.heappop(self._rest)
+            self.members.remove(worst[2])
+            heapq.heappush(self._rest, (-worst[0], worst[1], worst[2]))
+            self._promote(best[2])
+            removed.append(worst[2])
+            added.append(best[2])
+
+        # 过期记录过多时重建堆
+        if len(self._top) + len(self._rest) > 4 * len(self.scores) + 64:
+            self._rebuild()
+
+        # 同一次调整中先进后出 (或先出后进) 的币种互相抵消
+        both = set(added) & set(removed)
+        added = [symbol for symbol in added if symbol not in both or symbol in self.members]
+        removed = [symbol for symbol in removed if symbol not in both or symbol not in self.members]
+        return added, removed
+
+    def _promote(self, symbol):
+        self.members.add(symbol)
+        heapq.heappush(self._top, (self.scores[symbol], self._versions[symbol], symbol))
+
+    def _rebuild(self):
+        self._top = [(self.scores[s], self._versions[s], s) for s in self.members]
+        self._rest = [(-self.scores[s], self._versions[s], s) for s in self.scores if s not in self.members]
+        heapq.heapify(self._top)
+        heapq.heapify(self._rest)
+
+
+class Universe:
+    """动态维护的监控范围
+
+    - 以7日均交易额 (每分钟) 为分数维护头部`n`个币种
+    - 监控中的币种随K线更新分数；其余候选由全市场24小时行情定期估算分数
+    - 新进入头部的币种在后台线程中补齐历史数据并创建监控，退出头部的币种移除监控
+    """
+
+    def __init__(
+        self,
+        n,                                      # 头部数量
+        factory,                                # 创建监控的函数 factory(symbol)，数据不足时返回None
+        on_add=None,                            # 监控加入时的回调 on_add(symbol, monitor)
+        on_remove=None,                         # 监控移除时的回调 on_remove(symbol, monitor)
+        refresh_interval=60 * 60,               # 刷新可交易币种及候选分数的间隔 (秒)
+        verbosity=1,
+    ):
+        self.ranking = TopN(n)
+        self.factory = factory
+        self.on_add = on_add
+        self.on_remove = on_remove
+        self.refresh_interval = refresh_interval
+        self.verbosity = verbosity
+
+        self.monitors = {}    # 监控中的币种 symbol -> monitor
+        self.symbols = set()    # 可交易币种
+        self._score_tics = {}    # 候选分数的估算时间
+        self._scheduled = set()    # 等待或正在创建监控的币种
+        self._todo = queue.Queue()
+        self._ready = queue.Queue()
+        self._last_refresh_tic = time.time()
+        threading.Thread(target=self._work, daemon=True).start()
+
+    def seed(self, monitors):
+        """以已创建的监控初始化排名，头部之外的监控直接丢弃"""
+
+        for symbol, monitor in monitors.items():
+            self.symbols.add(symbol)
+            self.ranking.update(symbol, monitor.ma_7d_volume)
+        for symbol in self.ranking.members:
+            self._activate(symbol, monitors[symbol])
+
+    def update(self, symbol, score):
+        """更新监控中币种的分数"""
+
+        self._apply(*self.ranking.update(symbol, score))
+
+    def poll(self):
+        """在主循环中调用：接入后台创建完成的监控，并定期刷新可交易币种"""
+
+        while not self._ready.empty():
+            symbol, monitor = self._ready.get()
+            self._scheduled.discard(symbol)
+            if monitor is None:    # 历史数据不足，暂不参与排名，等待下次刷新
+                self._apply(*self.ranking.remove(symbol))
+                continue
+            if symbol in self.ranking.members:
+                self._activate(symbol, monitor)
+            self.update(symbol, monitor.ma_7d_volume)
+
+        if time.time() - self._last_refresh_tic > self.refresh_interval:
+            self._last_refresh_tic = time.time()
+            self.refresh()
+
+    def refresh(self):
+        """刷新可交易币种，并以24小时交易额估算候选币种的7日均交易额"""
+
+        err, symbols = get_symbols()
+        if err is not None:
+            if self.verbosity:
+                print(err)
+            return
+        symbols = set(symbols)
+
+        # 移除下架币种
+        for symbol in self.symbols - symbols:
+            self._apply(*self.ranking.remove(symbol))
+        self.symbols = symbols
+
+        # 估算候选分数：按距上次估算的时间占7天的比例，向24小时均值靠拢
+        err, markets = binance.get_instance().get_price_change(None, interval="24hr")
+        if err is not None or not isinstance(markets, list):
+            return
+        now = time.time()
+        for market in markets:
+            symbol = market["symbol"]
+            if symbol not in symbols or symbol in self.monitors:
+                continue
+            score = float(market["quoteVolume"]) / data_loader.DAY
+            if symbol in self.ranking.scores:
+                ratio = min((now - self._score_tics.get(symbol, now)) / (7 * 24 * 60 * 60), 1)
+                score = self.ranking.scores[symbol] + (score - self.ranking.scores[symbol]) * ratio
+            self._score_tics[symbol] = now
+            self._apply(*self.ranking.update(symbol, score))
+
+    def _apply(self, added, removed):
+        """处理排名变动"""
+
+        for symbol in removed:
+            monitor = self.monitors.pop(symbol, None)
+            if monitor is not None:
+                if self.verbosity:
+                    print("%s --- 移出监控: %s" % (utils.tic2time(time.time()), symbol))
+                if self.on_remove:
+                    self.on_remove(symbol, monitor)
+        for symbol in added:
+            if symbol not in self.monitors and symbol not in self._scheduled:
+                self._scheduled.add(symbol)
+                self._todo.put(symbol)
+
+    def _activate(self, symbol, monitor):
+        self.monitors[symbol] = monitor
+        if self.verbosity:
+            print("%s --- 加入监控: %s" % (utils.tic2time(time.time()), symbol))
+        if self.on_add:
+            self.on_add(symbol, monitor)
+
+    def _work(self):
+        """后台线程：逐一补齐历史数据并创建监控"""
+
+        while True:
+            symbol = self._todo.get()
+            try:
+                monitor = self.factory(symbol)
+            except Exception as e:
+                if self.verbosity:
+                    print("创建%s监控失败: %s" % (symbol, e))
+                monitor = None
+            self._ready.put((symbol, monitor))
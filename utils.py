@@ -1,6 +1,5 @@
 import os
 import time
-import numpy as np
 
 
 def mkdir(path, clear_existing_files=False):
@@ -104,6 +103,7 @@ def time2tic(year, month, day, hour, minute, second):
 
 def get_diagnal_corr(prices):
     """获取资产价格和时间的相关性"""
+    import numpy as np
 
     max_price = max(prices)
     min_price = min(prices)
@@ -0,0 +1,144 @@
+# 多分辨率的滑动窗口：近期数据保留分钟粒度，较早的数据按小时汇总
+
+import sys
+import array
+import random
+import collections
+
+import data_loader
+
+
+MINUTE_MS = 60 * data_loader.TIMESTAMP_UNIT
+
+class MultiResolutionWindow:
+    """多分辨率的滑动窗口，用于计算长周期均值
+
+    - 最近`recent`个数据点保留原始值，支持`window[-i]`读取，`short_windows`中各窗口的均值与逐点计算完全一致
+    - 更早的数据按每`bucket`分钟汇总为桶，桶内分钟值以数组紧凑保存 (每分钟9字节，而非Python浮点数的列表)；
+      长窗口之和随新数据累加，窗口起点所在的桶逐分钟扣除移出窗口的值，均值与`long_window`分钟内的逐点均值一致
+      (窗口为最新时间戳之前`long_window`分钟，分母为实际数据点数)
+    - 桶按时间戳划分，数据缺失的分钟不会导致窗口错位
+
+    以7日窗口为例，每个币种只需保存约430个Python浮点数，其余10080个分钟值按168个小时桶紧凑保存
+    """
+
+    def __init__(
+        self,
+        short_windows=(7, 420),                 # 保留原始值计算的窗口 (分钟)
+        long_window=data_loader.DAY * 7,        # 按桶汇总计算的窗口 (分钟)
+        bucket=data_loader.HOUR,                # 桶的大小 (分钟)
+        recent=None,                            # 保留原始值的数量，默认为最大短窗口加10
+    ):
+        self.short_windows = short_windows
+        self.long_window = long_window
+        self.bucket_ms = bucket * 60 * data_loader.TIMESTAMP_UNIT
+        self.long_window_ms = long_window * 60 * data_loader.TIMESTAMP_UNIT
+        self.recent = collections.deque(maxlen=recent or max(short_windows) + 10)
+
+        self.short_sums = {window: 0.0 for window in short_windows}    # 各短窗口之和
+        self.buckets = collections.deque()    # 窗口内的桶 (最后一个为当前未满的桶) [桶起始时间戳, 桶内分钟序号, 分钟值]
+        self.edge = 0    # 第一个桶中已移出窗口的分钟数
+        self.long_sum = 0.0    # 长窗口之和
+        self.long_count = 0    # 长窗口的数据点数
+
+    @classmethod
+    def from_history(cls, tics, values, **kwargs):
+        """由历史数据创建"""
+
+        window = cls(**kwargs)
+        for tic, value in zip(tics, values):
+            window.append(tic, value)
+        return window
+
+    def append(self, tic, value):
+        """追加一个分钟数据点"""
+
+        # 短窗口：加新值，减去移出窗口的旧值
+        n = len(self.recent)
+        for window in self.short_windows:
+            if n >= window:
+                self.short_sums[window] -= self.recent[-window]
+            self.short_sums[window] += value
+        self.recent.append(value)
+
+        # 长窗口：按桶保存分钟值
+        bucket_tic = int(tic) // self.bucket_ms * self.bucket_ms
+        if not self.buckets or bucket_tic > self.buckets[-1][0]:
+            self.buckets.append([bucket_tic, array.array("B"), array.array("d")])
+        bucket = self.buckets[-1]
+        bucket[1].append((int(tic) - bucket_tic) // MINUTE_MS)
+        bucket[2].append(value)
+        self.long_sum += value
+        self.long_count += 1
+
+        # 扣除移出窗口的分钟 (窗口起点之前的整桶直接丢弃，起点所在的桶逐分钟扣除)
+        start = int(tic) - self.long_window_ms
+        while self.buckets:
+            bucket_tic, minutes, values = self.buckets[0]
+            while self.edge < len(values) and bucket_tic + minutes[self.edge] * MINUTE_MS <= start:
+                self.long_sum -= values[self.edge]
+                self.long_count -= 1
+                self.edge += 1
+            if self.edge < len(values):
+                break
+            self.buckets.popleft()
+            self.edge = 0
+        if not self.long_count:    # 窗口为空时清零，避免累积的浮点误差
+            self.long_sum = 0.0
+
+    def mean(self, window):
+        """窗口均值，`window`为`short_windows`之一或`long_window`"""
+
+        if window in self.short_sums:
+            return self.short_sums[window] / window
+        if window == self.long_window:
+            if self.long_count == 0:
+                return None
+            return self.long_sum / self.long_count
+        raise ValueError("unsupported window: %s" % window)
+
+    def __getitem__(self, i):
+        return self.recent[i]
+
+    def __len__(self):
+        return len(self.recent)
+
+    @property
+    def nbytes(self):
+        """占用的内存 (字节，含Python对象开销)"""
+
+        nbytes = sys.getsizeof(self.recent) + sum(sys.getsizeof(v) for v in self.recent)
+        nbytes += sys.getsizeof(self.buckets)
+        for bucket in self.buckets:
+            nbytes += sys.getsizeof(bucket) + sum(sys.getsizeof(v) for v in bucket)
+        return nbytes
+
+
+def check_long_mean(n=data_loader.DAY * 10, gap_rate=0.01, every=37, **kwargs):
+    """每`every`分钟与逐点计算的长窗口均值比较一次 (随机缺失部分分钟)，返回最大相对误差"""
+
+    window = MultiResolutionWindow(**kwargs)
+    tics = []
+    values = []
+    tic = 0
+    max_error = 0.0
+    for i in range(n):
+        tic += MINUTE_MS * (2 if random.random() < gap_rate else 1)
+        value = random.uniform(1, 100)
+        window.append(tic, value)
+        tics.append(tic)
+        values.append(value)
+        if i % every:
+            continue
+        expected = [v for t, v in zip(tics, values) if t > tic - window.long_window_ms]
+        expected = sum(expected) / len(expected)
+        max_error = max(max_error, abs(window.mean(window.long_window) - expected) / expected)
+    return max_error
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) < 2:
+        print("Usage: python3 window.py [minutes]        e.g. python3 window.py 20000")
+        sys.exit(-1)
+    print("长窗口均值的最大相对误差: %.2e" % check_long_mean(n=int(sys.argv[1])))